@@ -1,12 +1,30 @@
+import time
+moduleImportStart = time.perf_counter()
 import os
-import unittest
 import vtk, qt, ctk, slicer
 from slicer.ScriptedLoadableModule import *
 import logging
-import sitkUtils
-import SimpleITK as sitk
-from qt import QWidget, QLabel, QPushButton, QCheckBox, QRadioButton, QSpinBox, QTimer, QButtonGroup, QGroupBox
-from qt import QVBoxLayout, QHBoxLayout, QGridLayout, QFormLayout, QSizePolicy, QDialog, QSize, QPoint
+from IrBaseUlcerDetectionLib import lazyImport
+from IrBaseUlcerDetectionLib.Instrumentation import Profiler
+
+# Slicer imports this file at every startup: numpy, SimpleITK and the
+# processing library are loaded on first use, when the module is entered
+np = lazyImport("numpy")
+sitk = lazyImport("SimpleITK")
+Asymmetry = lazyImport("IrBaseUlcerDetectionLib.Asymmetry")
+BackgroundRunner = lazyImport("IrBaseUlcerDetectionLib.BackgroundRunner")
+BatchProcessing = lazyImport("IrBaseUlcerDetectionLib.BatchProcessing")
+FrameStream = lazyImport("IrBaseUlcerDetectionLib.FrameStream")
+LiveAcquisition = lazyImport("IrBaseUlcerDetectionLib.LiveAcquisition")
+ProcessingEngine = lazyImport("IrBaseUlcerDetectionLib.ProcessingEngine")
+RadiometricReader = lazyImport("IrBaseUlcerDetectionLib.RadiometricReader")
+RegionStatistics = lazyImport("IrBaseUlcerDetectionLib.RegionStatistics")
+ResultCache = lazyImport("IrBaseUlcerDetectionLib.ResultCache")
+SeedDetection = lazyImport("IrBaseUlcerDetectionLib.SeedDetection")
+StackProcessing = lazyImport("IrBaseUlcerDetectionLib.StackProcessing")
+StageGraph = lazyImport("IrBaseUlcerDetectionLib.StageGraph")
+VolumeBridge = lazyImport("IrBaseUlcerDetectionLib.VolumeBridge")
+moduleImportSeconds = time.perf_counter() - moduleImportStart
 
 #
 # IrBaseUlcerDetection
@@ -32,6 +50,7 @@ It performs a simple thresholding on the input volume and optionally captures a
 This file was originally developed by Jean-Christophe Fillion-Robin, Kitware Inc.
 and Steve Pieper, Isomics, Inc. and was partially funded by NIH grant 3P41RR013218-12S1.
 """ # replace with organization, grant and thanks.
+    logging.debug("IrBaseUlcerDetection imported in %.1f ms" % (moduleImportSeconds * 1000))
 
 #
 # IrBaseUlcerDetectionWidget
@@ -46,21 +65,14 @@ class IrBaseUlcerDetectionWidget(ScriptedLoadableModuleWidget):
 
   def setup(self):
     ScriptedLoadableModuleWidget.setup(self)
+    setupStart = time.perf_counter()
 
     # Instantiate and connect widgets ...
 
     #clear scene
     # slicer.mrmlScene.Clear(0) 
 
-    #Define Widgets layout
-    lm = slicer.app.layoutManager()
-    lm.setLayout(slicer.vtkMRMLLayoutNode.SlicerLayoutThreeOverThreeView)
-    lm.sliceWidget('Red').setSliceOrientation('Axial')
-    lm.sliceWidget('Red+').setSliceOrientation('Axial')
-    lm.sliceWidget('Yellow').setSliceOrientation('Axial')
-    lm.sliceWidget('Yellow+').setSliceOrientation('Axial')
-    lm.sliceWidget('Green').setSliceOrientation('Axial')
-    lm.sliceWidget('Green+').setSliceOrientation('Axial')
+    # the viewer layout is set up in enter, when the module is shown
 
     #
     # Parameters Area
@@ -122,6 +134,46 @@ class IrBaseUlcerDetectionWidget(ScriptedLoadableModuleWidget):
     self.processingSelector.addItem("contouring")
     parametersFormLayout.addRow("Processing: ", self.processingSelector)
 
+    #
+    # Smoothing selector
+    #
+    self.smoothingSelector = qt.QComboBox()
+    for smoothing in ProcessingEngine.SMOOTHING_METHODS:
+      self.smoothingSelector.addItem(smoothing)
+    self.smoothingSelector.toolTip = "Noise reduction method; \"auto\" picks the cheapest edge-preserving one that removes enough noise."
+    parametersFormLayout.addRow("Smoothing: ", self.smoothingSelector)
+
+    self.holeFillingSelector = qt.QComboBox()
+    for holeFilling in ProcessingEngine.HOLE_FILLING_METHODS:
+      self.holeFillingSelector.addItem(holeFilling)
+    self.holeFillingSelector.toolTip = "Hole filling of the \"+ no holes\" and \"contouring\" modes; \"fill holes\" fills every enclosed hole, \"small holes\" keeps the large cold spots."
+    parametersFormLayout.addRow("Hole filling: ", self.holeFillingSelector)
+
+    self.tileSizeSpinBox = qt.QSpinBox()
+    self.tileSizeSpinBox.setRange(0, 8192)
+    self.tileSizeSpinBox.setSingleStep(256)
+    self.tileSizeSpinBox.setSuffix(" px")
+    self.tileSizeSpinBox.setSpecialValueText("whole frames")
+    self.tileSizeSpinBox.setValue(0)
+    self.tileSizeSpinBox.setToolTip("Process larger frames (panoramas, high resolution sensors) by tiles of this size to bound memory; the results do not change.")
+    parametersFormLayout.addRow("Tiles: ", self.tileSizeSpinBox)
+
+    #
+    # Hot spot threshold
+    #
+    self.hotSpotThresholdSpinBox = qt.QDoubleSpinBox()
+    self.hotSpotThresholdSpinBox.setRange(0.1, 10.0)
+    self.hotSpotThresholdSpinBox.setSingleStep(0.1)
+    self.hotSpotThresholdSpinBox.setSuffix(" C")
+    self.hotSpotThresholdSpinBox.setValue(Asymmetry.DEFAULT_THRESHOLD)
+    self.hotSpotThresholdSpinBox.setToolTip("Temperature difference to the matching point of the other foot above which a region is a hot spot.")
+    parametersFormLayout.addRow("Hot spot dT: ", self.hotSpotThresholdSpinBox)
+
+    self.subregionsCheckBox = qt.QCheckBox("Forefoot, midfoot and heel statistics")
+    self.subregionsCheckBox.toolTip = "Add a row per third of each foot along its long axis (toes at the top of the image) to the 'RegionStatistics' table."
+    self.subregionsCheckBox.checked = False
+    parametersFormLayout.addRow(self.subregionsCheckBox)
+
     #
     #  SpinBoxes : numerical inputs
     #
@@ -131,9 +183,9 @@ class IrBaseUlcerDetectionWidget(ScriptedLoadableModuleWidget):
     self.tempGroupBox=qt.QGroupBox("Temperature")
     self.tempHBoxLayout = qt.QHBoxLayout()
     
-    self.qlabelMin = QLabel('Min:')
+    self.qlabelMin = qt.QLabel('Min:')
     self.doubleMinTemp = ctk.ctkSliderWidget()
-    self.doubleMinTemp.setSizePolicy(QSizePolicy.Ignored, QSizePolicy.Preferred)
+    self.doubleMinTemp.setSizePolicy(qt.QSizePolicy.Ignored, qt.QSizePolicy.Preferred)
     self.doubleMinTemp.setDecimals(2)
     self.doubleMinTemp.setValue(27.0)
     self.tempHBoxLayout.addWidget(self.qlabelMin)
@@ -217,40 +269,258 @@ class IrBaseUlcerDetectionWidget(ScriptedLoadableModuleWidget):
     # self.extractButton.enabled = False
     parametersFormLayout.addRow(self.extractButton)
 
+    #
+    # Sequence Button
+    #
+    self.sequenceButton = qt.QPushButton("Apply Segmentation to All Frames")
+    self.sequenceButton.toolTip = "Segment every frame of the working volume, tracking the feet from frame to frame."
+    parametersFormLayout.addRow(self.sequenceButton)
+
+    #
+    # Stack Button
+    #
+    self.stackButton = qt.QPushButton("Apply Processing to All Slices")
+    self.stackButton.toolTip = "Run the selected processing on every slice of the working volume, in parallel."
+    self.workersSpinBox = qt.QSpinBox()
+    self.workersSpinBox.setRange(1, 256)
+    self.workersSpinBox.setValue(StackProcessing.defaultWorkerCount())
+    self.workersSpinBox.setToolTip("Number of slices processed at the same time.")
+    stackHBox = qt.QHBoxLayout()
+    stackHBox.addWidget(self.stackButton)
+    stackHBox.addWidget(qt.QLabel("Workers:"))
+    stackHBox.addWidget(self.workersSpinBox)
+    parametersFormLayout.addRow(stackHBox)
+
+    #
+    # Background processing
+    #
+    self.backgroundCheckBox = qt.QCheckBox("Run in background")
+    self.backgroundCheckBox.toolTip = "Process on a worker thread, keeping the viewers responsive. A new request cancels the running one."
+    self.backgroundCheckBox.checked = False
+    self.progressBar = qt.QProgressBar()
+    self.progressBar.setRange(0, 100)
+    self.progressBar.setValue(100)
+    self.progressBar.setFormat("%p%")
+    self.cancelButton = qt.QPushButton("Cancel")
+    self.cancelButton.toolTip = "Cancel the processing running in background."
+    backgroundHBox = qt.QHBoxLayout()
+    backgroundHBox.addWidget(self.backgroundCheckBox)
+    backgroundHBox.addWidget(self.progressBar)
+    backgroundHBox.addWidget(self.cancelButton)
+    parametersFormLayout.addRow(backgroundHBox)
+
+    #
+    # Result cache
+    #
+    self.cacheCheckBox = qt.QCheckBox("Cache results on disk")
+    self.cacheCheckBox.toolTip = "Keep smoothed slices, masks and sequence statistics on disk, keyed by the image pixels and the parameters, so that repeated runs are read back instead of recomputed."
+    self.cacheCheckBox.checked = True
+    self.clearCacheButton = qt.QPushButton("Clear cache")
+    cacheHBox = qt.QHBoxLayout()
+    cacheHBox.addWidget(self.cacheCheckBox)
+    cacheHBox.addWidget(self.clearCacheButton)
+    parametersFormLayout.addRow(cacheHBox)
+
     # connections
     self.extractButton.connect('clicked(bool)', self.onExtractButton)
+    self.sequenceButton.connect('clicked(bool)', self.onSequenceButton)
+    self.stackButton.connect('clicked(bool)', self.onStackButton)
     self.takeImageButton.connect('clicked(bool)', self.onTakeImageButton)
     self.outputSelector.connect("currentNodeChanged(vtkMRMLNode*)", self.onSelectWorkingImage)
     self.processingSelector.connect('currentIndexChanged(QString)', self.onProcessing)
+    self.smoothingSelector.connect('currentIndexChanged(QString)', self.onSmoothing)
+    self.holeFillingSelector.connect('currentIndexChanged(QString)', self.onHoleFilling)
+    self.tileSizeSpinBox.connect('valueChanged(int)', self.onTileSize)
+    self.hotSpotThresholdSpinBox.connect('valueChanged(double)', self.onHotSpotThreshold)
+    self.subregionsCheckBox.connect('toggled(bool)', self.onSubregionsToggled)
+    self.doubleMinTemp.connect('valueChanged(double)', self.onTemperatureChanged)
+    self.doubleMaxTemp.connect('valueChanged(double)', self.onTemperatureChanged)
+    self.cancelButton.connect('clicked(bool)', self.onCancelButton)
+    self.cacheCheckBox.connect('toggled(bool)', self.onCacheToggled)
+    self.clearCacheButton.connect('clicked(bool)', self.onClearCache)
+
+    # one logic for the whole session, so smoothing and threshold indexes are reused
+    self.logic = IrBaseUlcerDetectionLogic()
+    self.logic.progressCallback = self.onProgress
+
+    #
+    # Raw Files Area
+    #
+    rawCollapsibleButton = ctk.ctkCollapsibleButton()
+    rawCollapsibleButton.text = "Raw thermal files"
+    rawCollapsibleButton.collapsed = True
+    self.layout.addWidget(rawCollapsibleButton)
+    rawFormLayout = qt.QFormLayout(rawCollapsibleButton)
+
+    self.rawPathLineEdit = ctk.ctkPathLineEdit()
+    self.rawPathLineEdit.filters = ctk.ctkPathLineEdit.Files
+    self.rawPathLineEdit.toolTip = "Raw radiometric frames, described by a <file>.json sidecar (size, layout and calibration)."
+    rawFormLayout.addRow("Raw file: ", self.rawPathLineEdit)
+
+    self.rawFirstFrameSpinBox = qt.QSpinBox()
+    self.rawFirstFrameSpinBox.setRange(0, 10000000)
+    self.rawFramesSpinBox = qt.QSpinBox()
+    self.rawFramesSpinBox.setRange(0, 10000000)
+    self.rawFramesSpinBox.setValue(1)
+    self.rawFramesSpinBox.setSpecialValueText("all")
+    self.rawFramesSpinBox.setToolTip("Number of frames to load or analyze.")
+    rangeHBox = qt.QHBoxLayout()
+    rangeHBox.addWidget(qt.QLabel("First frame:"))
+    rangeHBox.addWidget(self.rawFirstFrameSpinBox)
+    rangeHBox.addWidget(qt.QLabel("Frames:"))
+    rangeHBox.addWidget(self.rawFramesSpinBox)
+    rawFormLayout.addRow(rangeHBox)
+
+    self.loadRawButton = qt.QPushButton("Load frames")
+    self.loadRawButton.toolTip = "Load the frames as a volume of temperatures and make it the working volume."
+    self.analyzeRawButton = qt.QPushButton("Analyze sequence")
+    self.analyzeRawButton.toolTip = "Segment both feet on every frame, streamed from the file, into the 'SequenceTemperatures' table."
+    rawButtonsHBox = qt.QHBoxLayout()
+    rawButtonsHBox.addWidget(self.loadRawButton)
+    rawButtonsHBox.addWidget(self.analyzeRawButton)
+    rawFormLayout.addRow(rawButtonsHBox)
+
+    self.loadRawButton.connect('clicked(bool)', self.onLoadRawButton)
+    self.analyzeRawButton.connect('clicked(bool)', self.onAnalyzeRawButton)
+
+    #
+    # Live Acquisition Area
+    #
+    liveCollapsibleButton = ctk.ctkCollapsibleButton()
+    liveCollapsibleButton.text = "Live acquisition"
+    liveCollapsibleButton.collapsed = True
+    self.layout.addWidget(liveCollapsibleButton)
+    liveFormLayout = qt.QFormLayout(liveCollapsibleButton)
+
+    self.liveSourceSelector = qt.QComboBox()
+    self.liveSourceSelector.addItems(IrBaseUlcerDetectionLogic.LIVE_SOURCES)
+    self.liveSourceSelector.toolTip = "Where the frames come from: a raw radiometric file replayed at its frame rate, new files of a directory, or a camera bridge on a local TCP port."
+    liveFormLayout.addRow("Source: ", self.liveSourceSelector)
+
+    self.livePathLineEdit = ctk.ctkPathLineEdit()
+    self.livePathLineEdit.filters = ctk.ctkPathLineEdit.Files | ctk.ctkPathLineEdit.Dirs
+    self.livePathLineEdit.toolTip = "Raw file to replay or directory to watch."
+    liveFormLayout.addRow("File or directory: ", self.livePathLineEdit)
+
+    self.livePortSpinBox = qt.QSpinBox()
+    self.livePortSpinBox.setRange(1, 65535)
+    self.livePortSpinBox.setValue(LiveAcquisition.DEFAULT_PORT)
+    self.livePortSpinBox.setToolTip("Local port of the camera bridge.")
+    liveFormLayout.addRow("Port: ", self.livePortSpinBox)
+
+    self.liveButton = qt.QPushButton("Start live")
+    self.liveButton.toolTip = "Process the newest frame of the source with the selected processing and show it in the green viewer; frames arriving while a frame is processed are dropped."
+    self.liveButton.checkable = True
+    liveFormLayout.addRow(self.liveButton)
+
+    self.liveMetricsLabel = qt.QLabel("")
+    liveFormLayout.addRow(self.liveMetricsLabel)
+
+    self.liveButton.connect('toggled(bool)', self.onLiveToggled)
+    self.logic.liveCallback = self.onLiveMetrics
+
+    #
+    # Profiling Area
+    #
+    profilingCollapsibleButton = ctk.ctkCollapsibleButton()
+    profilingCollapsibleButton.text = "Profiling"
+    profilingCollapsibleButton.collapsed = True
+    self.layout.addWidget(profilingCollapsibleButton)
+    profilingFormLayout = qt.QFormLayout(profilingCollapsibleButton)
+
+    self.profilingCheckBox = qt.QCheckBox("Record stage timings")
+    self.profilingCheckBox.toolTip = "Record wall time, memory growth and image size of every processing stage."
+    self.profilingCheckBox.checked = self.logic.profiler.enabled
+    profilingFormLayout.addRow(self.profilingCheckBox)
+
+    self.profilingSummary = qt.QPlainTextEdit()
+    self.profilingSummary.readOnly = True
+    self.profilingSummary.lineWrapMode = qt.QPlainTextEdit.NoWrap
+    self.profilingSummary.setFont(qt.QFontDatabase.systemFont(qt.QFontDatabase.FixedFont))
+    profilingFormLayout.addRow(self.profilingSummary)
+
+    self.clearProfilingButton = qt.QPushButton("Clear")
+    self.saveProfilingButton = qt.QPushButton("Save records...")
+    self.saveProfilingButton.toolTip = "Save every stage record as JSON lines."
+    profilingHBox = qt.QHBoxLayout()
+    profilingHBox.addWidget(self.clearProfilingButton)
+    profilingHBox.addWidget(self.saveProfilingButton)
+    profilingFormLayout.addRow(profilingHBox)
+
+    self.profilingCheckBox.connect('toggled(bool)', self.onProfilingToggled)
+    self.clearProfilingButton.connect('clicked(bool)', self.onClearProfiling)
+    self.saveProfilingButton.connect('clicked(bool)', self.onSaveProfiling)
+    self.logic.profiler.runFinishedCallback = self.onRunProfiled
     
     # self.parent.connect('mrmlSceneChanged(vtkMRMLScene*)', self.seedFiducialsNodeSelector, 'setMRMLScene(vtkMRMLScene*)')
 
     # Add vertical spacer
     self.layout.addStretch(1)
+    logging.debug("IrBaseUlcerDetection widget set up in %.1f ms" % ((time.perf_counter() - setupStart) * 1000))
+
+  def enter(self):
+    #Define Widgets layout: six axial viewers
+    lm = slicer.app.layoutManager()
+    if lm is None:
+      return
+    lm.setLayout(slicer.vtkMRMLLayoutNode.SlicerLayoutThreeOverThreeView)
+    for viewerName in ('Red', 'Red+', 'Yellow', 'Yellow+', 'Green', 'Green+'):
+      lm.sliceWidget(viewerName).setSliceOrientation('Axial')
 
   def cleanup(self):
-    pass
+    self.logic.stopLive()
+    self.logic.cancelBackgroundJobs()
+
+  def markupSeedsRAS(self):
+    """World RAS positions of the right and left seed markups, None for a markup not placed"""
+    positions = []
+    for selector in (self.seedRightFiducialsNodeSelector, self.seedLeftFiducialsNodeSelector):
+      markupsNode = selector.currentNode()
+      if markupsNode is None or markupsNode.GetNumberOfFiducials() == 0:
+        positions.append(None)
+      else:
+        position = [0.0, 0.0, 0.0, 1.0]
+        markupsNode.GetNthFiducialWorldCoordinates(0, position)
+        positions.append(position[0:3])
+    return positions
 
   def onExtractButton(self):
-    logic = IrBaseUlcerDetectionLogic()
-    # Other access method
-    # arr = [0,0,0]
-    # self.seedRightFiducialsNodeSelector.currentNode().GetMarkupPoint(self.seedRightFiducialsNodeSelector.currentNode().GetNumberOfMarkups()-1,0,arr)
-
-    leftCoordinatesRAS = [0, 0, 0]
-    leftPoint = self.seedLeftFiducialsNodeSelector.currentNode()
-    leftPoint.GetNthFiducialPosition(0,leftCoordinatesRAS)
-
-    rightCoordinatesRAS = [0, 0, 0]
-    rightPoint = self.seedRightFiducialsNodeSelector.currentNode()
-    rightPoint.GetNthFiducialPosition(0,rightCoordinatesRAS)
+    logic = self.logic
+    # seeds are detected on the image unless both markups are placed
+    rightCoordinatesRAS, leftCoordinatesRAS = self.markupSeedsRAS()
 
 
     # rightImage = logic.processVolume(self.outputSelector,self.processingSelector, self.doubleMinTemp.value, self.doubleMaxTemp.value, rightCoordinatesRAS)
-    logic.runSegmentation(self.outputSelector, self.processingSelector, self.doubleMinTemp.value, self.doubleMaxTemp.value, rightCoordinatesRAS, leftCoordinatesRAS)
+    runSegmentation = logic.runSegmentationAsync if self.backgroundCheckBox.checked else logic.runSegmentation
+    runSegmentation(self.outputSelector, self.processingSelector, self.doubleMinTemp.value, self.doubleMaxTemp.value, rightCoordinatesRAS, leftCoordinatesRAS)
  
+  def onSequenceButton(self):
+    self.logic.runSequence(self.outputSelector, self.processingSelector, self.doubleMinTemp.value, self.doubleMaxTemp.value, *self.markupSeedsRAS())
+
+  def onStackButton(self):
+    self.logic.runStack(self.outputSelector, self.processingSelector, self.doubleMinTemp.value, self.doubleMaxTemp.value, self.workersSpinBox.value)
+
+  def rawFrameRange(self):
+    start = self.rawFirstFrameSpinBox.value
+    return start, (start + self.rawFramesSpinBox.value if self.rawFramesSpinBox.value else None)
+
+  def onLoadRawButton(self):
+    try:
+      volumeNode = self.logic.loadRadiometric(self.rawPathLineEdit.currentPath, *self.rawFrameRange())
+    except (OSError, ValueError, KeyError) as e:
+      slicer.util.errorDisplay("Cannot read the raw file: %s" % e)
+      return
+    self.outputSelector.setCurrentNode(volumeNode)
+
+  def onAnalyzeRawButton(self):
+    try:
+      self.logic.runRadiometricSequence(self.rawPathLineEdit.currentPath, self.processingSelector,
+                                        self.doubleMinTemp.value, self.doubleMaxTemp.value, *self.rawFrameRange())
+    except (OSError, ValueError, KeyError) as e:
+      slicer.util.errorDisplay("Cannot analyze the raw file: %s" % e)
+
   def onTakeImageButton(self):
-    logic = IrBaseUlcerDetectionLogic()
+    logic = self.logic
     self.outputSelector.setCurrentNode(logic.runTakeImage(self.inputSelector.currentNode()))
 
   def onSelectWorkingImage(self):
@@ -265,8 +535,90 @@ class IrBaseUlcerDetectionWidget(ScriptedLoadableModuleWidget):
     yellowLogic.GetSliceCompositeNode().SetBackgroundVolumeID(self.outputSelector.currentNode().GetID())
 
   def onProcessing(self):
-    logic = IrBaseUlcerDetectionLogic()
-    logic.runProcessing(self.outputSelector, self.processingSelector, self.doubleMinTemp.value, self.doubleMaxTemp.value)
+    logic = self.logic
+    if logic.live is not None:
+      # the next live frames are processed with the new parameters
+      try:
+        logic.updateLiveParameters(self.processingSelector, self.doubleMinTemp.value, self.doubleMaxTemp.value, *self.markupSeedsRAS())
+      except ValueError as e:
+        logging.error("live parameters not updated: %s" % e)
+      return
+    runProcessing = logic.runProcessingAsync if self.backgroundCheckBox.checked else logic.runProcessing
+    runProcessing(self.outputSelector, self.processingSelector, self.doubleMinTemp.value, self.doubleMaxTemp.value, *self.markupSeedsRAS())
+
+  def onSmoothing(self, smoothing):
+    self.logic.smoothing = smoothing
+    if self.outputSelector.currentNode() or self.logic.live is not None:
+      self.onProcessing()
+
+  def onHoleFilling(self, holeFilling):
+    self.logic.holeFilling = holeFilling
+    if self.outputSelector.currentNode() or self.logic.live is not None:
+      self.onProcessing()
+
+  def onTileSize(self, tileSize):
+    self.logic.tileSize = tileSize or None
+
+  def onHotSpotThreshold(self, threshold):
+    self.logic.hotSpotThreshold = threshold
+
+  def onSubregionsToggled(self, enabled):
+    self.logic.subregionStatistics = enabled
+
+  def onTemperatureChanged(self):
+    # live preview: segmentation modes only need a threshold index lookup
+    if (self.outputSelector.currentNode() or self.logic.live is not None) and self.processingSelector.currentText in ProcessingEngine.SEGMENTATION_MODES:
+      self.onProcessing()
+
+  def onCancelButton(self):
+    self.logic.cancelBackgroundJobs()
+
+  def onCacheToggled(self, enabled):
+    self.logic.resultCache.enabled = enabled
+
+  def onClearCache(self):
+    self.logic.resultCache.clear()
+    self.logic.processingGraph.clear()
+
+  def onProgress(self, stage, progress):
+    self.progressBar.setValue(int(progress * 100))
+    self.progressBar.setFormat("%s %%p%%" % stage)
+
+  def onLiveToggled(self, enabled):
+    if not enabled:
+      self.logic.stopLive()
+      self.liveButton.text = "Start live"
+      return
+    try:
+      source = self.logic.liveSource(self.liveSourceSelector.currentText, self.livePathLineEdit.currentPath, self.livePortSpinBox.value)
+    except (OSError, ValueError, KeyError) as e:
+      slicer.util.errorDisplay("Cannot open the live source: %s" % e)
+      self.liveButton.checked = False
+      return
+    self.logic.startLive(source, self.outputSelector, self.processingSelector, self.doubleMinTemp.value, self.doubleMaxTemp.value,
+                         *self.markupSeedsRAS())
+    self.liveButton.text = "Stop live"
+
+  def onLiveMetrics(self, metrics, running):
+    self.liveMetricsLabel.text = metrics.formatSummary()
+    if not running and self.liveButton.checked:
+      # the source ended
+      self.liveButton.checked = False
+
+  def onProfilingToggled(self, enabled):
+    self.logic.profiler.enabled = enabled
+
+  def onRunProfiled(self, record):
+    self.profilingSummary.setPlainText(self.logic.profiler.formatSummary())
+
+  def onClearProfiling(self):
+    self.logic.profiler.clear()
+    self.profilingSummary.setPlainText("")
+
+  def onSaveProfiling(self):
+    path = qt.QFileDialog.getSaveFileName(self.parent, "Save stage records", "", "JSON lines (*.jsonl)")
+    if path:
+      self.logic.profiler.writeJson(path)
 
 
 # ----------------------------------------------------------------------------------------------------------------------------------------------------------------------
@@ -283,190 +635,612 @@ class IrBaseUlcerDetectionLogic(ScriptedLoadableModuleLogic):
   https://github.com/Slicer/Slicer/blob/master/Base/Python/slicer/ScriptedLoadableModule.py
   """
 
+  # live frame sources, in the order of the widget combo box
+  LIVE_SOURCES = ("Replay raw file", "Watch directory", "Local socket")
+
+
+  def __init__(self, parent=None):
+    ScriptedLoadableModuleLogic.__init__(self, parent)
+    self.outputNodes = VolumeBridge.OutputNodePool()
+    # interactive runs: only the stages downstream of a changed parameter are recomputed
+    self.processingGraph = StageGraph.ProcessingGraph(smooth=self.smoothedSlice)
+    self.rasToIjk = VolumeBridge.RasToIjk()
+    self.footSeedsKey = None
+    self.footSeedsCache = None
+    # smoothing method of every run, one of ProcessingEngine.SMOOTHING_METHODS
+    self.smoothing = ProcessingEngine.SMOOTHING_CURVATURE_FLOW
+    # hole filling method of the "+ no holes" and "contouring" modes, one of ProcessingEngine.HOLE_FILLING_METHODS
+    self.holeFilling = ProcessingEngine.HOLE_FILLING_VOTING
+    # tile size of the smoothing and morphology stages on large frames, None for whole frames
+    self.tileSize = None
+    # contralateral difference of the hot spots, and last asymmetry result of runSegmentation
+    self.hotSpotThreshold = Asymmetry.DEFAULT_THRESHOLD
+    self.asymmetry = None
+    # per-region statistics rows of the last runSegmentation, optionally with foot thirds
+    self.subregionStatistics = False
+    self.statistics = None
+    # smoothed slices, foot masks and sequence results, kept across sessions
+    self.resultCache = ResultCache.DiskCache(os.path.join(slicer.app.temporaryPath, 'IrBaseUlcerDetectionCache'))
+    # per-stage timings, see IrBaseUlcerDetectionLib.Instrumentation
+    self.profiler = Profiler()
+    # live acquisition: the running LiveAcquisition, the parameters of its next frames and the viewer refresh
+    self.live = None
+    self.liveParameters = None
+    self.liveSelector = None
+    self.liveCallback = None
+    self.liveTimer = qt.QTimer()
+    self.liveTimer.setInterval(20)
+    self.liveTimer.connect('timeout()', self.onPollLive)
+
+    self.backgroundRunner = BackgroundRunner.BackgroundRunner()
+    self.backgroundHandlers = {}
+    self.progressCallback = None
+    self.pollTimer = qt.QTimer()
+    self.pollTimer.setInterval(50)
+    self.pollTimer.connect('timeout()', self.onPollBackgroundJobs)
+
   def runTakeImage(self, inputVolume):
     #clone volume
     volumesLogic = slicer.modules.volumes.logic()
     workingVolume = volumesLogic.CloneVolume(slicer.mrmlScene, inputVolume, 'workingVolume')
     return workingVolume
   
-  def rasToXYZ(self,rasPoint):
-    """return x y for a give r a s"""
-    sliceNode = self.sliceLogic.GetSliceNode()
-    rasToXY = vtk.vtkMatrix4x4()
-    rasToXY.DeepCopy(sliceNode.GetXYToRAS())
-    rasToXY.Invert()
-    xyzw = rasToXY.MultiplyPoint(rasPoint+(1,))
-    return xyzw[:3]
+  def rasToIJK(self, volumeNode, rasPoint):
+    """return the i j k voxel of volumeNode nearest to a world r a s point"""
+    return self.rasToIjk.convert(volumeNode, rasPoint)
+
+  def markupSeeds(self, volumeNode, rightCoordinatesRAS, leftCoordinatesRAS):
+    """Right and left foot seeds (i, j) of the markups, or [] unless both are placed.
+
+    Raises ValueError if a markup lies outside the volume.
+    """
+    if rightCoordinatesRAS is None or leftCoordinatesRAS is None:
+      return []
+    seeds = [self.rasToIJK(volumeNode, coordinates)[0:2] for coordinates in (rightCoordinatesRAS, leftCoordinatesRAS)]
+    ProcessingEngine.checkSeeds(volumeNode.GetImageData().GetDimensions(), seeds)
+    return seeds
+
+  def footSeeds(self, volumeNode, zslice=0, rightCoordinatesRAS=None, leftCoordinatesRAS=None):
+    """Right and left foot seeds (i, j): from the markups when both are placed, else detected on the slice.
+
+    Detected seeds are kept until the volume data or the slice changes.
+    """
+    seeds = self.markupSeeds(volumeNode, rightCoordinatesRAS, leftCoordinatesRAS)
+    if seeds:
+      return seeds
+    key = (volumeNode.GetID(), volumeNode.GetImageData().GetMTime(), zslice)
+    if self.footSeedsKey != key:
+      inputImage = self.pullSlice(volumeNode, zslice)
+      with self.profiler.stage('seed detection'):
+        self.footSeedsCache = SeedDetection.detectFootSeeds(inputImage)
+      self.footSeedsKey = key
+    return self.footSeedsCache
+
+  def processingParameters(self, processingSelector, tempMin, tempMax, seeds=None):
+    """Build the engine parameters from the widget values"""
+    mode = processingSelector if isinstance(processingSelector, str) else processingSelector.currentText
+    return ProcessingEngine.ProcessingParameters(mode=mode, tempMin=tempMin, tempMax=tempMax, seeds=seeds, smoothing=self.smoothing,
+                                                 holeFilling=self.holeFilling, tileSize=self.tileSize)
 
   def processVolume(self, workingSelector, processingSelector,tempMin,tempMax, coordinates, name):
-    print("processing")
-    
-    inputImage = sitkUtils.PullVolumeFromSlicer(workingSelector.currentNode())
-    volumesLogic = slicer.modules.volumes.logic()
-    processedVolume = volumesLogic.CloneVolume(slicer.mrmlScene, workingSelector.currentNode(), name)
-
-    #extract image from volume
-    zslice = 0
-    size = list(inputImage.GetSize())
-    size[2] = 0
-    index = [0, 0, zslice]
-    Extractor = sitk.ExtractImageFilter()
-    Extractor.SetSize(size)
-    Extractor.SetIndex(index)
-
-    outputImage=Extractor.Execute(inputImage)
-
-    # step 1)filtering: noise reduction
-    imgSmooth =  sitk.CurvatureFlow(image1=outputImage, timeStep=0.125, numberOfIterations=5)
-
-    # step 2) filtering: segmentation
-    # aux = self.rasToXYZ(coordinates)
-    # coordinates=[197, 140, 190,2]
-    lstSeeds = [()]
-    lstSeeds[0] = tuple(coordinates[0:2])
-    print(lstSeeds)
-    print(coordinates)
-    labelLeftHand=1
-    imgLeftHand = sitk.ConnectedThreshold(image1=imgSmooth, seedList=lstSeeds, lower=tempMin, upper=tempMax, replaceValue=labelLeftHand)
-
-    #step 3) create image to display
-    imgSmoothInt = sitk.Cast(sitk.RescaleIntensity(imgSmooth), imgLeftHand.GetPixelID())
-    # Use 'LabelOverlay' to overlay 'imgSmooth' and 'imgWhiteMatter'
-    outI=sitk.LabelOverlay(imgSmoothInt, imgLeftHand)
-    outI2 = sitk.Multiply(imgSmooth,  sitk.Cast ( imgLeftHand, sitk.sitkFloat64 ) )
-
-    return outI2
-
-  def visualizationImages(self, workingSelector, viewerName, img, name):
-    volumesLogic = slicer.modules.volumes.logic()
-    processedVolume = volumesLogic.CloneVolume(slicer.mrmlScene, workingSelector.currentNode(), name)
+    logging.info('Processing %s' % name)
 
-    workingSelector.setCurrentNode(processedVolume)
-    #processedVolume= workingSelector.currentNode()
-    outNode = sitkUtils.PushVolumeToSlicer(img, targetNode=workingSelector.currentNode(), name=None, className='vtkMRMLScalarVolumeNode')
+    volumeNode = workingSelector.currentNode()
+    seeds = [self.rasToIJK(volumeNode, coordinates)[0:2]] if coordinates is not None else []
+    parameters = self.processingParameters(processingSelector, tempMin, tempMax, seeds=seeds)
+    with self.profiler.run('processVolume', parameters.mode):
+      inputImage = self.pullSlice(volumeNode, parameters.zslice)
+      return ProcessingEngine.segmentFoot(inputImage, parameters, observer=self.profiler.engineObserver()).image
 
-    # step 4) display image in Slice viwer
+  def pullSlice(self, volumeNode, zslice=0):
+    with self.profiler.stage('pull'):
+      return VolumeBridge.pullSlice(volumeNode, zslice)
+
+  def showInViewer(self, viewerName, volumeNode):
+    """Display volumeNode as background of the slice viewer viewerName"""
     lm = slicer.app.layoutManager()
     sliceViewer = lm.sliceWidget(viewerName)
     sliceViewerLogic = sliceViewer.sliceLogic()
-    sliceViewerLogic.GetSliceCompositeNode().SetBackgroundVolumeID(workingSelector.currentNode().GetID())
-    sliceViewer.setSliceOrientation('Axial')
-    view=sliceViewer.sliceView()
-    view.forceRender()
-    # Set the orientation to axial
-    sliceViewerLogic.GetSliceNode().UpdateMatrices()
-    sliceViewerLogic.EndSliceNodeInteraction()
+    with self.profiler.stage('render'):
+      sliceViewerLogic.GetSliceCompositeNode().SetBackgroundVolumeID(volumeNode.GetID())
+      sliceViewerLogic.GetSliceCompositeNode().SetLabelVolumeID(None)
+      sliceViewer.setSliceOrientation('Axial')
+      view=sliceViewer.sliceView()
+      view.forceRender()
+      # Set the orientation to axial
+      sliceViewerLogic.GetSliceNode().UpdateMatrices()
+      sliceViewerLogic.EndSliceNodeInteraction()
+
+  def visualizationImages(self, workingSelector, viewerName, img, name, zslice=0):
+    # reuse the output node of this role instead of cloning the working volume
+    processedVolume = self.outputNodes.node(name)
+    with self.profiler.stage('push', img):
+      VolumeBridge.pushSlice(img, processedVolume, workingSelector.currentNode(), zslice)
 
+    # step 4) display image in Slice viwer
+    self.showInViewer(viewerName, processedVolume)
+    return processedVolume
+
+  def showLabelsInViewer(self, viewerName, backgroundNode, labelNode):
+    """Display labelNode as label layer over backgroundNode in the slice viewer viewerName"""
+    sliceViewer = slicer.app.layoutManager().sliceWidget(viewerName)
+    compositeNode = sliceViewer.sliceLogic().GetSliceCompositeNode()
+    with self.profiler.stage('render'):
+      # the viewer is set up once; later updates only modify the label layer data
+      if compositeNode.GetBackgroundVolumeID() != backgroundNode.GetID() or compositeNode.GetLabelVolumeID() != labelNode.GetID():
+        compositeNode.SetBackgroundVolumeID(backgroundNode.GetID())
+        compositeNode.SetLabelVolumeID(labelNode.GetID())
+        compositeNode.SetLabelOpacity(1.0)
+        sliceViewer.setSliceOrientation('Axial')
+        sliceViewer.fitSliceToBackground()
+      sliceViewer.sliceView().forceRender()
+
+  def visualizationLabels(self, workingSelector, viewerName, labels, name, zslice=0):
+    """Push a uint8 label image to the label map output node name and overlay it on the working volume"""
+    labelNode = self.outputNodes.labelNode(name)
+    with self.profiler.stage('push', labels):
+      VolumeBridge.pushSlice(labels, labelNode, workingSelector.currentNode(), zslice)
+    self.showLabelsInViewer(viewerName, workingSelector.currentNode(), labelNode)
+    return labelNode
+
+  def visualizationResult(self, workingSelector, viewerName, result, zslice=0):
+    """Show a runProcessing result: temperatures as a volume, masks and outlines as labels over the working volume"""
+    if result.mode in ProcessingEngine.SEGMENTATION_MODES:
+      labels = result.image if result.mode == ProcessingEngine.MODE_CONTOURING else result.mask
+      return self.visualizationLabels(workingSelector, viewerName, labels, 'processedLabels', zslice)
+    return self.visualizationImages(workingSelector, viewerName, result.image, 'processedVolume', zslice)
+
+  def asymmetryOf(self, result, hotSpotThreshold, observer=None):
+    """Asymmetry.AsymmetryResult of a segmentFeet result, or None if it cannot be computed"""
+    try:
+      return Asymmetry.asymmetryMap(result.smoothed, result.mask, hotSpotThreshold, observer=observer)
+    except ValueError as e:
+      logging.warning("asymmetry map failed: %s" % e)
+      return None
+
+  def statisticsOf(self, result, asymmetry=None, subregions=False):
+    """RegionStatistics rows of both feet (and their thirds if subregions) of a segmentFeet result"""
+    labelImages = [result.mask]
+    if subregions:
+      labelImages.append(RegionStatistics.footSubregions(result.mask))
+    return RegionStatistics.labelStatistics(result.smoothed, labelImages, asymmetry.hotSpots if asymmetry else None,
+                                            labels=(ProcessingEngine.RIGHT_FOOT_LABEL, ProcessingEngine.LEFT_FOOT_LABEL))
+
+  def statisticsTable(self, rows):
+    """Write statistics rows to the 'RegionStatistics' table"""
+    tableNode = self.outputNodes.node('RegionStatistics', 'vtkMRMLTableNode')
+    with self.profiler.stage('push'):
+      VolumeBridge.pushTable(tableNode, rows, RegionStatistics.statisticsColumns())
+    return tableNode
+
+  def visualizationAsymmetry(self, workingSelector, asymmetry, zslice=0):
+    """Show the 'AsymmetryMap' temperature differences with the 'HotSpots' label map over them in Red+"""
+    deltaNode = self.outputNodes.node('AsymmetryMap')
+    hotSpotNode = self.outputNodes.labelNode('HotSpots')
+    with self.profiler.stage('push', asymmetry.deltaT):
+      VolumeBridge.pushSlice(asymmetry.deltaT, deltaNode, workingSelector.currentNode(), zslice)
+      VolumeBridge.pushSlice(asymmetry.hotSpots, hotSpotNode, workingSelector.currentNode(), zslice)
+    self.showLabelsInViewer('Red+', deltaNode, hotSpotNode)
+    for region in asymmetry.regions:
+      logging.info("hot spot on label %d: %d px, max dT %.2f C at (%.0f, %.0f)"
+                   % (region["label"], region["area"], region["max"], region["centroid"][0], region["centroid"][1]))
+    return deltaNode, hotSpotNode
 
   def runSegmentation(self, workingSelector, processingSelector,tempMin,tempMax, rightCoordinatesRAS, leftCoordinatesRAS):
     """
     Run the actual algorithm
     """
-    #outputVolume=workingSelector.currentNode()
-
-    rightImage = self.processVolume(workingSelector, processingSelector, tempMin, tempMax, [70,117,1], "RightVolumen")
-    # rightImage = self.processVolume(workingSelector, processingSelector, tempMin, tempMax, rightCoordinatesRAS)
-    self.visualizationImages(workingSelector, "Yellow+", rightImage, "RightVolumen")
-
-    leftImage = self.processVolume(workingSelector, processingSelector, tempMin, tempMax, [206,41,1], "LeftVolumen")
-    # leftImage = self.processVolume(workingSelector, processingSelector, tempMin, tempMax, leftCoordinatesRAS)
-    self.visualizationImages(workingSelector, "Red+", leftImage, "LeftVolumen")
-  
-    print("Images processed")
-
-  def runProcessing(self, workingSelector, processingSelector,tempMin,tempMax):
-
-    # outputVolume=workingSelector.currentNode()
-    inputImage = sitkUtils.PullVolumeFromSlicer(workingSelector.currentNode())
-    # extract image from volume
-    zslice = 0
-    size = list(inputImage.GetSize())
-    size[2] = 0
-    index = [0, 0, zslice]
-    Extractor = sitk.ExtractImageFilter()
-    Extractor.SetSize(size)
-    Extractor.SetIndex(index)
-    outputImage = Extractor.Execute(inputImage)
-
-    if processingSelector.currentText == "original" :
-      # original
-      print("no processing required ")
+    # both feet share one pull and one smoothing pass
+    volumeNode = workingSelector.currentNode()
+    parameters = self.processingParameters(processingSelector, tempMin, tempMax)
+    with self.profiler.run('runSegmentation', parameters.mode):
+      try:
+        parameters = parameters.copy(seeds=self.footSeeds(volumeNode, parameters.zslice, rightCoordinatesRAS, leftCoordinatesRAS))
+        inputImage = self.pullSlice(volumeNode, parameters.zslice)
+        result = self.segmentFeetCached(inputImage, parameters, observer=self.profiler.engineObserver())
+      except ValueError as e:
+        logging.error("segmentation failed: %s" % e)
+        return None
+
+      # both feet in one label map over the working volume
+      self.visualizationLabels(workingSelector, "Yellow+", result.mask, "FootLabels")
+
+      # contralateral temperature differences and hot spots
+      observer = self.profiler.engineObserver()
+      self.asymmetry = self.asymmetryOf(result, self.hotSpotThreshold, observer)
+      ProcessingEngine.reportStage(observer, "done", 1.0)
+      if self.asymmetry is not None:
+        self.visualizationAsymmetry(workingSelector, self.asymmetry)
+
+      with self.profiler.stage('statistics'):
+        self.statistics = self.statisticsOf(result, self.asymmetry, self.subregionStatistics)
+      self.statisticsTable(self.statistics)
+
+    logging.info("Images processed")
+    return result
+
+  def sliceKey(self, volumeNode, zslice=0):
+    """Identity of the pixels of a working slice, for the processing graph"""
+    return (volumeNode.GetID(), volumeNode.GetImageData().GetMTime(), zslice)
+
+  def smoothedSlice(self, inputImage, parameters):
+    """Smoothed slice, read from the result cache when these pixels were smoothed with the same settings"""
+    key = self.resultCache.key('smoothing', [inputImage], parameters.smoothingKey())
+    entry = self.resultCache.get(key)
+    if entry is not None:
+      return entry.image('smoothed')
+    imgSmooth = ProcessingEngine.smoothImage(inputImage, parameters)
+    self.resultCache.put(key, {'smoothed': imgSmooth})
+    return imgSmooth
+
+  def segmentFeetCached(self, inputImage, parameters, observer=None):
+    """ProcessingEngine.segmentFeet, read from the result cache when already run on these pixels and parameters"""
+    key = self.resultCache.key('feet', [inputImage], parameters.segmentationKey())
+    entry = self.resultCache.get(key)
+    if entry is not None:
+      ProcessingEngine.reportStage(observer, "cache", 0.0)
+      result = ProcessingEngine.feetResult(entry.image('smoothed'), entry.image('labels'), parameters)
+      ProcessingEngine.reportStage(observer, "done", 1.0)
+      return result
+    result = ProcessingEngine.segmentFeet(inputImage, parameters, observer=observer)
+    self.resultCache.put(key, {'smoothed': result.smoothed, 'labels': result.mask})
+    return result
+
+  def runProcessing(self, workingSelector, processingSelector,tempMin,tempMax, rightCoordinatesRAS=None, leftCoordinatesRAS=None):
+
+    try:
+      parameters = self.processingParameters(processingSelector, tempMin, tempMax)
+      if parameters.mode == ProcessingEngine.MODE_ORIGINAL:
+        logging.info("no processing required")
+        return
+      parameters.validate()
+    except ValueError as e:
+      logging.error("processing failed: %s" % e)
       return
-    elif processingSelector.currentText == "image smoothing" :
-      # step 1)filtering: noise reduction
-      outI2 = sitk.CurvatureFlow(image1=outputImage, timeStep=0.125, numberOfIterations=5)
-    elif processingSelector.currentText == "image segmentation" :
-      # step 1)filtering: noise reduction
-      imgSmooth = sitk.CurvatureFlow(image1=outputImage, timeStep=0.125, numberOfIterations=5)
-      # step 2) filtering: segmentation
-      lstSeeds = [(247, 86)]
-      labelLeftHand = 1
-      imgLeftHand = sitk.ConnectedThreshold(image1=imgSmooth, seedList=lstSeeds, lower=tempMin, upper=tempMax, replaceValue=labelLeftHand)
-      # step 3) create image to display
-      imgSmoothInt = sitk.Cast(sitk.RescaleIntensity(imgSmooth), imgLeftHand.GetPixelID())
-      # Use 'LabelOverlay' to overlay 'imgSmooth' and 'imgWhiteMatter'
-      outI2 = sitk.Multiply(imgSmooth, sitk.Cast(imgLeftHand, sitk.sitkFloat64))
-    elif processingSelector.currentText== "image segmentation + no holes" :
-      # step 1)filtering: noise reduction
-      imgSmooth = sitk.CurvatureFlow(image1=outputImage, timeStep=0.125, numberOfIterations=5)
-      # step 2) filtering: segmentation
-      lstSeeds = [(247, 86)]
-      labelLeftHand = 1
-      imgLeftHand = sitk.ConnectedThreshold(image1=imgSmooth, seedList=lstSeeds, lower=tempMin, upper=tempMax, replaceValue=labelLeftHand)
-      # step 3) create image to display
-      imgSmoothInt = sitk.Cast(sitk.RescaleIntensity(imgSmooth), imgLeftHand.GetPixelID())
-      # Use 'LabelOverlay' to overlay 'imgSmooth' and 'imgWhiteMatter'
-      imgLeftHandNoHoles = sitk.VotingBinaryHoleFilling(image1=imgLeftHand , radius=[2] * 3,  majorityThreshold=1, backgroundValue=0, foregroundValue=labelLeftHand )
-      #outI2 = sitk.Multiply(imgSmooth, sitk.Cast(imgLeftHandNoHoles, sitk.sitkFloat64))
-      outI2 = imgLeftHandNoHoles
-    elif processingSelector.currentText == "contouring":
-      # step 1)filtering: noise reduction
-      imgSmooth = sitk.CurvatureFlow(image1=outputImage, timeStep=0.125, numberOfIterations=5)
-      # step 2) filtering: segmentation
-      lstSeeds = [(247, 86)]
-      labelLeftHand = 1
-      imgLeftHand = sitk.ConnectedThreshold(image1=imgSmooth, seedList=lstSeeds, lower=tempMin, upper=tempMax,
-                                            replaceValue=labelLeftHand)
-      # step 3) create image to display
-      imgSmoothInt = sitk.Cast(sitk.RescaleIntensity(imgSmooth), imgLeftHand.GetPixelID())
-      # Use 'LabelOverlay' to overlay 'imgSmooth' and 'imgWhiteMatter'
-      imgLeftHandNoHoles = sitk.VotingBinaryHoleFilling(image1=imgLeftHand, radius=[2] * 3, majorityThreshold=1, backgroundValue=0, foregroundValue=labelLeftHand)
-
-      #imageContourning=sitk.Cast(sitk.LabelContour(imgLeftHandNoHoles), sitk.sitkUInt16)
-      #outI2 = imageContourning*16383
-      imageContourning = (sitk.Cast(sitk.LabelContour(imgLeftHandNoHoles), sitk.sitkFloat64))*16383
-      # outI2 = sitk.LabelOverlay(imgSmoothInt, sitk.LabelContour(imgLeftHandNoHoles ))
-      outI2 = sitk.LabelOverlay(imgSmoothInt, sitk.Cast(sitk.LabelContour(imgLeftHandNoHoles), imgLeftHand.GetPixelID()))
-
-      #outI2 = sitk.Cast(outI, sitk.sitkFloat64)
-
-    else:
-      print("unknown processing")
-
-    # step4) Push image to VTK volume
-    # if not processedVolume:
-    #  print("output node should exist and be selected before processing is performed")
-    volumesLogic = slicer.modules.volumes.logic()
-    processedVolume = volumesLogic.CloneVolume(slicer.mrmlScene, workingSelector.currentNode(), 'processedVolume')
-
-    workingSelector.setCurrentNode(processedVolume)
-    # processedVolume= workingSelector.currentNode()
-    outNode = sitkUtils.PushVolumeToSlicer(outI2, targetNode=workingSelector.currentNode(), name=None, className='vtkMRMLScalarVolumeNode')
-
-    # step 4) display image in green Slice viwer
-    lm = slicer.app.layoutManager()
-    green = lm.sliceWidget('green')
-    greenLogic = green.sliceLogic()
-    greenLogic.GetSliceCompositeNode().SetBackgroundVolumeID(workingSelector.currentNode().GetID())
-    green.setSliceOrientation('Axial')
-    view = green.sliceView()
-    view.forceRender()
-    # Set the orientation to axial
-    greenLogic.GetSliceNode().UpdateMatrices()
-    greenLogic.EndSliceNodeInteraction()
 
+    with self.profiler.run('runProcessing', parameters.mode):
+      try:
+        parameters = parameters.copy(seeds=self.footSeeds(workingSelector.currentNode(), parameters.zslice, rightCoordinatesRAS, leftCoordinatesRAS))
+      except ValueError as e:
+        logging.error("processing failed: %s" % e)
+        return
+      volumeNode = workingSelector.currentNode()
+      result = self.processingGraph.run(lambda: self.pullSlice(volumeNode, parameters.zslice), parameters,
+                                        self.sliceKey(volumeNode, parameters.zslice), observer=self.profiler.engineObserver())
+
+      # step4) Push the result to its output node and display it in green Slice viwer
+      self.visualizationResult(workingSelector, 'green', result)
     return
 
+  #
+  # Background execution
+  #
+  # The *Async variants read the working slice on the main thread, run the
+  # engine on a worker thread and push the result to the scene from the
+  # main thread once the run finishes. A new request cancels the running
+  # one of the same kind, whose result is then dropped.
+  #
+
+  def submitBackgroundJob(self, channel, pipeline, onFinished):
+    job = self.backgroundRunner.submit(channel, pipeline)
+    # only the latest job of a channel is ever handled
+    self.backgroundHandlers[channel] = (job.id, onFinished)
+    if not self.pollTimer.isActive():
+      self.pollTimer.start()
+    return job
+
+  def onPollBackgroundJobs(self):
+    failed = None
+    for job in self.backgroundRunner.takeFinished():
+      jobId, onFinished = self.backgroundHandlers.pop(job.channel, (None, None))
+      if jobId != job.id:
+        continue
+      if job.error is not None:
+        logging.error("%s failed: %s" % (job.channel, job.error))
+        failed = job
+      else:
+        onFinished(job.result)
+    running = self.backgroundRunner.running()
+    if self.progressCallback is not None:
+      if running:
+        self.progressCallback(running[-1].stage, running[-1].progress)
+      elif failed is not None:
+        self.progressCallback("%s failed" % failed.channel, failed.progress)
+      else:
+        self.progressCallback("done", 1.0)
+    if not running:
+      self.pollTimer.stop()
+
+  def cancelBackgroundJobs(self):
+    self.backgroundRunner.cancel()
+
+  def runProcessingAsync(self, workingSelector, processingSelector,tempMin,tempMax, rightCoordinatesRAS=None, leftCoordinatesRAS=None):
+    parameters = self.processingParameters(processingSelector, tempMin, tempMax)
+    if parameters.mode == ProcessingEngine.MODE_ORIGINAL:
+      logging.info("no processing required")
+      return None
+
+    volumeNode = workingSelector.currentNode()
+    try:
+      parameters.validate()
+      parameters = parameters.copy(seeds=self.footSeeds(volumeNode, parameters.zslice, rightCoordinatesRAS, leftCoordinatesRAS))
+    except ValueError as e:
+      logging.error("processing failed: %s" % e)
+      return None
+    key = self.sliceKey(volumeNode, parameters.zslice)
+    # the run spans submission to display; a cancelled job leaves no total record
+    run = self.profiler.beginRun('runProcessingAsync', parameters.mode)
+    with self.profiler.activeRun(run):
+      # the scene is only read from the main thread
+      inputImage = self.pullSlice(volumeNode, parameters.zslice)
+
+    def pipeline(observer=None):
+      observer = ProcessingEngine.chainObservers(observer, self.profiler.engineObserver(run))
+      return self.processingGraph.run(inputImage, parameters, key, observer=observer)
+
+    def onFinished(result):
+      with self.profiler.activeRun(run):
+        self.visualizationResult(workingSelector, 'green', result)
+      self.profiler.endRun(run)
+
+    return self.submitBackgroundJob('processing', pipeline, onFinished)
+
+  def runSegmentationAsync(self, workingSelector, processingSelector,tempMin,tempMax, rightCoordinatesRAS, leftCoordinatesRAS):
+    volumeNode = workingSelector.currentNode()
+    parameters = self.processingParameters(processingSelector, tempMin, tempMax)
+    try:
+      parameters = parameters.copy(seeds=self.footSeeds(volumeNode, parameters.zslice, rightCoordinatesRAS, leftCoordinatesRAS))
+    except ValueError as e:
+      logging.error("segmentation failed: %s" % e)
+      return None
+    run = self.profiler.beginRun('runSegmentationAsync', parameters.mode)
+    with self.profiler.activeRun(run):
+      inputImage = self.pullSlice(volumeNode, parameters.zslice)
+
+    hotSpotThreshold = self.hotSpotThreshold
+    subregions = self.subregionStatistics
+
+    def pipeline(observer=None):
+      observer = ProcessingEngine.chainObservers(observer, self.profiler.engineObserver(run))
+      # each step reports its own 0-1 progress: map them to one range of the job each
+      result = self.segmentFeetCached(inputImage, parameters, observer=ProcessingEngine.progressRange(observer, 0.0, 0.7))
+      asymmetry = self.asymmetryOf(result, hotSpotThreshold, ProcessingEngine.progressRange(observer, 0.7, 0.9))
+      ProcessingEngine.reportStage(observer, "statistics", 0.9)
+      statistics = self.statisticsOf(result, asymmetry, subregions)
+      ProcessingEngine.reportStage(observer, "done", 1.0)
+      return result, asymmetry, statistics
+
+    def onFinished(results):
+      result, self.asymmetry, self.statistics = results
+      with self.profiler.activeRun(run):
+        self.visualizationLabels(workingSelector, "Yellow+", result.mask, "FootLabels")
+        if self.asymmetry is not None:
+          self.visualizationAsymmetry(workingSelector, self.asymmetry)
+        self.statisticsTable(self.statistics)
+      self.profiler.endRun(run)
+      logging.info("Images processed")
+
+    return self.submitBackgroundJob('segmentation', pipeline, onFinished)
+
+  def runSequence(self, workingSelector, processingSelector,tempMin,tempMax, rightCoordinatesRAS, leftCoordinatesRAS):
+    """
+    Segment both feet on every frame (slice) of the working volume, carrying
+    the seeds and region of interest of each frame to the next one.
+    Labels go to the 'SequenceLabels' label map and the per-frame foot
+    temperatures and contralateral differences to the 'SequenceTemperatures' table.
+    """
+    volumeNode = workingSelector.currentNode()
+    # without markups the feet are detected on the first frame
+    try:
+      parameters = self.processingParameters(processingSelector, tempMin, tempMax,
+                                             seeds=self.markupSeeds(volumeNode, rightCoordinatesRAS, leftCoordinatesRAS))
+    except ValueError as e:
+      logging.error("sequence segmentation failed: %s" % e)
+      return None
+
+    labelNode = self.outputNodes.labelNode('SequenceLabels')
+    dimensions = volumeNode.GetImageData().GetDimensions()
+    slicer.util.updateVolumeFromArray(labelNode, np.zeros(tuple(reversed(dimensions)), np.uint8))
+    labelNode.CopyOrientation(volumeNode)
+    labelArray = slicer.util.arrayFromVolume(labelNode)
+
+    rows = []
+    with self.profiler.run('runSequence', parameters.mode):
+      cacheKey = self.resultCache.key('sequence', [slicer.util.arrayFromVolume(volumeNode)],
+                                      (parameters.segmentationKey(), self.hotSpotThreshold))
+      entry = self.resultCache.get(cacheKey)
+      if entry is not None:
+        with self.profiler.stage('cache'):
+          labelArray[:] = entry.array('labels')
+          rows = entry.data['rows']
+      else:
+        with self.profiler.stage('segmentation'):
+          for frameResult in FrameStream.streamSegmentation(VolumeBridge.iterateSlices(volumeNode), parameters,
+                                                            hotSpotThreshold=self.hotSpotThreshold):
+            labelArray[frameResult.index] = sitk.GetArrayViewFromImage(frameResult.labelMap)
+            rows.append(self.sequenceRow(frameResult))
+        self.resultCache.put(cacheKey, {'labels': sitk.GetImageFromArray(labelArray)}, {'rows': rows})
+
+      with self.profiler.stage('push'):
+        slicer.util.arrayFromVolumeModified(labelNode)
+        tableNode = self.sequenceTable(rows)
+
+    logging.info("Sequence processed: %d frames" % len(rows))
+    return labelNode, tableNode
+
+  def sequenceColumns(self):
+    """(label, column name prefix) of the per-frame sequence tables"""
+    return ((ProcessingEngine.RIGHT_FOOT_LABEL, "Right"), (ProcessingEngine.LEFT_FOOT_LABEL, "Left"))
+
+  def sequenceRow(self, frameResult):
+    """'SequenceTemperatures' table row of a FrameStream.FrameResult"""
+    row = [frameResult.index]
+    for label, name in self.sequenceColumns():
+      statistics = frameResult.statistics[label]
+      row += [statistics["mean"], statistics["min"], statistics["max"], statistics["area"]]
+    asymmetry = frameResult.asymmetry
+    if asymmetry is None:
+      row += [float("nan"), 0]
+    else:
+      row += [float(sitk.GetArrayViewFromImage(asymmetry.deltaT).max()), sum(region["area"] for region in asymmetry.regions)]
+    return row
+
+  def sequenceTable(self, rows):
+    """Write the per-frame rows to the 'SequenceTemperatures' table"""
+    tableNode = self.outputNodes.node('SequenceTemperatures', 'vtkMRMLTableNode')
+    columnNames = ["Frame"]
+    for label, name in self.sequenceColumns():
+      columnNames += [name + " mean", name + " min", name + " max", name + " area (px)"]
+    columnNames += ["Max dT", "Hot spot area (px)"]
+    slicer.util.updateTableFromArray(tableNode, np.array(rows, dtype=np.float64), columnNames)
+    return tableNode
+
+  #
+  # Raw radiometric files
+  #
+  # Frames are read memory-mapped and calibrated one at a time (see
+  # RadiometricReader), so a sequence is analyzed without loading it.
+  #
+
+  def loadRadiometric(self, path, start=0, stop=None, name=None):
+    """Load frames start to stop (excluded) of a raw radiometric file as a volume of temperatures"""
+    radiometricFile = RadiometricReader.RadiometricFile(path)
+    with self.profiler.run('loadRadiometric'):
+      with self.profiler.stage('pull'):
+        temperatures = radiometricFile.volumeArray(start, stop)
+      with self.profiler.stage('push'):
+        volumeNode = slicer.util.addVolumeFromArray(temperatures, name=name or os.path.splitext(os.path.basename(path))[0])
+        volumeNode.SetSpacing(radiometricFile.spacing + (1.0,))
+    logging.info("Loaded %d of %d frames of %s" % (temperatures.shape[0], len(radiometricFile), path))
+    return volumeNode
+
+  def runRadiometricSequence(self, path, processingSelector, tempMin, tempMax, start=0, stop=None):
+    """
+    Segment both feet on frames start to stop (excluded) of a raw
+    radiometric file, streamed from disk, and write the per-frame foot
+    temperatures and contralateral differences to the 'SequenceTemperatures'
+    table. The feet are detected on the first frame.
+    """
+    radiometricFile = RadiometricReader.RadiometricFile(path)
+    parameters = self.processingParameters(processingSelector, tempMin, tempMax)
+    rows = []
+    with self.profiler.run('runRadiometricSequence', parameters.mode):
+      with self.profiler.stage('segmentation'):
+        for frameResult in FrameStream.streamSegmentation(radiometricFile.frames(start, stop), parameters,
+                                                          hotSpotThreshold=self.hotSpotThreshold):
+          rows.append(self.sequenceRow(frameResult))
+          rows[-1][0] += start
+      with self.profiler.stage('push'):
+        tableNode = self.sequenceTable(rows)
+    logging.info("Sequence processed: %d frames of %s" % (len(rows), path))
+    return tableNode
+
+  def runStack(self, workingSelector, processingSelector,tempMin,tempMax, workers=None):
+    """
+    Run the selected processing on every slice of the working volume in
+    parallel and show the stacked result in the 'processedStack' volume, or
+    over the working volume from the 'processedStackLabels' label map.
+    """
+    volumeNode = workingSelector.currentNode()
+    parameters = self.processingParameters(processingSelector, tempMin, tempMax)
+    with self.profiler.run('runStack', parameters.mode):
+      try:
+        with self.profiler.stage('processing'):
+          outputs = StackProcessing.processSlices(VolumeBridge.iterateSlices(volumeNode), parameters, workers)
+      except ValueError as e:
+        logging.error("stack processing failed: %s" % e)
+        return None
+
+      with self.profiler.stage('push'):
+        outputArray = np.stack([sitk.GetArrayViewFromImage(output) for output in outputs])
+        # masks and outlines are uint8 labels, shown over the working volume
+        isLabels = outputArray.dtype == np.uint8
+        stackVolume = self.outputNodes.labelNode('processedStackLabels') if isLabels else self.outputNodes.node('processedStack')
+        slicer.util.updateVolumeFromArray(stackVolume, outputArray)
+        stackVolume.CopyOrientation(volumeNode)
+      if isLabels:
+        self.showLabelsInViewer('Green+', volumeNode, stackVolume)
+      else:
+        self.showInViewer('Green+', stackVolume)
+    return stackVolume
+
+  #
+  # Live acquisition
+  #
+  # Frames of a live source are processed newest first on the threads of
+  # LiveAcquisition; the poll timer pushes the latest frame to the
+  # 'liveVolume' node, which becomes the working volume, and its result to
+  # the green viewer.
+  #
+
+  def liveSource(self, sourceType, path=None, port=None):
+    """LiveAcquisition frame source of one of LIVE_SOURCES"""
+    if sourceType == self.LIVE_SOURCES[0]:
+      return LiveAcquisition.ReplaySource.fromRadiometricFile(path, loop=True)
+    if sourceType == self.LIVE_SOURCES[1]:
+      if not os.path.isdir(path or ""):
+        raise ValueError("%r is not a directory" % path)
+      return LiveAcquisition.DirectorySource(path)
+    if sourceType == self.LIVE_SOURCES[2]:
+      return LiveAcquisition.SocketSource(port or LiveAcquisition.DEFAULT_PORT)
+    raise ValueError("unknown live source %r, expected one of %s" % (sourceType, ", ".join(self.LIVE_SOURCES)))
+
+  def updateLiveParameters(self, processingSelector, tempMin, tempMax, rightCoordinatesRAS=None, leftCoordinatesRAS=None):
+    """Parameters of the next live frames; without both markups the feet are detected on every frame"""
+    liveNode = self.outputNodes.find('liveVolume')
+    seeds = []
+    if liveNode is not None and liveNode.GetImageData() is not None:
+      seeds = self.markupSeeds(liveNode, rightCoordinatesRAS, leftCoordinatesRAS)
+    parameters = self.processingParameters(processingSelector, tempMin, tempMax, seeds=seeds)
+    parameters.validate()
+    # read by the processing thread at its next frame
+    self.liveParameters = parameters
+
+  def processLiveFrame(self, image):
+    return ProcessingEngine.runProcessing(image, self.liveParameters)
+
+  def startLive(self, source, workingSelector, processingSelector, tempMin, tempMax, rightCoordinatesRAS=None, leftCoordinatesRAS=None):
+    """Process the frames of source live until stopLive or the end of the source"""
+    self.stopLive()
+    self.updateLiveParameters(processingSelector, tempMin, tempMax, rightCoordinatesRAS, leftCoordinatesRAS)
+    self.liveSelector = workingSelector
+    self.live = LiveAcquisition.LiveAcquisition(source, self.processLiveFrame).start()
+    self.liveTimer.start()
+    return self.live
+
+  def onPollLive(self):
+    live = self.live
+    if live is None:
+      return
+    running = live.isRunning()
+    taken = live.takeResult()
+    if taken is not None:
+      frame, result = taken
+      liveNode = self.outputNodes.node('liveVolume')
+      with self.profiler.run('live', result.mode, frame.image):
+        with self.profiler.stage('push', frame.image):
+          liveNode.SetSpacing(tuple(frame.image.GetSpacing()[0:2]) + (1.0,))
+          VolumeBridge.pushSlice(frame.image, liveNode, liveNode)
+        if self.liveSelector.currentNode() != liveNode:
+          self.liveSelector.setCurrentNode(liveNode)
+        self.visualizationResult(self.liveSelector, 'green', result)
+      live.displayed(frame)
+    if self.liveCallback is not None and (taken is not None or not running):
+      self.liveCallback(live.metrics, running)
+    if not running and taken is None:
+      self.stopLive()
+
+  def stopLive(self):
+    """Stop the live acquisition, if any, and log its metrics"""
+    if self.live is None:
+      return
+    live, self.live = self.live, None
+    self.liveTimer.stop()
+    live.stop()
+    if live.error is not None:
+      logging.error("live source failed: %s" % live.error)
+    logging.info("Live acquisition stopped: %s" % live.metrics.formatSummary())
+
 
   # def hasImageData(self,volumeNode):
   #   """This is an example logic method that
@@ -574,6 +1348,26 @@ class IrBaseUlcerDetectionTest(ScriptedLoadableModuleTest):
     """
     self.setUp()
     self.test_IrBaseUlcerDetection1()
+    self.test_ProcessingEngine()
+    self.setUp()
+    self.test_OutputNodeReuse()
+    self.test_StageGraph()
+    self.test_StackProcessing()
+    self.test_BackgroundRunner()
+    self.test_FrameStream()
+    self.test_Profiler()
+    self.test_CroppedProcessing()
+    self.test_TiledProcessing()
+    self.test_LiveAcquisition()
+    self.test_LazyImport()
+    self.test_HoleFilling()
+    self.setUp()
+    self.test_SeedDetection()
+    self.test_Asymmetry()
+    self.test_ResultCache()
+    self.test_RadiometricReader()
+    self.test_RegionStatistics()
+    self.test_BatchProcessing()
 
   def test_IrBaseUlcerDetection1(self):
     """ Ideally you should have several levels of tests.  At the lowest level
@@ -610,3 +1404,659 @@ class IrBaseUlcerDetectionTest(ScriptedLoadableModuleTest):
     logic = IrBaseUlcerDetectionLogic()
     # self.assertIsNotNone( logic.hasImageData(volumeNode) )
     self.delayDisplay('Test passed!')
+
+  def test_ProcessingEngine(self):
+    """ The engine runs every mode on a plain SimpleITK image, without the scene.
+    """
+    self.delayDisplay("Starting the processing engine test")
+
+    # background at 20 degrees with a 32 degrees square "foot" around the seed
+    image = sitk.Image(64, 48, 1, sitk.sitkFloat64) + 20.0
+    image[10:30, 10:40, 0] = 32.0
+    parameters = ProcessingEngine.ProcessingParameters(tempMin=27.0, tempMax=35.0, seeds=[(20, 20)])
+
+    for mode in ProcessingEngine.PROCESSING_MODES:
+      result = ProcessingEngine.runProcessing(image, parameters.copy(mode=mode))
+      self.assertEqual(result.image.GetSize()[0:2], (64, 48))
+
+    result = ProcessingEngine.runProcessing(image, parameters.copy(mode=ProcessingEngine.MODE_SEGMENTATION))
+    # smoothing rounds the corners of the square off
+    area = sitk.GetArrayViewFromImage(result.mask).sum()
+    self.assertTrue(0.95 * 20 * 30 < area <= 20 * 30)
+
+    # the outline is a label map, not an RGB overlay
+    result = ProcessingEngine.runProcessing(image, parameters.copy(mode=ProcessingEngine.MODE_CONTOURING))
+    self.assertEqual(result.image.GetPixelID(), sitk.sitkUInt8)
+    self.assertEqual(set(np.unique(sitk.GetArrayViewFromImage(result.image))), {0, ProcessingEngine.CONTOUR_LABEL})
+
+    with self.assertRaises(ValueError):
+      ProcessingEngine.runProcessing(image, parameters.copy(mode="unknown"))
+    # seeds of markups placed off the frame, past either edge
+    for seeds in ([(70, 20)], [(-1, 20)], [(20, 48)]):
+      with self.assertRaises(ValueError):
+        ProcessingEngine.runProcessing(image, parameters.copy(seeds=seeds))
+      with self.assertRaises(ValueError):
+        StageGraph.ProcessingGraph().run(image, parameters.copy(seeds=seeds))
+
+    # threshold index lookups match a new flood fill for every window
+    from IrBaseUlcerDetectionLib.ThresholdIndex import ThresholdIndex
+    index = ThresholdIndex(result.smoothed, parameters.seeds)
+    for tempMin, tempMax in [(27.0, 35.0), (25.5, 35.0), (31.99, 35.0), (31.99, 32.5), (15.0, 25.0)]:
+      flooded = ProcessingEngine.segmentRegion(result.smoothed, parameters.seeds, tempMin, tempMax)
+      looked = index.region(tempMin, tempMax)
+      self.assertEqual(sitk.GetArrayViewFromImage(flooded).tolist(), sitk.GetArrayViewFromImage(looked).tolist())
+    self.assertEqual(list(index.areaByTempMin(35.0, [27.0, 40.0])), [area, 0])
+
+    # float32 pixels on the 0.01 grid (median smoothing, linear radiometric frames), bounds on the pixel values
+    values = np.round(np.random.RandomState(0).uniform(30.0, 34.0, (40, 50)), 2).astype(np.float32)
+    values[20, 25] = 33.0
+    gridImage = sitk.GetImageFromArray(values)
+    index = ThresholdIndex(gridImage, [(25, 20)])
+    for tempMin in sorted(set(round(float(value), 2) for value in values[15:25, 20:30].flat if value <= 33.0)):
+      for tempMax in (33.0, 33.5, 34.0):
+        flooded = sitk.GetArrayFromImage(sitk.ConnectedThreshold(gridImage, seedList=[(25, 20)], lower=tempMin, upper=tempMax))
+        self.assertEqual(index.regionArray(tempMin, tempMax).tolist(), (flooded != 0).tolist())
+        self.assertEqual(index.areaByTempMax(tempMin, [tempMax])[0], (flooded != 0).sum())
+
+    # compact precisions: float32 computation, uint16 encoded temperatures
+    result = ProcessingEngine.runProcessing(image, parameters.copy(mode=ProcessingEngine.MODE_SMOOTHING, precision=ProcessingEngine.PRECISION_UINT16))
+    self.assertEqual(result.smoothed.GetPixelID(), sitk.sitkFloat32)
+    self.assertEqual(result.image.GetPixelID(), sitk.sitkUInt16)
+    self.assertAlmostEqual(ProcessingEngine.decodeTemperatures(result.image)[20, 20], 32.0, places=1)
+
+    # dual-foot run: one label per seed, from a single smoothing pass
+    image[40:60, 10:40, 0] = 31.0
+    result = ProcessingEngine.segmentFeet(image, parameters.copy(seeds=[(20, 20), (50, 20)]))
+    labels = sitk.GetArrayViewFromImage(result.mask)
+    self.assertEqual(labels[20, 20], ProcessingEngine.RIGHT_FOOT_LABEL)
+    self.assertEqual(labels[20, 50], ProcessingEngine.LEFT_FOOT_LABEL)
+
+    # every smoothing backend keeps the flat regions and the computation pixel type
+    for smoothing in ProcessingEngine.SMOOTHING_METHODS:
+      result = ProcessingEngine.runProcessing(image, parameters.copy(mode=ProcessingEngine.MODE_SEGMENTATION, smoothing=smoothing))
+      self.assertEqual(result.smoothed.GetPixelID(), sitk.sitkFloat32)
+      self.assertAlmostEqual(result.smoothed[20, 20], 32.0, places=3)
+    with self.assertRaises(ValueError):
+      ProcessingEngine.runProcessing(image, parameters.copy(smoothing="unknown"))
+    self.delayDisplay('Test passed!')
+
+  def test_OutputNodeReuse(self):
+    """ Repeated runs write into the same output nodes instead of cloning new ones.
+    """
+    self.delayDisplay("Starting the output node reuse test")
+    import numpy as np
+
+    temperatures = np.full((1, 48, 64), 20.0)
+    temperatures[0, 10:40, 10:30] = 32.0
+    workingNode = slicer.util.addVolumeFromArray(temperatures, name='workingVolume')
+    workingSelector = slicer.qMRMLNodeComboBox()
+    workingSelector.nodeTypes = ["vtkMRMLScalarVolumeNode"]
+    workingSelector.setMRMLScene(slicer.mrmlScene)
+    workingSelector.setCurrentNode(workingNode)
+
+    logic = IrBaseUlcerDetectionLogic()
+    # temperatures go to a volume node and masks to a label map node: create both first
+    for mode in ProcessingEngine.PROCESSING_MODES:
+      logic.runProcessing(workingSelector, mode, 27.0, 35.0)
+    numberOfNodes = slicer.mrmlScene.GetNumberOfNodes()
+    for mode in ProcessingEngine.PROCESSING_MODES * 3:
+      logic.runProcessing(workingSelector, mode, 27.0, 35.0)
+    self.assertEqual(slicer.mrmlScene.GetNumberOfNodes(), numberOfNodes)
+    self.assertEqual(workingSelector.currentNode(), workingNode)
+
+    logic.outputNodes.clear()
+    self.assertEqual(logic.outputNodes.nodes(), [])
+    self.delayDisplay('Test passed!')
+
+  def test_StageGraph(self):
+    """ Changing the mode or a downstream parameter only recomputes the stages after it.
+    """
+    self.delayDisplay("Starting the stage graph test")
+
+    image = sitk.Image(64, 48, sitk.sitkFloat32) + 20.0
+    image[10:30, 10:40] = 32.0
+    image[18:22, 18:22] = 20.0
+    parameters = ProcessingEngine.ProcessingParameters(seeds=[(12, 12)])
+    graph = StageGraph.ProcessingGraph()
+
+    def computedStages(**changes):
+      stages = []
+      result = graph.run(image, parameters.copy(**changes), "image", observer=lambda stage, progress: stages.append(stage))
+      reference = ProcessingEngine.runProcessing(image, parameters.copy(cropMargin=None, **changes))
+      self.assertEqual(sitk.GetArrayViewFromImage(result.image).tolist(), sitk.GetArrayViewFromImage(reference.image).tolist())
+      return stages[:-1]
+
+    self.assertEqual(computedStages(mode=ProcessingEngine.MODE_SEGMENTATION),
+                     ["extraction", "smoothing", "threshold index", "segmentation", "masked temperatures"])
+    self.assertEqual(computedStages(mode=ProcessingEngine.MODE_SEGMENTATION_NO_HOLES), ["hole filling"])
+    self.assertEqual(computedStages(mode=ProcessingEngine.MODE_CONTOURING), ["contouring"])
+    self.assertEqual(computedStages(mode=ProcessingEngine.MODE_SEGMENTATION), [])
+    self.assertEqual(computedStages(mode=ProcessingEngine.MODE_CONTOURING, tempMin=25.0), ["segmentation", "hole filling", "contouring"])
+    self.assertEqual(computedStages(mode=ProcessingEngine.MODE_CONTOURING, holeRadius=3), ["hole filling", "contouring"])
+
+    # the least recently used results go once over the size bound
+    graph.maxBytes = 64 * 48 * 4
+    computedStages(mode=ProcessingEngine.MODE_SMOOTHING, sigma=2.0, smoothing=ProcessingEngine.SMOOTHING_GAUSSIAN)
+    self.assertLessEqual(graph.totalBytes(), graph.maxBytes)
+    self.assertIn("smoothing", computedStages(mode=ProcessingEngine.MODE_SEGMENTATION))
+
+    # the threshold index builds its level maps on the region lookup, after it was memoized: they count too
+    graph = StageGraph.ProcessingGraph(maxBytes=64 * 48 * 13)
+    segmentation = parameters.copy(mode=ProcessingEngine.MODE_SEGMENTATION)
+    graph.run(image, segmentation, "image")
+    self.assertLessEqual(sum(StageGraph.valueBytes(result) for result in graph.memo.values()), graph.maxBytes)
+    self.assertLessEqual(graph.totalBytes(), graph.maxBytes)
+    self.delayDisplay('Test passed!')
+
+  def test_StackProcessing(self):
+    """ Slices processed in parallel, on threads or processes, equal one runProcessing per slice.
+    """
+    self.delayDisplay("Starting the stack processing test")
+    from IrBaseUlcerDetectionLib import SyntheticThermogram
+
+    slices = [SyntheticThermogram.footThermogram(96, 64, noiseSeed=zslice)[0] for zslice in range(3)]
+    seeds = SyntheticThermogram.footThermogram(96, 64)[1]
+    for mode in (ProcessingEngine.MODE_SMOOTHING, ProcessingEngine.MODE_CONTOURING):
+      parameters = ProcessingEngine.ProcessingParameters(mode=mode, seeds=seeds)
+      expected = [sitk.GetArrayFromImage(ProcessingEngine.runProcessing(image, parameters).image).tolist() for image in slices]
+      for useProcesses in (False, True):
+        outputs = StackProcessing.processSlices(slices, parameters, workers=2, useProcesses=useProcesses)
+        self.assertEqual([sitk.GetArrayFromImage(output).tolist() for output in outputs], expected)
+
+    # invalid parameters are logged, not raised into the button slot
+    workingNode = slicer.util.addVolumeFromArray(np.stack([sitk.GetArrayFromImage(image) for image in slices]), name='workingVolume')
+    workingSelector = slicer.qMRMLNodeComboBox()
+    workingSelector.nodeTypes = ["vtkMRMLScalarVolumeNode"]
+    workingSelector.setMRMLScene(slicer.mrmlScene)
+    workingSelector.setCurrentNode(workingNode)
+    logic = IrBaseUlcerDetectionLogic()
+    self.assertIsNone(logic.runStack(workingSelector, ProcessingEngine.MODE_SEGMENTATION, 35.0, 27.0, workers=2))
+    self.assertIsNotNone(logic.runStack(workingSelector, ProcessingEngine.MODE_SMOOTHING, 27.0, 35.0, workers=2))
+    self.delayDisplay('Test passed!')
+
+  def test_BackgroundRunner(self):
+    """ A new job cancels the running one of its channel and only the latest result is kept.
+    """
+    self.delayDisplay("Starting the background runner test")
+    import time
+
+    image = sitk.Image(256, 256, sitk.sitkFloat64) + 30.0
+    parameters = ProcessingEngine.ProcessingParameters(mode=ProcessingEngine.MODE_CONTOURING, seeds=[(128, 128)])
+    runner = BackgroundRunner.BackgroundRunner()
+    first = runner.submit('processing', ProcessingEngine.runProcessing, image, parameters)
+    second = runner.submit('processing', ProcessingEngine.runProcessing, image, parameters.copy(mode=ProcessingEngine.MODE_SMOOTHING))
+    while runner.running():
+      time.sleep(0.01)
+
+    self.assertTrue(first.isCancelled())
+    self.assertEqual(runner.takeFinished(), [second])
+    self.assertEqual(second.result.mode, ProcessingEngine.MODE_SMOOTHING)
+
+    # failed jobs are returned with their error; a channel does not wait behind another one
+    import threading
+    release = threading.Event()
+    blocked = runner.submit('processing', lambda observer=None: release.wait(10.0))
+    failing = runner.submit('segmentation', ProcessingEngine.runProcessing, image, parameters.copy(mode="unknown"))
+    while not failing.isDone():
+      time.sleep(0.01)
+    self.assertFalse(blocked.isDone())
+    self.assertEqual(runner.takeFinished(), [failing])
+    self.assertIsInstance(failing.error, ValueError)
+    release.set()
+    runner.shutdown()
+    self.delayDisplay('Test passed!')
+
+  def test_FrameStream(self):
+    """ Streaming follows two warm squares drifting across the frames.
+    """
+    self.delayDisplay("Starting the frame stream test")
+
+    def frames():
+      for shift in range(10):
+        frame = sitk.Image(96, 64, sitk.sitkFloat64) + 20.0
+        frame[10 + shift:30 + shift, 10:50] = 32.0
+        frame[50 + shift:70 + shift, 10:50] = 31.0
+        yield frame
+
+    parameters = ProcessingEngine.ProcessingParameters(tempMin=27.0, tempMax=35.0, seeds=[(12, 30), (52, 30)])
+    results = list(FrameStream.streamSegmentation(frames(), parameters))
+    self.assertEqual(len(results), 10)
+    self.assertTrue(all(result.cropped for result in results[1:]))
+    last = results[-1]
+    labels = sitk.GetArrayViewFromImage(last.labelMap)
+    self.assertEqual(labels[30, 25], ProcessingEngine.RIGHT_FOOT_LABEL)
+    self.assertEqual(labels[30, 65], ProcessingEngine.LEFT_FOOT_LABEL)
+    self.assertAlmostEqual(last.statistics[ProcessingEngine.LEFT_FOOT_LABEL]["mean"], 31.0, places=1)
+    self.delayDisplay('Test passed!')
+
+  def test_Profiler(self):
+    """ A profiled run records every engine stage, the scene stages and a total.
+    """
+    self.delayDisplay("Starting the profiler test")
+
+    image = sitk.Image(64, 48, sitk.sitkFloat32) + 30.0
+    parameters = ProcessingEngine.ProcessingParameters(mode=ProcessingEngine.MODE_CONTOURING, seeds=[(20, 20)])
+    profiler = Profiler()
+    with profiler.run('runProcessing', parameters.mode, image):
+      with profiler.stage('pull', image):
+        pass
+      ProcessingEngine.runProcessing(image, parameters, observer=profiler.engineObserver())
+    stages = [record["stage"] for record in profiler.records]
+    self.assertEqual(stages, ['pull', 'extraction', 'smoothing', 'segmentation', 'hole filling', 'contouring', 'total'])
+    self.assertTrue(all(record["imageSize"] == [64, 48] for record in profiler.records))
+    self.assertEqual(len(profiler.summary()), len(stages))
+
+    profiler.enabled = False
+    with profiler.run('runProcessing', parameters.mode, image):
+      ProcessingEngine.runProcessing(image, parameters, observer=profiler.engineObserver())
+    self.assertEqual(len(profiler.records), len(stages))
+
+    # memory growth is the stage's own, also below an earlier peak of the process
+    from IrBaseUlcerDetectionLib import Instrumentation
+    if Instrumentation.residentMemoryBytes() is not None:
+      profiler = Profiler()
+      with profiler.run('allocation'):
+        with profiler.stage('peak'):
+          peak = np.ones(64 * 1048576 // 8)
+          del peak
+        with profiler.stage('kept'):
+          kept = np.ones(32 * 1048576 // 8)
+      self.assertGreater(profiler.records[1]["memoryGrowthBytes"], 24 * 1048576)
+      del kept
+    self.delayDisplay('Test passed!')
+
+  def test_CroppedProcessing(self):
+    """ Processing on crops around the feet gives the full-frame regions.
+    """
+    self.delayDisplay("Starting the cropped processing test")
+    from IrBaseUlcerDetectionLib import SyntheticThermogram
+
+    image, seeds = SyntheticThermogram.footThermogram(320, 240)
+    for mode in ProcessingEngine.SEGMENTATION_MODES:
+      parameters = ProcessingEngine.ProcessingParameters(mode=mode, seeds=seeds[0:1])
+      cropped = ProcessingEngine.runProcessing(image, parameters)
+      full = ProcessingEngine.runProcessing(image, parameters.copy(cropMargin=None))
+      self.assertEqual(sitk.GetArrayViewFromImage(cropped.mask).tolist(), sitk.GetArrayViewFromImage(full.mask).tolist())
+
+    parameters = ProcessingEngine.ProcessingParameters(seeds=seeds)
+    cropped = ProcessingEngine.segmentFeet(image, parameters)
+    full = ProcessingEngine.segmentFeet(image, parameters.copy(cropMargin=None))
+    self.assertEqual(sitk.GetArrayViewFromImage(cropped.mask).tolist(), sitk.GetArrayViewFromImage(full.mask).tolist())
+    self.delayDisplay('Test passed!')
+
+  def test_TiledProcessing(self):
+    """ Tiles with halos stitch into the full-frame results, and the flood fill joins regions across tiles.
+    """
+    self.delayDisplay("Starting the tiled processing test")
+    import tempfile
+    from IrBaseUlcerDetectionLib import SyntheticThermogram, TiledProcessing
+
+    image, seeds = SyntheticThermogram.footThermogram(320, 240)
+    parameters = ProcessingEngine.ProcessingParameters(seeds=seeds, cropMargin=None)
+    for mode in ProcessingEngine.PROCESSING_MODES:
+      whole = ProcessingEngine.runProcessing(image, parameters.copy(mode=mode))
+      tiled = ProcessingEngine.runProcessing(image, parameters.copy(mode=mode, tileSize=70))
+      self.assertEqual(tiled.image.GetPixelID(), whole.image.GetPixelID())
+      self.assertEqual(sitk.GetArrayViewFromImage(tiled.image).tolist(), sitk.GetArrayViewFromImage(whole.image).tolist())
+
+    # many small components, seeds in some of them
+    values = np.random.RandomState(0).normal(30.0, 2.0, (150, 200)).astype(np.float32)
+    seedList = [(10, 10), (100, 75), (199, 149)]
+    flooded = sitk.ConnectedThreshold(sitk.GetImageFromArray(values), seedList=seedList, lower=28.0, upper=31.0)
+    for tileSize in (16, 45, 256):
+      tiled = TiledProcessing.connectedThreshold(values, seedList, 28.0, 31.0, tileSize=tileSize)
+      self.assertEqual(tiled.tolist(), sitk.GetArrayViewFromImage(flooded).tolist())
+
+    # out of core: memory-mapped input and output
+    with tempfile.TemporaryFile() as inputFile, tempfile.TemporaryFile() as outputFile:
+      mapped = np.memmap(inputFile, np.float32, "w+", shape=values.shape)
+      mapped[:] = values
+      output = np.memmap(outputFile, np.float32, "w+", shape=values.shape)
+      TiledProcessing.tiledFilter(mapped, lambda tile: sitk.Median(tile, [2, 2]), 2, 40, output=output)
+      self.assertEqual(output.tolist(), sitk.GetArrayViewFromImage(sitk.Median(sitk.GetImageFromArray(values), [2, 2])).tolist())
+    self.delayDisplay('Test passed!')
+
+  def test_LiveAcquisition(self):
+    """ A slow pipeline drops the stale frames, ends on the newest one and keeps its latency bounded.
+    """
+    self.delayDisplay("Starting the live acquisition test")
+    import socket
+    import threading
+    import time
+
+    images = [sitk.Image(64, 48, sitk.sitkFloat32) + float(index) for index in range(40)]
+    processingSeconds = 0.02
+
+    def process(image):
+      time.sleep(processingSeconds)
+      return image
+
+    live = LiveAcquisition.LiveAcquisition(LiveAcquisition.ReplaySource(images, frameInterval=0.002), process).start()
+    shown = []
+    while live.isRunning() or live.latest is not None:
+      taken = live.takeResult()
+      if taken is not None:
+        live.displayed(taken[0])
+        shown.append(taken[0].index)
+      time.sleep(0.001)
+    summary = live.metrics.summary()
+    self.assertEqual(summary["acquired"], len(images))
+    self.assertEqual(shown[-1], len(images) - 1)
+    self.assertEqual(summary["displayed"] + summary["dropped"], len(images))
+    self.assertGreater(summary["dropped"], len(images) // 2)
+    # waiting for the frame being processed, then processing: two frames at most
+    self.assertLess(summary["endToEndLatency"]["max"], 4 * processingSeconds)
+
+    # socket frames arrive unchanged
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen(1)
+
+    def serve():
+      connection, address = server.accept()
+      for image in images[0:3]:
+        LiveAcquisition.sendFrame(connection, image)
+      connection.close()
+
+    sender = threading.Thread(target=serve)
+    sender.start()
+    received = list(LiveAcquisition.SocketSource(server.getsockname()[1]).frames())
+    sender.join()
+    server.close()
+    self.assertEqual([sitk.GetArrayViewFromImage(image).tolist() for image in received],
+                     [sitk.GetArrayViewFromImage(image).tolist() for image in images[0:3]])
+
+    # the logic shows the live frames as the working volume
+    workingSelector = slicer.qMRMLNodeComboBox()
+    workingSelector.nodeTypes = ["vtkMRMLScalarVolumeNode"]
+    workingSelector.setMRMLScene(slicer.mrmlScene)
+    logic = IrBaseUlcerDetectionLogic()
+    logic.startLive(LiveAcquisition.ReplaySource(images[0:5]), workingSelector, ProcessingEngine.MODE_SMOOTHING, 27.0, 35.0)
+    while logic.live is not None:
+      logic.onPollLive()
+      time.sleep(0.01)
+    liveNode = logic.outputNodes.find('liveVolume')
+    self.assertEqual(workingSelector.currentNode(), liveNode)
+    self.assertEqual(float(slicer.util.arrayFromVolume(liveNode).max()), 4.0)
+    self.delayDisplay('Test passed!')
+
+  def test_LazyImport(self):
+    """ Lazily imported modules run on first use only, and the package import stays light.
+    """
+    self.delayDisplay("Starting the lazy import test")
+    import subprocess
+    import sys
+    import tempfile
+    from IrBaseUlcerDetectionLib import lazyImport
+
+    directory = tempfile.mkdtemp()
+    with open(os.path.join(directory, "irBaseLazyImportProbe.py"), "w") as probe:
+      probe.write("import sys\nsys.irBaseLazyImportRuns = getattr(sys, 'irBaseLazyImportRuns', 0) + 1\nVALUE = 42\n")
+    sys.path.insert(0, directory)
+    try:
+      module = lazyImport("irBaseLazyImportProbe")
+      self.assertEqual(getattr(sys, "irBaseLazyImportRuns", 0), 0)
+      self.assertEqual(module.VALUE, 42)
+      self.assertEqual(sys.irBaseLazyImportRuns, 1)
+      self.assertIs(lazyImport("irBaseLazyImportProbe"), module)
+    finally:
+      sys.path.remove(directory)
+      sys.modules.pop("irBaseLazyImportProbe", None)
+      del sys.irBaseLazyImportRuns
+
+    # the library imports of this file, in a fresh interpreter: numpy and SimpleITK must not be loaded
+    with open(os.path.abspath(__file__)) as moduleFile:
+      header = moduleFile.read().split("\nmoduleImportSeconds = ")[0]
+    imports = [line for line in header.splitlines() if line.startswith("from IrBaseUlcerDetectionLib") or " = lazyImport(" in line]
+    script = "\n".join(["import sys", "sys.path.insert(0, %r)" % os.path.dirname(os.path.abspath(__file__))] + imports + [
+      "print(sorted(set(name.split('.')[0] for name in sys.modules if name.startswith(('numpy.', 'SimpleITK.')))))"])
+    self.assertEqual(subprocess.check_output([sys.executable, "-c", script]).decode().split(), ["[]"])
+    self.delayDisplay('Test passed!')
+
+  def test_HoleFilling(self):
+    """ Every hole filling method gives its full-frame result on the mask box and by tiles.
+    """
+    self.delayDisplay("Starting the hole filling test")
+    from IrBaseUlcerDetectionLib import SyntheticThermogram
+
+    image, seeds = SyntheticThermogram.footThermogram(320, 240, coldSpots=20)
+    parameters = ProcessingEngine.ProcessingParameters(seeds=seeds, cropMargin=None)
+    mask = ProcessingEngine.runProcessing(image, parameters).mask
+    label = ProcessingEngine.FOREGROUND_LABEL
+
+    def pixels(image):
+      return sitk.GetArrayFromImage(image).tolist()
+
+    voting = sitk.VotingBinaryHoleFilling(image1=mask, radius=[parameters.holeRadius] * 2, majorityThreshold=1,
+                                          backgroundValue=0, foregroundValue=label)
+    self.assertEqual(pixels(ProcessingEngine.fillHoles(mask, parameters)), pixels(voting))
+    filled = sitk.BinaryFillhole(mask, fullyConnected=False, foregroundValue=label)
+    fillParameters = parameters.copy(holeFilling=ProcessingEngine.HOLE_FILLING_RECONSTRUCTION)
+    self.assertEqual(pixels(ProcessingEngine.fillHoles(mask, fillParameters)), pixels(filled))
+    # the cold spots left holes, which "small holes" fills up to holeArea
+    self.assertNotEqual(pixels(filled), pixels(mask))
+    areaParameters = parameters.copy(holeFilling=ProcessingEngine.HOLE_FILLING_AREA)
+    self.assertEqual(pixels(ProcessingEngine.fillHoles(mask, areaParameters.copy(holeArea=0))), pixels(mask))
+    self.assertEqual(pixels(ProcessingEngine.fillHoles(mask, areaParameters.copy(holeArea=mask.GetNumberOfPixels()))), pixels(filled))
+    for holeFilling in ProcessingEngine.HOLE_FILLING_METHODS:
+      whole = ProcessingEngine.fillHoles(mask, parameters.copy(holeFilling=holeFilling))
+      tiled = ProcessingEngine.fillHoles(mask, parameters.copy(holeFilling=holeFilling, tileSize=97))
+      self.assertEqual(pixels(tiled), pixels(whole))
+    self.delayDisplay('Test passed!')
+
+  def test_Asymmetry(self):
+    """ A warm patch of the left foot is a hot spot against the right foot, whatever the feet placement.
+    """
+    self.delayDisplay("Starting the asymmetry test")
+
+    labels = sitk.Image(96, 64, sitk.sitkUInt8)
+    labels[10:30, 10:50] = ProcessingEngine.RIGHT_FOOT_LABEL
+    # 4 pixels right and down of the mirror position of the right foot
+    labels[62:82, 14:54] = ProcessingEngine.LEFT_FOOT_LABEL
+    temperatures = sitk.Cast(labels != 0, sitk.sitkFloat32) * 10.0 + 20.0
+    temperatures[68:74, 30:36] = 34.0
+    for transformType in Asymmetry.TRANSFORMS:
+      asymmetry = Asymmetry.asymmetryMap(temperatures, labels, transformType=transformType)
+      self.assertGreater(asymmetry.overlap, 0.95)
+      deltaT = sitk.GetArrayViewFromImage(asymmetry.deltaT)
+      self.assertAlmostEqual(deltaT[32, 70], 4.0, places=1)
+      self.assertAlmostEqual(deltaT[28, 20], -4.0, places=1)
+      self.assertEqual([(region["label"], region["area"]) for region in asymmetry.regions], [(ProcessingEngine.LEFT_FOOT_LABEL, 36)])
+
+    # chained as in a background segmentation: one progress range per step, no "done" in the middle
+    reports = []
+    record = lambda stage, progress: reports.append((stage, progress))
+    parameters = ProcessingEngine.ProcessingParameters(seeds=[(20, 30), (72, 34)])
+    feet = ProcessingEngine.segmentFeet(temperatures, parameters, observer=ProcessingEngine.progressRange(record, 0.0, 0.7))
+    Asymmetry.asymmetryMap(feet.smoothed, feet.mask, observer=ProcessingEngine.progressRange(record, 0.7, 0.9))
+    progress = [each for stage, each in reports]
+    self.assertEqual(progress, sorted(progress))
+    self.assertEqual(reports[-1], ("asymmetry", 0.7))
+    self.assertNotIn("done", [stage for stage, each in reports])
+    self.delayDisplay('Test passed!')
+
+  def test_ResultCache(self):
+    """ Cached images come back with their geometry, the least recently used entries go first.
+    """
+    self.delayDisplay("Starting the result cache test")
+    import shutil
+    import tempfile
+
+    directory = tempfile.mkdtemp()
+    try:
+      images = [sitk.Image(64, 48, sitk.sitkFloat32) + float(value) for value in range(3)]
+      for image in images:
+        image.SetSpacing((0.5, 0.5))
+      cache = ResultCache.DiskCache(directory)
+      keys = [cache.key('smoothing', [image], ('curvature flow', 5)) for image in images]
+      self.assertEqual(len(set(keys)), 3)
+      self.assertNotEqual(cache.key('smoothing', [images[0]], ('curvature flow', 6)), keys[0])
+
+      cache.put(keys[0], {'smoothed': images[0]}, {'area': 12})
+      entry = cache.get(keys[0])
+      self.assertEqual(entry.data, {'area': 12})
+      self.assertEqual(entry.image('smoothed').GetSpacing(), (0.5, 0.5))
+      self.assertEqual(entry.array('smoothed')[0, 0], 0.0)
+      self.assertIsInstance(entry.array('smoothed'), np.memmap)
+
+      # room for two entries: the third write evicts the least recently read one
+      cache.maxBytes = 2 * cache.totalBytes() + 1
+      cache.put(keys[1], {'smoothed': images[1]})
+      cache.get(keys[0])
+      cache.put(keys[2], {'smoothed': images[2]})
+      reopened = ResultCache.DiskCache(directory, cache.maxBytes)
+      self.assertIsNotNone(reopened.get(keys[0]))
+      self.assertIsNone(reopened.get(keys[1]))
+      self.assertIsNotNone(reopened.get(keys[2]))
+      reopened.clear()
+      self.assertIsNone(reopened.get(keys[0]))
+    finally:
+      shutil.rmtree(directory, ignore_errors=True)
+    self.delayDisplay('Test passed!')
+
+  def test_RadiometricReader(self):
+    """ Raw counts are read memory-mapped, past frame headers, and calibrated to degrees.
+    """
+    self.delayDisplay("Starting the radiometric reader test")
+    import os
+    import shutil
+    import tempfile
+
+    directory = tempfile.mkdtemp()
+    try:
+      path = os.path.join(directory, "feet.raw")
+      counts = np.full((3, 48, 64), 29315, np.uint16)
+      counts[:, 10:30, 10:40] = 30515
+      counts[2, 20, 20] = 30615
+      # 8 bytes of file header, 4 bytes before each frame
+      with open(path, "wb") as rawFile:
+        rawFile.write(b"IRRAWHDR")
+        for frame in counts:
+          rawFile.write(b"FRM0" + frame.tobytes())
+      header = {"width": 64, "height": 48, "headerBytes": 8, "frameHeaderBytes": 4,
+                "calibration": {"type": "linear", "scale": 0.01, "offset": -273.15}}
+      radiometricFile = RadiometricReader.RadiometricFile(path, header)
+      self.assertEqual(len(radiometricFile), 3)
+      self.assertIsInstance(radiometricFile.counts.base, np.memmap)
+      temperatures = radiometricFile.temperatures(2)
+      self.assertEqual(temperatures.dtype, np.float32)
+      self.assertAlmostEqual(float(temperatures[0, 0]), 20.0, places=3)
+      self.assertAlmostEqual(float(temperatures[20, 20]), 33.0, places=3)
+      self.assertEqual(radiometricFile.frame(0).GetSize(), (64, 48))
+
+      # Planck parameters through the sidecar
+      R1, R2, B, F, O = 14000.0, 0.012, 1390.0, 1.0, -7000.0
+      kelvin = np.array([[293.15, 305.15]])
+      planckCounts = np.round(R1 / (R2 * (np.exp(B / kelvin) - F)) - O).astype(np.uint16)
+      planckPath = os.path.join(directory, "planck.raw")
+      RadiometricReader.writeRadiometricFile(planckPath, planckCounts, {"type": "planck", "R1": R1, "R2": R2, "B": B, "F": F, "O": O})
+      planckTemperatures = RadiometricReader.RadiometricFile(planckPath).temperatures(0)
+      self.assertTrue(np.allclose(planckTemperatures, [[20.0, 32.0]], atol=0.05))
+      # release the mappings before removing the files
+      del radiometricFile
+    finally:
+      shutil.rmtree(directory, ignore_errors=True)
+    self.delayDisplay('Test passed!')
+
+  def test_RegionStatistics(self):
+    """ One pass gives numpy's statistics for every foot and foot third, with the hot spots of each.
+    """
+    self.delayDisplay("Starting the region statistics test")
+
+    temperatures = sitk.GetImageFromArray(np.random.RandomState(0).normal(30.0, 1.0, (60, 80)).astype(np.float32))
+    temperatures.SetSpacing((0.5, 0.5))
+    labels = sitk.Image(80, 60, sitk.sitkUInt8)
+    labels[10:30, 5:50] = ProcessingEngine.RIGHT_FOOT_LABEL
+    labels[50:70, 5:50] = ProcessingEngine.LEFT_FOOT_LABEL
+    hotSpots = sitk.Image(80, 60, sitk.sitkUInt8)
+    hotSpots[12:16, 8:12] = ProcessingEngine.HOTSPOT_LABEL
+    hotSpots[20:24, 40:44] = ProcessingEngine.HOTSPOT_LABEL
+
+    subregions = RegionStatistics.footSubregions(labels)
+    rows = RegionStatistics.labelStatistics(temperatures, [labels, subregions], hotSpots)
+    self.assertEqual([row["label"] for row in rows], [1, 2, 11, 12, 13, 21, 22, 23])
+    values = sitk.GetArrayViewFromImage(temperatures)
+    right = values[sitk.GetArrayViewFromImage(labels) == ProcessingEngine.RIGHT_FOOT_LABEL]
+    self.assertEqual(rows[0]["area"], 20 * 45)
+    self.assertAlmostEqual(rows[0]["areaMm2"], 20 * 45 * 0.25)
+    self.assertAlmostEqual(rows[0]["mean"], right.mean(), places=5)
+    self.assertAlmostEqual(rows[0]["std"], right.std(), places=5)
+    self.assertAlmostEqual(rows[0]["p25"], np.percentile(right, 25), places=5)
+    self.assertEqual((rows[0]["min"], rows[0]["max"]), (right.min(), right.max()))
+    self.assertEqual((rows[0]["hotSpots"], rows[0]["hotSpotArea"]), (2, 32))
+    # toes at the top: the forefoot third holds the first hot spot, the heel third the second one
+    self.assertEqual([(row["hotSpots"], row["hotSpotArea"]) for row in rows[2:5]], [(1, 16), (0, 0), (1, 16)])
+    self.assertEqual(sum(row["area"] for row in rows[5:8]), rows[1]["area"])
+    self.delayDisplay('Test passed!')
+
+  def test_BatchProcessing(self):
+    """ A batch writes one results line per exam, records failures and resumes without redoing finished exams.
+    """
+    self.delayDisplay("Starting the batch processing test")
+    import shutil, tempfile
+    from IrBaseUlcerDetectionLib import SyntheticThermogram
+
+    directory = tempfile.mkdtemp()
+    try:
+      image, seeds = SyntheticThermogram.footThermogram(160, 120)
+      sitk.WriteImage(image, os.path.join(directory, "exam1.nrrd"))
+      sitk.WriteImage(image, os.path.join(directory, "exam2.nrrd"))
+      with open(os.path.join(directory, "manifest.csv"), "w") as manifestFile:
+        manifestFile.write("id,path,tempMax,seeds\n")
+        manifestFile.write("first,exam1.nrrd,,%d %d; %d %d\n" % (seeds[0] + seeds[1]))
+        manifestFile.write(",exam2.nrrd,36.5,\n")
+        manifestFile.write("missing,missing.nrrd,,\n")
+      exams = BatchProcessing.readManifest(os.path.join(directory, "manifest.csv"))
+      self.assertEqual([exam.id for exam in exams], ["first", "exam2", "missing"])
+      self.assertEqual(exams[0].parameters.seeds, seeds)
+      self.assertEqual(exams[1].parameters.tempMax, 36.5)
+
+      outputDirectory = os.path.join(directory, "results")
+      summary = BatchProcessing.runBatch(exams, outputDirectory, workers=0)
+      self.assertEqual((summary["processed"], summary["failed"], summary["skipped"]), (3, 1, 0))
+      results = BatchProcessing.readResults(outputDirectory)
+      self.assertEqual(results["first"]["status"], BatchProcessing.STATUS_DONE)
+      self.assertEqual([row["label"] for row in results["exam2"]["statistics"]], [1, 2])
+      self.assertIn("smoothing", results["first"]["timings"])
+      self.assertEqual(results["missing"]["status"], BatchProcessing.STATUS_FAILED)
+      labels = sitk.ReadImage(os.path.join(outputDirectory, "first", "labels.nrrd"))
+      self.assertEqual(labels[seeds[1]], ProcessingEngine.LEFT_FOOT_LABEL)
+
+      # an interrupted run left a torn line: finished exams are skipped, the failed one only on request
+      with open(os.path.join(outputDirectory, BatchProcessing.RESULTS_FILE), "a") as resultsFile:
+        resultsFile.write('{"id": "exa')
+      summary = BatchProcessing.runBatch(exams, outputDirectory, workers=0)
+      self.assertEqual((summary["processed"], summary["skipped"]), (0, 3))
+      summary = BatchProcessing.runBatch(exams, outputDirectory, workers=0, retryFailed=True)
+      self.assertEqual((summary["processed"], summary["skipped"]), (1, 2))
+      self.assertEqual(len(BatchProcessing.readResults(outputDirectory)), 3)
+    finally:
+      shutil.rmtree(directory, ignore_errors=True)
+    self.delayDisplay('Test passed!')
+
+  def test_SeedDetection(self):
+    """ Seeds are found inside each foot, right foot first, and markups map to their voxel.
+    """
+    self.delayDisplay("Starting the seed detection test")
+    from IrBaseUlcerDetectionLib import SyntheticThermogram
+
+    image, seeds = SyntheticThermogram.footThermogram(320, 240)
+    detected = SeedDetection.detectFootSeeds(image)
+    labels = sitk.GetArrayViewFromImage(ProcessingEngine.segmentFeet(image, ProcessingEngine.ProcessingParameters(seeds=seeds)).mask)
+    self.assertEqual([labels[j, i] for i, j in detected], [ProcessingEngine.RIGHT_FOOT_LABEL, ProcessingEngine.LEFT_FOOT_LABEL])
+    # no seeds: the engine detects them
+    result = ProcessingEngine.runProcessing(image, ProcessingEngine.ProcessingParameters())
+    self.assertGreater(sitk.GetArrayViewFromImage(result.mask).sum(), 0)
+    with self.assertRaises(ValueError):
+      SeedDetection.detectFootSeeds(sitk.Image(320, 240, sitk.sitkFloat32) + 22.0)
+
+    volumeNode = slicer.util.addVolumeFromArray(np.zeros((1, 48, 64)), name='workingVolume')
+    volumeNode.SetSpacing(0.5, 0.5, 1.0)
+    volumeNode.SetOrigin(10.0, 20.0, 0.0)
+    ijkToRAS = vtk.vtkMatrix4x4()
+    volumeNode.GetIJKToRASMatrix(ijkToRAS)
+    logic = IrBaseUlcerDetectionLogic()
+    self.assertEqual(logic.rasToIJK(volumeNode, ijkToRAS.MultiplyPoint((30, 12, 0, 1))), (30, 12, 0))
+    volumeNode.SetOrigin(0.0, 0.0, 0.0)
+    self.assertEqual(logic.rasToIJK(volumeNode, ijkToRAS.MultiplyPoint((30, 12, 0, 1))), (50, 52, 0))
+    self.delayDisplay('Test passed!')
@@ -0,0 +1,230 @@
+"""Contralateral temperature difference between the two feet.
+
+The left foot is mirrored (i -> width - 1 - i) and registered onto the right
+one: the centroids and principal axes of the two masks give the initial
+transform, then a rigid or affine fit of the masks runs coarse to fine on
+shrunk, blurred copies of crops around each foot. Every foot pixel then gets
+its temperature minus the temperature of the matching pixel of the other
+foot, and hot spots are the connected regions where that difference reaches
+a threshold.
+
+Registration works in index space (unit spacing, zero origin), so results do
+not depend on the pixel spacing of the thermogram. The transform of a frame
+is a good start for the next one of a sequence (see initialTransform).
+"""
+
+import math
+
+import numpy as np
+import SimpleITK as sitk
+
+from . import ProcessingEngine, RegionOfInterest
+
+TRANSFORM_RIGID = "rigid"
+TRANSFORM_AFFINE = "affine"
+
+TRANSFORMS = (
+  TRANSFORM_RIGID,
+  TRANSFORM_AFFINE,
+  )
+
+# Contralateral difference (degrees) considered clinically relevant
+DEFAULT_THRESHOLD = 2.2
+
+# Hot spots smaller than this number of pixels are dropped
+MINIMUM_HOTSPOT_AREA = 9
+
+# The feet crops are bin shrunk to about this height before the fit
+REGISTRATION_HEIGHT = 96
+
+# Pixels added around each foot crop, so the blurred masks keep their border
+REGISTRATION_MARGIN = 8
+
+# Extra shrink factor and blur (in shrunk pixels) of each registration level
+SHRINK_FACTORS = (4, 2, 1)
+SMOOTHING_SIGMAS = (2.0, 1.0, 1.0)
+
+
+class AsymmetryResult(object):
+  """Output of asymmetryMap.
+
+  deltaT: float32 image, each foot pixel temperature minus the matching
+    pixel of the other foot; 0 outside the feet or where they do not overlap.
+  hotSpots: uint8 label map, HOTSPOT_LABEL where deltaT reaches the threshold.
+  regions (list of dict): one per hot spot, largest first, with "label"
+    (foot label), "area" (pixels), "mean" and "max" (deltaT) and "centroid" (i, j).
+  transform: sitk transform from right foot to mirrored left foot index space.
+  overlap (float): Dice coefficient of the registered masks (1 is a perfect match).
+  """
+
+  def __init__(self, deltaT, hotSpots, regions, transform, overlap):
+    self.deltaT = deltaT
+    self.hotSpots = hotSpots
+    self.regions = regions
+    self.transform = transform
+    self.overlap = overlap
+
+
+def _indexSpace(image):
+  image = sitk.Image(image)
+  image.SetOrigin((0.0, 0.0))
+  image.SetSpacing((1.0, 1.0))
+  image.SetDirection((1.0, 0.0, 0.0, 1.0))
+  return image
+
+
+def mirror(image):
+  """image flipped left to right over the same pixel grid (pixel i goes to width - 1 - i)"""
+  # Flip keeps pixels in place physically: go back to index space
+  return _indexSpace(sitk.Flip(image, [True, False]))
+
+
+def maskMoments(maskArray):
+  """(centroid (i, j), angle of the major axis) of the non zero pixels of a 2D mask"""
+  rows, columns = np.nonzero(maskArray)
+  if len(rows) < 3:
+    raise ValueError("foot mask is empty")
+  centroid = (columns.mean(), rows.mean())
+  eigenvalues, eigenvectors = np.linalg.eigh(np.cov(np.vstack((columns, rows))))
+  major = eigenvectors[:, np.argmax(eigenvalues)]
+  return centroid, math.atan2(major[1], major[0])
+
+
+def momentTransform(fixedArray, movingArray):
+  """Rigid transform matching the centroids and major axes of two masks"""
+  fixedCentroid, fixedAngle = maskMoments(fixedArray)
+  movingCentroid, movingAngle = maskMoments(movingArray)
+  # axes have no direction: keep the smaller of the two possible rotations
+  angle = (movingAngle - fixedAngle + math.pi / 2) % math.pi - math.pi / 2
+  transform = sitk.Euler2DTransform()
+  transform.SetCenter(fixedCentroid)
+  transform.SetAngle(angle)
+  transform.SetTranslation((movingCentroid[0] - fixedCentroid[0], movingCentroid[1] - fixedCentroid[1]))
+  return transform
+
+
+def _affine(transform):
+  affine = sitk.AffineTransform(2)
+  affine.SetCenter(transform.GetCenter())
+  affine.SetMatrix(transform.GetMatrix())
+  affine.SetTranslation(transform.GetTranslation())
+  return affine
+
+
+def _registrationImage(maskArray, imageSize):
+  """Float crop of a mask around its pixels, bin shrunk to about REGISTRATION_HEIGHT rows"""
+  rows = np.nonzero(maskArray.any(axis=1))[0]
+  columns = np.nonzero(maskArray.any(axis=0))[0]
+  width, height = imageSize
+  box = (max(int(columns[0]) - REGISTRATION_MARGIN, 0), max(int(rows[0]) - REGISTRATION_MARGIN, 0),
+         min(int(columns[-1]) + REGISTRATION_MARGIN + 1, width), min(int(rows[-1]) + REGISTRATION_MARGIN + 1, height))
+  shrink = max(1, (box[3] - box[1]) // REGISTRATION_HEIGHT)
+  mask = _indexSpace(sitk.GetImageFromArray(maskArray.astype(np.float32)))
+  return sitk.BinShrink(RegionOfInterest.cropImage(mask, box), [shrink, shrink])
+
+
+def _fit(fixed, moving, transform, shrinkFactors, smoothingSigmas, learningRate):
+  registration = sitk.ImageRegistrationMethod()
+  registration.SetMetricAsMeanSquares()
+  registration.SetInterpolator(sitk.sitkLinear)
+  registration.SetOptimizerAsRegularStepGradientDescent(learningRate=learningRate, minStep=0.05, numberOfIterations=40,
+                                                        gradientMagnitudeTolerance=1e-6)
+  registration.SetOptimizerScalesFromIndexShift()
+  registration.SetShrinkFactorsPerLevel(shrinkFactors)
+  registration.SetSmoothingSigmasPerLevel(smoothingSigmas)
+  registration.SmoothingSigmasAreSpecifiedInPhysicalUnitsOff()
+  registration.SetInitialTransform(transform, inPlace=True)
+  registration.Execute(fixed, moving)
+  return transform
+
+
+def registerFeet(rightMaskArray, mirroredLeftMaskArray, transformType=TRANSFORM_RIGID, initialTransform=None):
+  """Transform from the right foot mask onto the mirrored left foot mask (index space).
+
+  The affine fit starts from the rigid one and only runs on the finer
+  levels, where the masks are sharp enough to constrain shear and scale.
+  """
+  if transformType not in TRANSFORMS:
+    raise ValueError("unknown transform %r, expected one of %s" % (transformType, ", ".join(TRANSFORMS)))
+  imageSize = tuple(reversed(rightMaskArray.shape))
+  fixed = _registrationImage(rightMaskArray, imageSize)
+  moving = _registrationImage(mirroredLeftMaskArray, imageSize)
+  if initialTransform is not None and initialTransform.GetName() == "AffineTransform" and transformType == TRANSFORM_AFFINE:
+    # tracking: the previous frame fit is close already
+    return _fit(fixed, moving, sitk.AffineTransform(initialTransform), SHRINK_FACTORS[1:], SMOOTHING_SIGMAS[1:], 0.5)
+
+  if initialTransform is None or initialTransform.GetName() != "Euler2DTransform":
+    initialTransform = momentTransform(rightMaskArray, mirroredLeftMaskArray)
+  transform = _fit(fixed, moving, sitk.Euler2DTransform(initialTransform), SHRINK_FACTORS, SMOOTHING_SIGMAS, 2.0)
+  if transformType == TRANSFORM_AFFINE:
+    transform = _fit(fixed, moving, _affine(transform), SHRINK_FACTORS[1:], SMOOTHING_SIGMAS[1:], 0.5)
+  return transform
+
+
+def hotSpotRegions(deltaT, labels, threshold=DEFAULT_THRESHOLD, minimumArea=MINIMUM_HOTSPOT_AREA):
+  """(hot spot label map, regions) of the connected pixels where deltaT reaches threshold"""
+  components = sitk.RelabelComponent(sitk.ConnectedComponent(deltaT >= threshold), minimumObjectSize=minimumArea)
+  hotSpots = sitk.Cast(components != 0, sitk.sitkUInt8) * ProcessingEngine.HOTSPOT_LABEL
+  statistics = sitk.LabelIntensityStatisticsImageFilter()
+  statistics.Execute(_indexSpace(components), _indexSpace(deltaT))
+  labelArray = sitk.GetArrayViewFromImage(labels)
+  componentArray = sitk.GetArrayViewFromImage(components)
+  regions = []
+  for component in statistics.GetLabels():
+    footLabels = labelArray[componentArray == component]
+    regions.append({
+      "label": int(np.bincount(footLabels).argmax()),
+      "area": statistics.GetNumberOfPixels(component),
+      "mean": statistics.GetMean(component),
+      "max": statistics.GetMaximum(component),
+      "centroid": statistics.GetCentroid(component),
+      })
+  return hotSpots, regions
+
+
+def asymmetryMap(temperatures, labels, threshold=DEFAULT_THRESHOLD, transformType=TRANSFORM_RIGID,
+                 initialTransform=None, minimumArea=MINIMUM_HOTSPOT_AREA, observer=None):
+  """Contralateral temperature difference of a dual-foot label map (see segmentFeet).
+
+  temperatures: 2D image (the smoothed one of the segmentation).
+  labels: 2D label map with RIGHT_FOOT_LABEL and LEFT_FOOT_LABEL regions.
+  initialTransform: start of the fit, e.g. the transform of the previous
+    frame; by default the moments of the masks.
+  observer: engine observer (see ProcessingEngine), notified of the
+    "asymmetry" stage. The map is a step of a larger run: it does not report
+    "done", the caller does.
+  Returns an AsymmetryResult; raises ValueError if a foot is missing.
+  """
+  if threshold <= 0:
+    raise ValueError("hot spot threshold must be positive, got %g" % threshold)
+  ProcessingEngine.reportStage(observer, "asymmetry", 0.0)
+  temperatures = sitk.Cast(ProcessingEngine.extractSlice(temperatures, 0), sitk.sitkFloat32)
+  labels = ProcessingEngine.extractSlice(labels, 0)
+  labelArray = sitk.GetArrayViewFromImage(labels)
+  rightArray = labelArray == ProcessingEngine.RIGHT_FOOT_LABEL
+  mirroredLeftArray = (labelArray == ProcessingEngine.LEFT_FOOT_LABEL)[:, ::-1]
+  transform = registerFeet(rightArray, mirroredLeftArray, transformType, initialTransform)
+
+  # right foot pixels read the mirrored left foot through transform, left
+  # foot pixels read the right foot through its inverse and are mirrored back
+  reference = _indexSpace(temperatures)
+  rightMask = _indexSpace(sitk.Cast(labels == ProcessingEngine.RIGHT_FOOT_LABEL, sitk.sitkUInt8))
+  leftMask = _indexSpace(sitk.Cast(labels == ProcessingEngine.LEFT_FOOT_LABEL, sitk.sitkUInt8))
+  inverse = transform.GetInverse()
+  leftOnRight = sitk.Resample(mirror(reference), reference, transform, sitk.sitkLinear, 0.0)
+  leftMaskOnRight = sitk.Resample(mirror(leftMask), reference, transform, sitk.sitkNearestNeighbor, 0)
+  rightOnLeft = mirror(sitk.Resample(reference, reference, inverse, sitk.sitkLinear, 0.0))
+  rightMaskOnLeft = mirror(sitk.Resample(rightMask, reference, inverse, sitk.sitkNearestNeighbor, 0))
+
+  temperatureArray = sitk.GetArrayViewFromImage(temperatures)
+  deltaArray = np.zeros(temperatureArray.shape, np.float32)
+  right = rightArray & (sitk.GetArrayViewFromImage(leftMaskOnRight) != 0)
+  left = (labelArray == ProcessingEngine.LEFT_FOOT_LABEL) & (sitk.GetArrayViewFromImage(rightMaskOnLeft) != 0)
+  deltaArray[right] = temperatureArray[right] - sitk.GetArrayViewFromImage(leftOnRight)[right]
+  deltaArray[left] = temperatureArray[left] - sitk.GetArrayViewFromImage(rightOnLeft)[left]
+  deltaT = sitk.GetImageFromArray(deltaArray)
+  deltaT.CopyInformation(temperatures)
+
+  hotSpots, regions = hotSpotRegions(deltaT, labels, threshold, minimumArea)
+  overlap = 2.0 * right.sum() / max(rightArray.sum() + mirroredLeftArray.sum(), 1)
+  return AsymmetryResult(deltaT, hotSpots, regions, transform, overlap)
@@ -0,0 +1,128 @@
+"""Background execution of processing pipelines.
+
+Pipelines run on worker threads (SimpleITK filters release the GIL), one
+per channel, so a segmentation does not wait behind a processing run. They
+report their current stage through the engine observer, and can be
+cancelled between stages. Submitting a new job for a channel cancels the
+previous one, so results of outdated parameters are dropped instead of
+queued. Nothing here touches the scene: the caller polls finished and
+failed jobs from the main thread and pushes their results itself.
+"""
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .ProcessingEngine import PipelineCancelled
+
+
+class PipelineJob(object):
+  """One submitted pipeline run.
+
+  stage (str) and progress (float in [0, 1]) are updated by the worker;
+  result holds the return value once the job finished successfully, error
+  the exception of a failed job.
+  """
+
+  def __init__(self, jobId, channel):
+    self.id = jobId
+    self.channel = channel
+    self.stage = "queued"
+    self.progress = 0.0
+    self.result = None
+    self.error = None
+    self.future = None
+    self._cancelled = threading.Event()
+
+  def cancel(self):
+    """Ask the job to stop at the next stage boundary"""
+    self._cancelled.set()
+    if self.future is not None:
+      self.future.cancel()
+
+  def isCancelled(self):
+    return self._cancelled.is_set()
+
+  def isDone(self):
+    return self.future is not None and self.future.done()
+
+  def report(self, stage, progress):
+    """Engine observer: record the stage, stop if the job was cancelled"""
+    if self._cancelled.is_set():
+      raise PipelineCancelled(self.id)
+    self.stage = stage
+    self.progress = progress
+
+
+class BackgroundRunner(object):
+  """Runs pipeline functions on worker threads, keeping only the latest job per channel.
+
+  A pipeline function is called as function(*args, observer=job.report, **kwargs).
+  Each channel has its own worker thread: jobs of different channels run
+  concurrently, jobs of one channel one after the other.
+  """
+
+  def __init__(self):
+    self.executors = {}
+    self.jobs = {}
+    self.nextJobId = 0
+    self.lock = threading.Lock()
+
+  def submit(self, channel, function, *args, **kwargs):
+    """Start function in the background, cancelling the running job of the same channel"""
+    with self.lock:
+      previous = self.jobs.get(channel)
+      if previous is not None:
+        previous.cancel()
+      self.nextJobId += 1
+      job = PipelineJob(self.nextJobId, channel)
+      self.jobs[channel] = job
+      if channel not in self.executors:
+        self.executors[channel] = ThreadPoolExecutor(max_workers=1)
+      executor = self.executors[channel]
+    job.future = executor.submit(self._run, job, function, args, kwargs)
+    return job
+
+  def _run(self, job, function, args, kwargs):
+    try:
+      job.result = function(*args, observer=job.report, **kwargs)
+    except PipelineCancelled:
+      job.stage = "cancelled"
+    except Exception as e:
+      logging.exception("Background job %d failed" % job.id)
+      job.stage = "failed"
+      job.error = e
+    return job
+
+  def isStale(self, job):
+    """True if a newer job was submitted on the channel of job"""
+    return self.jobs.get(job.channel) is not job
+
+  def cancel(self, channel=None):
+    """Cancel the job of channel, or of every channel"""
+    with self.lock:
+      channels = [channel] if channel is not None else list(self.jobs)
+      for name in channels:
+        job = self.jobs.pop(name, None)
+        if job is not None:
+          job.cancel()
+
+  def running(self):
+    """Jobs that have not finished yet"""
+    return [job for job in self.jobs.values() if not job.isDone()]
+
+  def takeFinished(self):
+    """Remove and return the latest job of every channel that finished or failed (job.error set); cancelled jobs are dropped"""
+    finished = []
+    with self.lock:
+      for channel, job in list(self.jobs.items()):
+        if job.isDone():
+          del self.jobs[channel]
+          if not job.isCancelled():
+            finished.append(job)
+    return finished
+
+  def shutdown(self):
+    self.cancel()
+    for executor in self.executors.values():
+      executor.shutdown(wait=False)
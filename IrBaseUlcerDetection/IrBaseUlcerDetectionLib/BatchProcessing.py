@@ -0,0 +1,305 @@
+"""Headless batch analysis of exam archives.
+
+Runs the runSegmentation analysis of the module (both feet, contralateral
+asymmetry map, per-region statistics) on every exam of a manifest, spread
+over a process pool, without Slicer:
+
+  cd IrBaseUlcerDetection
+  python -m IrBaseUlcerDetectionLib.BatchProcessing manifest.csv --output results --workers 8
+
+The manifest is a CSV file with a "path" column (images readable by
+SimpleITK, or raw radiometric files with their JSON sidecar) and optional
+columns: "id" (default: the file name), "tempMin", "tempMax", "zslice",
+"smoothing", "hotSpotThreshold" and "seeds" ("i j; i j", right foot first,
+detected when empty). Values missing from a row come from the command
+line. Relative paths are relative to the manifest.
+
+Each exam writes <output>/<id>/labels.nrrd (feet), hotspots.nrrd and
+statistics.csv as soon as it completes, then appends one JSON line to
+<output>/results.jsonl with its status, seeds, statistics rows and stage
+timings. That file is the resume point: a new run over the same output
+directory skips the exams already listed there, so an interrupted batch
+continues where it stopped. Failed exams are recorded with their error and
+are only tried again with --retry-failed.
+"""
+
+import argparse
+import concurrent.futures
+import csv
+import json
+import logging
+import math
+import multiprocessing
+import os
+import shutil
+import sys
+import time
+
+import SimpleITK as sitk
+
+from . import Asymmetry, ProcessingEngine, RadiometricReader, RegionStatistics
+from .Instrumentation import Profiler
+
+RESULTS_FILE = "results.jsonl"
+
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+# Manifest columns read as parameters, with their types
+PARAMETER_COLUMNS = {
+  "tempMin": float,
+  "tempMax": float,
+  "zslice": int,
+  "smoothing": str,
+  "hotSpotThreshold": float,
+  }
+
+# Exams queued per worker: enough to keep workers busy, bounded for large manifests
+QUEUED_PER_WORKER = 2
+
+# Seconds between two progress reports
+PROGRESS_INTERVAL = 10.0
+
+
+class Exam(object):
+  """One manifest row: id, input path and analysis settings"""
+
+  def __init__(self, examId, path, parameters, hotSpotThreshold=Asymmetry.DEFAULT_THRESHOLD, subregions=False):
+    self.id = examId
+    self.path = path
+    self.parameters = parameters
+    self.hotSpotThreshold = hotSpotThreshold
+    self.subregions = subregions
+
+
+def parseSeeds(text):
+  """'i j; i j' -> [(i, j), (i, j)]"""
+  return [tuple(int(round(float(value))) for value in seed.replace(",", " ").split()) for seed in text.split(";") if seed.strip()]
+
+
+def readManifest(path, parameters=None, hotSpotThreshold=Asymmetry.DEFAULT_THRESHOLD, subregions=False):
+  """Exams of a manifest CSV file, parameters and hotSpotThreshold giving the values missing from a row"""
+  parameters = parameters or ProcessingEngine.ProcessingParameters()
+  directory = os.path.dirname(os.path.abspath(path))
+  exams = []
+  ids = set()
+  with open(path, newline="") as manifestFile:
+    for line, row in enumerate(csv.DictReader(manifestFile), 2):
+      if not row.get("path"):
+        raise ValueError("%s:%d: no path" % (path, line))
+      examPath = os.path.join(directory, row["path"])
+      examId = row.get("id") or os.path.splitext(os.path.basename(examPath))[0]
+      if examId in ids:
+        raise ValueError("%s:%d: duplicate exam id %s" % (path, line, examId))
+      ids.add(examId)
+      values = dict((name, PARAMETER_COLUMNS[name](value)) for name, value in row.items()
+                    if name in PARAMETER_COLUMNS and value not in (None, ""))
+      threshold = values.pop("hotSpotThreshold", hotSpotThreshold)
+      if row.get("seeds"):
+        values["seeds"] = parseSeeds(row["seeds"])
+      examParameters = parameters.copy(**values)
+      examParameters.validate()
+      exams.append(Exam(examId, examPath, examParameters, threshold, subregions))
+  return exams
+
+
+def readExamImage(path, zslice=0):
+  """2D float32 temperatures of slice (frame) zslice of an exam file"""
+  if os.path.exists(RadiometricReader.sidecarPath(path)):
+    return RadiometricReader.RadiometricFile(path).frame(zslice)
+  image = ProcessingEngine.extractSlice(sitk.ReadImage(path), zslice)
+  return sitk.Cast(image, sitk.sitkFloat32) if image.GetPixelID() != sitk.sitkFloat32 else image
+
+
+def _jsonValue(value):
+  # strict JSON has no NaN
+  return None if isinstance(value, float) and math.isnan(value) else value
+
+
+def writeStatistics(path, rows):
+  with open(path, "w", newline="") as statisticsFile:
+    writer = csv.DictWriter(statisticsFile, RegionStatistics.statisticsColumns())
+    writer.writeheader()
+    writer.writerows(rows)
+
+
+def processExam(exam, outputDirectory):
+  """Analyze one exam and write its outputs; return its results line (a dict).
+
+  Outputs are written to a temporary directory renamed once complete, so
+  an interrupted exam leaves no partial outputs behind.
+  """
+  profiler = Profiler()
+  record = {"id": exam.id, "path": exam.path}
+  examDirectory = os.path.join(outputDirectory, exam.id)
+  temporaryDirectory = examDirectory + ".partial"
+  try:
+    with profiler.run("batch", exam.parameters.mode):
+      with profiler.stage("read"):
+        image = readExamImage(exam.path, exam.parameters.zslice)
+      with profiler.stage("seed detection"):
+        parameters = ProcessingEngine.withSeeds(image, exam.parameters)
+      result = ProcessingEngine.segmentFeet(image, parameters, observer=profiler.engineObserver())
+      observer = profiler.engineObserver()
+      try:
+        asymmetry = Asymmetry.asymmetryMap(result.smoothed, result.mask, exam.hotSpotThreshold, observer=observer)
+      except ValueError as e:
+        logging.warning("%s: asymmetry map failed: %s" % (exam.id, e))
+        asymmetry = None
+      ProcessingEngine.reportStage(observer, "done", 1.0)
+      with profiler.stage("statistics"):
+        labelImages = [result.mask]
+        if exam.subregions:
+          labelImages.append(RegionStatistics.footSubregions(result.mask))
+        rows = RegionStatistics.labelStatistics(result.smoothed, labelImages, asymmetry.hotSpots if asymmetry else None,
+                                                labels=(ProcessingEngine.RIGHT_FOOT_LABEL, ProcessingEngine.LEFT_FOOT_LABEL))
+      with profiler.stage("write"):
+        shutil.rmtree(temporaryDirectory, ignore_errors=True)
+        os.makedirs(temporaryDirectory)
+        sitk.WriteImage(result.mask, os.path.join(temporaryDirectory, "labels.nrrd"), True)
+        if asymmetry is not None:
+          sitk.WriteImage(asymmetry.hotSpots, os.path.join(temporaryDirectory, "hotspots.nrrd"), True)
+        writeStatistics(os.path.join(temporaryDirectory, "statistics.csv"), rows)
+        shutil.rmtree(examDirectory, ignore_errors=True)
+        os.rename(temporaryDirectory, examDirectory)
+    record.update(status=STATUS_DONE, seeds=[list(seed) for seed in parameters.seeds],
+                  maxDeltaT=_jsonValue(float(sitk.GetArrayViewFromImage(asymmetry.deltaT).max())) if asymmetry else None,
+                  statistics=[dict((key, _jsonValue(value)) for key, value in row.items()) for row in rows])
+  except Exception as e:
+    shutil.rmtree(temporaryDirectory, ignore_errors=True)
+    record.update(status=STATUS_FAILED, error="%s: %s" % (type(e).__name__, e))
+  record["timings"] = dict((each["stage"], each["seconds"]) for each in profiler.records)
+  return record
+
+
+def readResults(outputDirectory):
+  """Results lines already written to outputDirectory, by exam id (the last line of an exam wins)"""
+  results = {}
+  path = os.path.join(outputDirectory, RESULTS_FILE)
+  if not os.path.exists(path):
+    return results
+  with open(path) as resultsFile:
+    for line in resultsFile:
+      try:
+        record = json.loads(line)
+      except ValueError:
+        # cut short by an interruption; the exam is processed again
+        continue
+      results[record["id"]] = record
+  return results
+
+
+def _initWorker():
+  # exams, not filter threads, run in parallel
+  sitk.ProcessObject.SetGlobalDefaultNumberOfThreads(1)
+
+
+def _serialResults(exams, outputDirectory):
+  for exam in exams:
+    yield processExam(exam, outputDirectory)
+
+
+def _poolResults(exams, outputDirectory, workers):
+  """Results of the exams in completion order, with at most QUEUED_PER_WORKER exams queued per worker"""
+  exams = iter(exams)
+  with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_initWorker) as executor:
+    pending = set()
+    try:
+      while True:
+        for exam in exams:
+          pending.add(executor.submit(processExam, exam, outputDirectory))
+          if len(pending) >= QUEUED_PER_WORKER * workers:
+            break
+        if not pending:
+          return
+        finished, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in finished:
+          yield future.result()
+    finally:
+      for future in pending:
+        future.cancel()
+
+
+def runBatch(exams, outputDirectory, workers=None, retryFailed=False, progressCallback=None):
+  """Process the exams not yet in the results of outputDirectory.
+
+  workers: processes of the pool, by default one per core; 0 runs the
+    exams one after the other in this process.
+  progressCallback(done, total, examsPerSecond), if given, is called after
+    every exam.
+  Returns the counts of processed, failed and skipped exams and the throughput.
+  """
+  os.makedirs(outputDirectory, exist_ok=True)
+  previous = readResults(outputDirectory)
+  finishedStatuses = (STATUS_DONE,) if retryFailed else (STATUS_DONE, STATUS_FAILED)
+  todo = [exam for exam in exams if previous.get(exam.id, {}).get("status") not in finishedStatuses]
+  workers = multiprocessing.cpu_count() if workers is None else workers
+  results = _poolResults(todo, outputDirectory, min(workers, len(todo))) if workers and todo else _serialResults(todo, outputDirectory)
+
+  summary = {"processed": 0, "failed": 0, "skipped": len(exams) - len(todo)}
+  start = time.perf_counter()
+  with open(os.path.join(outputDirectory, RESULTS_FILE), "a+") as resultsFile:
+    if resultsFile.tell() > 0:
+      resultsFile.seek(resultsFile.tell() - 1)
+      if resultsFile.read(1) != "\n":
+        # end the line an interruption cut short
+        resultsFile.write("\n")
+    for record in results:
+      resultsFile.write(json.dumps(record) + "\n")
+      resultsFile.flush()
+      summary["processed"] += 1
+      if record["status"] == STATUS_FAILED:
+        summary["failed"] += 1
+        logging.warning("%s failed: %s" % (record["id"], record["error"]))
+      if progressCallback is not None:
+        progressCallback(summary["processed"], len(todo), summary["processed"] / max(time.perf_counter() - start, 1e-9))
+  summary["seconds"] = time.perf_counter() - start
+  summary["examsPerSecond"] = summary["processed"] / max(summary["seconds"], 1e-9)
+  return summary
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument("manifest", help="CSV file listing the exams")
+  parser.add_argument("--output", required=True, help="directory of the results; an existing one is resumed")
+  parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per core, 0: no pool)")
+  parser.add_argument("--temp-min", type=float, default=27.0, help="lower bound of the temperature window")
+  parser.add_argument("--temp-max", type=float, default=35.0, help="upper bound of the temperature window")
+  parser.add_argument("--smoothing", default=ProcessingEngine.SMOOTHING_CURVATURE_FLOW, choices=ProcessingEngine.SMOOTHING_METHODS)
+  parser.add_argument("--tile-size", type=int, default=None,
+                      help="process larger frames by tiles of this size to bound memory (see TiledProcessing)")
+  parser.add_argument("--hot-spot-threshold", type=float, default=Asymmetry.DEFAULT_THRESHOLD,
+                      help="contralateral difference of the hot spots, in degrees")
+  parser.add_argument("--subregions", action="store_true", help="add forefoot, midfoot and heel statistics")
+  parser.add_argument("--retry-failed", action="store_true", help="process the exams that failed in a previous run again")
+  args = parser.parse_args(argv)
+  logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+
+  parameters = ProcessingEngine.ProcessingParameters(tempMin=args.temp_min, tempMax=args.temp_max, smoothing=args.smoothing,
+                                                     tileSize=args.tile_size)
+  try:
+    exams = readManifest(args.manifest, parameters, args.hot_spot_threshold, args.subregions)
+  except (OSError, ValueError) as e:
+    logging.error("cannot read the manifest: %s" % e)
+    return 2
+
+  state = {"reported": time.perf_counter()}
+
+  def progress(done, total, examsPerSecond):
+    now = time.perf_counter()
+    if done == total or now - state["reported"] >= PROGRESS_INTERVAL:
+      state["reported"] = now
+      logging.info("%d/%d exams, %.2f exams/s, %.0f s left" % (done, total, examsPerSecond, (total - done) / max(examsPerSecond, 1e-9)))
+
+  try:
+    summary = runBatch(exams, args.output, args.workers, args.retry_failed, progress)
+  except KeyboardInterrupt:
+    logging.info("interrupted; run again with the same output directory to resume")
+    return 130
+  logging.info("%(processed)d exams processed (%(failed)d failed, %(skipped)d already done) in %(seconds).1f s, "
+               "%(examsPerSecond).2f exams/s" % summary)
+  return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
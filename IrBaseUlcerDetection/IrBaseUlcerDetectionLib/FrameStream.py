@@ -0,0 +1,152 @@
+"""Streaming segmentation of multi-frame thermal sequences.
+
+Frames are processed one at a time from any iterable, so memory stays
+bounded by a couple of frames whatever the sequence length. The foot
+regions of each frame give the seeds and the region of interest of the
+next one: frames are smoothed and segmented only inside the bounding box
+of the previous regions (plus a margin), and fall back to the full frame
+when a region reaches the border of that box or a seed is lost. The
+contralateral asymmetry fit of a frame likewise starts from the one of the
+previous frame.
+"""
+
+import numpy as np
+import SimpleITK as sitk
+
+from . import Asymmetry, ProcessingEngine, RegionOfInterest, RegionStatistics, SeedDetection
+
+# Pixels added around the previous regions when cropping the next frame
+DEFAULT_MARGIN = 16
+
+
+class FrameResult(object):
+  """Output of one frame of a stream.
+
+  index (int): frame number.
+  labelMap: full-frame uint8 label map (RIGHT_FOOT_LABEL, LEFT_FOOT_LABEL).
+  seeds (list of (i, j)): seeds used for this frame, right foot first.
+  statistics (dict): label -> statistics row of the smoothed temperatures (see
+    RegionStatistics.labelStatistics: "mean", "min", "max", "area", percentiles...).
+  cropped (bool): True if the frame was processed inside the previous regions box only.
+  asymmetry: Asymmetry.AsymmetryResult of the frame, or None if not requested or failed.
+  """
+
+  def __init__(self, index, labelMap, seeds, statistics, cropped, asymmetry=None):
+    self.index = index
+    self.labelMap = labelMap
+    self.seeds = seeds
+    self.statistics = statistics
+    self.cropped = cropped
+    self.asymmetry = asymmetry
+
+
+def iterateSlices(image):
+  """Yield the z slices of a 3D image one at a time (a 2D image is a single frame)"""
+  if image.GetDimension() == 2:
+    yield image
+    return
+  for zslice in range(image.GetSize()[2]):
+    yield ProcessingEngine.extractSlice(image, zslice)
+
+
+def regionStatistics(imgSmooth, labelMap, labels=(ProcessingEngine.RIGHT_FOOT_LABEL, ProcessingEngine.LEFT_FOOT_LABEL)):
+  """Statistics row of each label, by label; absent labels have NaN values and area 0"""
+  rows = RegionStatistics.labelStatistics(imgSmooth, labelMap, labels=labels)
+  return dict((row["label"], row) for row in rows)
+
+
+def trackSeed(labelArray, label, previousSeed):
+  """Seed for the next frame: the pixel of the region nearest to its centroid.
+
+  Returns previousSeed when the region is empty.
+  """
+  rows, columns = np.nonzero(labelArray == label)
+  if len(rows) == 0:
+    return previousSeed
+  nearest = np.argmin((rows - rows.mean()) ** 2 + (columns - columns.mean()) ** 2)
+  return (int(columns[nearest]), int(rows[nearest]))
+
+
+def relocateSeed(values, seed, tempMin, tempMax, radius):
+  """Move a seed whose pixel left the temperature window to the nearest pixel within it.
+
+  Only a (2 radius + 1) square around the seed is searched; returns None if
+  no pixel of that square is within the window.
+  """
+  i, j = seed
+  if tempMin <= values[j, i] <= tempMax:
+    return seed
+  j0, i0 = max(j - radius, 0), max(i - radius, 0)
+  window = values[j0:j + radius + 1, i0:i + radius + 1]
+  rows, columns = np.nonzero((window >= tempMin) & (window <= tempMax))
+  if len(rows) == 0:
+    return None
+  nearest = np.argmin((rows + j0 - j) ** 2 + (columns + i0 - i) ** 2)
+  return (int(columns[nearest] + i0), int(rows[nearest] + j0))
+
+
+def _segmentFrame(frame, parameters, seeds, box):
+  """Smooth and segment frame, inside box if given. Returns (imgSmooth, labelMap, touchesBorder) in box coordinates"""
+  if box is not None:
+    i0, j0, i1, j1 = box
+    frame = sitk.RegionOfInterest(frame, [int(i1 - i0), int(j1 - j0)], [int(i0), int(j0)])
+    seeds = [(i - i0, j - j0) for i, j in seeds]
+  result = ProcessingEngine.segmentFeet(frame, parameters.copy(seeds=seeds))
+  labelArray = sitk.GetArrayViewFromImage(result.mask)
+  touchesBorder = box is not None and bool(labelArray[0, :].any() or labelArray[-1, :].any() or
+                                           labelArray[:, 0].any() or labelArray[:, -1].any())
+  return result.smoothed, result.mask, touchesBorder
+
+
+def streamSegmentation(frames, parameters, margin=DEFAULT_MARGIN, hotSpotThreshold=None):
+  """Segment both feet on every frame of frames and yield a FrameResult per frame.
+
+  parameters.seeds holds the right and the left foot seeds of the first
+  frame, or is empty to detect them on it. Each following frame starts from
+  the seeds and the regions box tracked on the previous one.
+  If hotSpotThreshold is given, the contralateral asymmetry map and its hot
+  spots above that difference are computed on every frame as well.
+  """
+  seeds = list(parameters.seeds)
+  box = None
+  transform = None
+  for index, frame in enumerate(frames):
+    frame = ProcessingEngine.extractSlice(frame, 0)
+    if not seeds:
+      seeds = SeedDetection.detectFootSeeds(frame)
+    elif index == 0:
+      ProcessingEngine.checkSeeds(frame.GetSize(), seeds)
+    values = sitk.GetArrayViewFromImage(frame)
+    relocated = [relocateSeed(values, seed, parameters.tempMin, parameters.tempMax, margin) for seed in seeds]
+    if any(seed is None for seed in relocated):
+      # a foot was lost: keep the previous seeds and look at the whole frame
+      relocated, box = seeds, None
+    seeds = relocated
+
+    imgSmooth, labelMap, touchesBorder = _segmentFrame(frame, parameters, seeds, box)
+    cropped = box is not None
+    if touchesBorder:
+      imgSmooth, labelMap, _ = _segmentFrame(frame, parameters, seeds, None)
+      cropped = False
+
+    statistics = regionStatistics(imgSmooth, labelMap)
+    if cropped:
+      fullLabelMap = sitk.Image(frame.GetSize(), sitk.sitkUInt8)
+      fullLabelMap.CopyInformation(frame)
+      labelMap = sitk.Paste(fullLabelMap, labelMap, labelMap.GetSize(), [0, 0], [int(box[0]), int(box[1])])
+    asymmetry = None
+    if hotSpotThreshold is not None:
+      if cropped:
+        imgSmooth = RegionOfInterest.pasteImage(sitk.Cast(frame, imgSmooth.GetPixelID()), imgSmooth, box)
+      try:
+        asymmetry = Asymmetry.asymmetryMap(imgSmooth, labelMap, hotSpotThreshold, initialTransform=transform)
+        transform = asymmetry.transform
+      except ValueError:
+        # a foot was lost on this frame
+        transform = None
+    yield FrameResult(index, labelMap, list(seeds), statistics, cropped, asymmetry)
+
+    labelArray = sitk.GetArrayViewFromImage(labelMap)
+    seeds = [trackSeed(labelArray, label, seed) for label, seed in
+             zip((ProcessingEngine.RIGHT_FOOT_LABEL, ProcessingEngine.LEFT_FOOT_LABEL), seeds)]
+    box = RegionOfInterest.maskBox(labelArray, margin)
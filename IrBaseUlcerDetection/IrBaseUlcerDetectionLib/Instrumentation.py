@@ -0,0 +1,203 @@
+"""Per-stage profiling of processing runs.
+
+A Profiler records one structured record per stage: wall time, image size
+and pixel type, and memory. The memory growth of a stage is the change of
+the resident size of the process across it (Linux only; what the stage
+allocates and frees again is not seen). The process peak is the lifetime
+peak resident size of the process: it only tells about a stage when that
+stage set a new peak. Stages are timed either with the stage() context
+manager (scene side: pull, push, render) or through the engine observer
+(smoothing, segmentation...). Every record is also logged as JSON on the
+LOGGER_NAME logger at DEBUG level, so a logging handler can collect them
+from production sessions.
+"""
+
+import collections
+import contextlib
+import json
+import logging
+import os
+import sys
+import time
+
+try:
+  import resource
+except ImportError:  # Windows
+  resource = None
+
+LOGGER_NAME = "IrBaseUlcerDetection.profile"
+
+try:
+  PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+except (AttributeError, ValueError, OSError):  # Windows
+  PAGE_SIZE = None
+
+
+def residentMemoryBytes():
+  """Current resident memory of the process, or None if unknown on this platform (Linux only)"""
+  try:
+    with open("/proc/self/statm") as statm:
+      return int(statm.read().split()[1]) * PAGE_SIZE
+  except (IOError, OSError, ValueError, IndexError):
+    return None
+
+
+def processPeakMemoryBytes():
+  """Peak resident memory of the process over its lifetime, or None if unknown on this platform"""
+  if resource is None:
+    return None
+  peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  # kilobytes on Linux, bytes on macOS
+  return peak if sys.platform == "darwin" else peak * 1024
+
+
+def imageDescription(image):
+  """(size, pixel type) of a SimpleITK image, or (None, None)"""
+  if image is None:
+    return None, None
+  return list(image.GetSize()), image.GetPixelIDTypeAsString()
+
+
+class Profiler(object):
+  """Collects stage records of processing runs.
+
+  with profiler.run("runProcessing", mode, image):
+    with profiler.stage("pull"):
+      ...
+    ProcessingEngine.runProcessing(image, parameters, observer=profiler.engineObserver())
+
+  Runs that finish later, on another thread, use beginRun and endRun and
+  pass the run explicitly (see activeRun). runFinishedCallback, if set, is
+  called with the "total" record of every finished run.
+  """
+
+  def __init__(self, maxRecords=10000):
+    self.enabled = True
+    self.records = collections.deque(maxlen=maxRecords)
+    self.logger = logging.getLogger(LOGGER_NAME)
+    self.runCount = 0
+    self.currentRun = None
+    self.runFinishedCallback = None
+
+  def _record(self, run, stage, seconds, memoryBefore, image=None):
+    memoryAfter = residentMemoryBytes()
+    size, pixelType = imageDescription(image)
+    record = {
+      "run": run["run"],
+      "pipeline": run["pipeline"],
+      "mode": run["mode"],
+      "stage": stage,
+      "seconds": seconds,
+      "imageSize": size or run["imageSize"],
+      "pixelType": pixelType or run["pixelType"],
+      "memoryGrowthBytes": None if memoryAfter is None or memoryBefore is None else memoryAfter - memoryBefore,
+      "processPeakMemoryBytes": processPeakMemoryBytes(),
+      "time": time.time(),
+      }
+    self.records.append(record)
+    self.logger.debug(json.dumps(record))
+    return record
+
+  def beginRun(self, pipeline, mode=None, image=None):
+    """Start a run and return it, or None when profiling is disabled"""
+    if not self.enabled:
+      return None
+    self.runCount += 1
+    size, pixelType = imageDescription(image)
+    return {"run": self.runCount, "pipeline": pipeline, "mode": mode, "imageSize": size, "pixelType": pixelType,
+            "start": time.perf_counter(), "memory": residentMemoryBytes()}
+
+  def endRun(self, run):
+    """Close run with its "total" record"""
+    if run is None:
+      return None
+    record = self._record(run, "total", time.perf_counter() - run["start"], run["memory"])
+    if self.runFinishedCallback is not None:
+      self.runFinishedCallback(record)
+    return record
+
+  @contextlib.contextmanager
+  def activeRun(self, run):
+    """Make run the current run of stage() for the enclosed block"""
+    previousRun, self.currentRun = self.currentRun, run
+    try:
+      yield run
+    finally:
+      self.currentRun = previousRun
+
+  @contextlib.contextmanager
+  def run(self, pipeline, mode=None, image=None):
+    """Group the stages of the enclosed block in one run"""
+    run = self.beginRun(pipeline, mode, image)
+    try:
+      with self.activeRun(run):
+        yield run
+    finally:
+      self.endRun(run)
+
+  @contextlib.contextmanager
+  def stage(self, name, image=None):
+    """Time the enclosed block as stage name of the current run"""
+    run = self.currentRun
+    if run is None:
+      yield
+      return
+    memoryBefore = residentMemoryBytes()
+    start = time.perf_counter()
+    try:
+      yield
+    finally:
+      self._record(run, name, time.perf_counter() - start, memoryBefore, image)
+
+  def engineObserver(self, run=None):
+    """Engine observer recording the engine stages of run (default: the current run).
+
+    It may be called from a worker thread.
+    """
+    run = run or self.currentRun
+    state = {}
+
+    def observer(stage, progress):
+      if run is None:
+        return
+      now = time.perf_counter()
+      if "stage" in state:
+        self._record(run, state["stage"], now - state["start"], state["memory"])
+      if stage == "done":
+        state.clear()
+      else:
+        state.update(stage=stage, start=now, memory=residentMemoryBytes())
+
+    return observer
+
+  def clear(self):
+    self.records.clear()
+
+  def summary(self):
+    """Per (pipeline, stage) count, total, mean and max seconds and max memory growth"""
+    groups = collections.OrderedDict()
+    for record in self.records:
+      group = groups.setdefault((record["pipeline"], record["stage"]), {
+        "pipeline": record["pipeline"], "stage": record["stage"], "count": 0,
+        "totalSeconds": 0.0, "maxSeconds": 0.0, "maxMemoryGrowthBytes": 0})
+      group["count"] += 1
+      group["totalSeconds"] += record["seconds"]
+      group["maxSeconds"] = max(group["maxSeconds"], record["seconds"])
+      group["maxMemoryGrowthBytes"] = max(group["maxMemoryGrowthBytes"], record["memoryGrowthBytes"] or 0)
+    for group in groups.values():
+      group["meanSeconds"] = group["totalSeconds"] / group["count"]
+    return list(groups.values())
+
+  def formatSummary(self):
+    lines = ["%-18s %-14s %5s %10s %10s %10s" % ("pipeline", "stage", "runs", "mean ms", "max ms", "mem +MB")]
+    for group in self.summary():
+      lines.append("%-18s %-14s %5d %10.1f %10.1f %10.1f" % (
+        group["pipeline"], group["stage"], group["count"], group["meanSeconds"] * 1000.0,
+        group["maxSeconds"] * 1000.0, group["maxMemoryGrowthBytes"] / 1048576.0))
+    return "\n".join(lines)
+
+  def writeJson(self, path):
+    """Write all records, one JSON object per line"""
+    with open(path, "w") as recordsFile:
+      for record in self.records:
+        recordsFile.write(json.dumps(record) + "\n")
@@ -0,0 +1,401 @@
+"""Live acquisition: process the newest camera frame, drop the stale ones.
+
+A frame source (a replayed file, a watched directory, a local socket)
+yields 2D temperature images as the camera delivers them. An acquisition
+thread stamps them and puts them into a small ring buffer; a processing
+thread always takes the newest frame of the buffer and discards the older
+ones. When processing is slower than the camera, frames are dropped
+instead of queued, so the displayed result is at most about two
+processing times behind the camera, whatever the frame rate.
+
+Results are not pushed anywhere: the consumer (the module logic, from the
+main thread) takes the latest one with takeResult and reports it with
+displayed, which closes the end-to-end latency of its frame. Latencies and
+drop counts are kept by LiveMetrics.
+"""
+
+import collections
+import fnmatch
+import logging
+import os
+import socket
+import struct
+import threading
+import time
+
+import numpy as np
+import SimpleITK as sitk
+
+from . import BatchProcessing, RadiometricReader
+
+DEFAULT_CAPACITY = 4
+DEFAULT_POLL_INTERVAL = 0.05
+# Latencies kept for the metrics summaries
+DEFAULT_WINDOW = 200
+
+# Socket frames: width, height (uint32) and spacing (float32), then
+# width x height float32 temperatures in degrees, row by row, little endian
+SOCKET_HEADER = struct.Struct("<IIff")
+DEFAULT_PORT = 18944
+
+
+class LiveFrame(object):
+  """A frame of the source: index in the source order, image and acquisition time (time.monotonic)"""
+
+  def __init__(self, index, image, timestamp):
+    self.index = index
+    self.image = image
+    self.timestamp = timestamp
+
+
+class FrameSource(object):
+  """Base of the frame sources.
+
+  frames() yields 2D SimpleITK images as they arrive and returns once the
+  source is exhausted or close() was called (from any thread).
+  """
+
+  def __init__(self):
+    self.closed = threading.Event()
+
+  def frames(self):
+    raise NotImplementedError
+
+  def close(self):
+    self.closed.set()
+
+
+class ReplaySource(FrameSource):
+  """Replay images at frameInterval seconds (None: as fast as they are read), once or in a loop.
+
+  images is a sequence of images or a function returning an iterable of
+  them (e.g. RadiometricFile.frames), called again for every loop.
+  """
+
+  def __init__(self, images, frameInterval=None, loop=False):
+    FrameSource.__init__(self)
+    self.images = images
+    self.frameInterval = frameInterval
+    self.loop = loop
+
+  @classmethod
+  def fromRadiometricFile(cls, path, frameInterval=None, loop=False):
+    """Replay a raw radiometric file, at the frame interval of its sidecar by default"""
+    radiometricFile = RadiometricReader.RadiometricFile(path)
+    return cls(radiometricFile.frames, frameInterval or radiometricFile.frameInterval, loop)
+
+  def frames(self):
+    due = time.monotonic()
+    while not self.closed.is_set():
+      for image in (self.images() if callable(self.images) else self.images):
+        if self.frameInterval:
+          # paced on the schedule, not on the previous frame, so reading time does not add up
+          if self.closed.wait(max(0.0, due - time.monotonic())):
+            return
+          due += self.frameInterval
+        if self.closed.is_set():
+          return
+        yield image
+      if not self.loop:
+        return
+
+
+class DirectorySource(FrameSource):
+  """Frames written to a directory by the camera software, in name order.
+
+  Files matching pattern that were there before the source started are
+  ignored. A file is read once its size stopped changing between two
+  polls; writers that create the file under another name and rename it
+  when complete are read on the next poll. reader(path) returns the image
+  (default: BatchProcessing.readExamImage, so raw files with a sidecar work).
+  """
+
+  def __init__(self, directory, pattern="*.nrrd", pollInterval=DEFAULT_POLL_INTERVAL, reader=None):
+    FrameSource.__init__(self)
+    self.directory = directory
+    self.pattern = pattern
+    self.pollInterval = pollInterval
+    self.reader = reader or BatchProcessing.readExamImage
+
+  def _sizes(self):
+    sizes = {}
+    for name in os.listdir(self.directory):
+      if fnmatch.fnmatch(name, self.pattern):
+        try:
+          sizes[name] = os.path.getsize(os.path.join(self.directory, name))
+        except OSError:
+          # removed meanwhile
+          pass
+    return sizes
+
+  def frames(self):
+    seen = set(self._sizes())
+    pending = {}
+    while not self.closed.wait(self.pollInterval):
+      sizes = self._sizes()
+      for name in sorted(set(sizes) - seen):
+        if pending.get(name) != sizes[name]:
+          pending[name] = sizes[name]
+          continue
+        del pending[name]
+        seen.add(name)
+        try:
+          yield self.reader(os.path.join(self.directory, name))
+        except (OSError, RuntimeError, ValueError) as e:
+          logging.warning("Cannot read live frame %s: %s" % (name, e))
+
+
+def _receive(connection, size, closed):
+  data = bytearray(size)
+  view = memoryview(data)
+  received = 0
+  while received < size:
+    try:
+      count = connection.recv_into(view[received:])
+    except socket.timeout:
+      if closed.is_set():
+        return None
+      continue
+    if count == 0:
+      return None
+    received += count
+  return data
+
+
+def sendFrame(connection, image):
+  """Send a 2D image on a connected socket, as SocketSource reads it"""
+  values = sitk.GetArrayViewFromImage(image).astype("<f4", copy=False)
+  height, width = values.shape
+  spacing = image.GetSpacing()
+  connection.sendall(SOCKET_HEADER.pack(width, height, spacing[0], spacing[1]) + values.tobytes())
+
+
+class SocketSource(FrameSource):
+  """Frames streamed over a local TCP connection by the camera bridge (see sendFrame).
+
+  The source connects to host:port and reads frames until the bridge closes the connection.
+  """
+
+  def __init__(self, port=DEFAULT_PORT, host="127.0.0.1", timeout=0.2):
+    FrameSource.__init__(self)
+    self.host = host
+    self.port = port
+    self.timeout = timeout
+
+  def frames(self):
+    connection = socket.create_connection((self.host, self.port), timeout=5.0)
+    connection.settimeout(self.timeout)
+    try:
+      while not self.closed.is_set():
+        header = _receive(connection, SOCKET_HEADER.size, self.closed)
+        if header is None:
+          return
+        width, height, spacingX, spacingY = SOCKET_HEADER.unpack(header)
+        data = _receive(connection, width * height * 4, self.closed)
+        if data is None:
+          return
+        image = sitk.GetImageFromArray(np.frombuffer(data, "<f4").reshape(height, width))
+        image.SetSpacing((float(spacingX), float(spacingY)))
+        yield image
+    finally:
+      connection.close()
+
+
+class RingBuffer(object):
+  """The last capacity frames; putting into a full buffer overwrites the oldest frame.
+
+  put and takeLatest return the number of frames they dropped.
+  """
+
+  def __init__(self, capacity=DEFAULT_CAPACITY):
+    if capacity < 1:
+      raise ValueError("ring buffer capacity must be at least 1, got %d" % capacity)
+    self.frames = collections.deque(maxlen=capacity)
+    self.condition = threading.Condition()
+    self.closed = False
+
+  def put(self, frame):
+    with self.condition:
+      dropped = 1 if len(self.frames) == self.frames.maxlen else 0
+      self.frames.append(frame)
+      self.condition.notify()
+    return dropped
+
+  def takeLatest(self, timeout=None):
+    """(newest frame, number of older frames dropped), waiting for a frame; (None, 0) once closed and empty or on timeout"""
+    with self.condition:
+      if not self.condition.wait_for(lambda: self.frames or self.closed, timeout):
+        return None, 0
+      if not self.frames:
+        return None, 0
+      frame = self.frames.pop()
+      dropped = len(self.frames)
+      self.frames.clear()
+      return frame, dropped
+
+  def close(self):
+    with self.condition:
+      self.closed = True
+      self.condition.notify_all()
+
+
+def _percentile(values, percentile):
+  return float(np.percentile(values, percentile)) if values else float("nan")
+
+
+class LiveMetrics(object):
+  """Counters and latencies of a live acquisition, safe to update from any thread.
+
+  acquired, processed, displayed and failed count frames; dropped counts
+  the frames that were never displayed, by reason: "overflow" (overwritten
+  in the ring buffer), "stale" (a newer frame was waiting when processing
+  was free) and "superseded" (processed, but a newer result came before
+  the display took it). Latencies are seconds from acquisition to the end
+  of processing and to display ("end-to-end"), over the last window frames.
+  """
+
+  DROP_REASONS = ("overflow", "stale", "superseded")
+
+  def __init__(self, window=DEFAULT_WINDOW):
+    self.lock = threading.Lock()
+    self.window = window
+    self.reset()
+
+  def reset(self):
+    with self.lock:
+      self.acquired = 0
+      self.processed = 0
+      self.displayed = 0
+      self.failed = 0
+      self.dropped = dict((reason, 0) for reason in self.DROP_REASONS)
+      self.processingLatencies = collections.deque(maxlen=self.window)
+      self.endToEndLatencies = collections.deque(maxlen=self.window)
+      self.displayTimes = collections.deque(maxlen=self.window)
+
+  def count(self, counter, number=1):
+    with self.lock:
+      setattr(self, counter, getattr(self, counter) + number)
+
+  def drop(self, reason, number=1):
+    if number:
+      with self.lock:
+        self.dropped[reason] += number
+
+  def addProcessed(self, frame, now):
+    with self.lock:
+      self.processed += 1
+      self.processingLatencies.append(now - frame.timestamp)
+
+  def addDisplayed(self, frame, now):
+    with self.lock:
+      self.displayed += 1
+      self.endToEndLatencies.append(now - frame.timestamp)
+      self.displayTimes.append(now)
+
+  def summary(self):
+    """Counters, drops by reason, displayed frames per second and latency mean, p50, p95 and max (seconds)"""
+    with self.lock:
+      processing = list(self.processingLatencies)
+      endToEnd = list(self.endToEndLatencies)
+      displayTimes = list(self.displayTimes)
+      summary = {
+        "acquired": self.acquired,
+        "processed": self.processed,
+        "displayed": self.displayed,
+        "failed": self.failed,
+        "dropped": sum(self.dropped.values()),
+        "droppedBy": dict(self.dropped),
+        }
+    span = displayTimes[-1] - displayTimes[0] if len(displayTimes) > 1 else 0.0
+    summary["displayRate"] = (len(displayTimes) - 1) / span if span > 0 else float("nan")
+    for name, latencies in (("processing", processing), ("endToEnd", endToEnd)):
+      summary[name + "Latency"] = {
+        "mean": float(np.mean(latencies)) if latencies else float("nan"),
+        "p50": _percentile(latencies, 50),
+        "p95": _percentile(latencies, 95),
+        "max": max(latencies) if latencies else float("nan"),
+        }
+    return summary
+
+  def formatSummary(self):
+    summary = self.summary()
+    latency = summary["endToEndLatency"]
+    return ("%.1f fps, latency %.0f ms (p95 %.0f ms, max %.0f ms), %d of %d frames dropped"
+            % (summary["displayRate"], latency["mean"] * 1000, latency["p95"] * 1000, latency["max"] * 1000,
+               summary["dropped"], summary["acquired"]))
+
+
+class LiveAcquisition(object):
+  """Runs process(image) on the newest frame of source, on its own threads.
+
+  process is called from the processing thread, one frame at a time; a
+  failing frame is logged, counted and skipped. The consumer polls
+  takeResult and calls displayed once it showed the result.
+  """
+
+  def __init__(self, source, process, capacity=DEFAULT_CAPACITY, metrics=None):
+    self.source = source
+    self.process = process
+    self.buffer = RingBuffer(capacity)
+    self.metrics = metrics or LiveMetrics()
+    self.error = None
+    self.lock = threading.Lock()
+    self.latest = None
+    self.threads = []
+
+  def start(self):
+    self.threads = [threading.Thread(target=self._acquire, name="live acquisition"),
+                    threading.Thread(target=self._processFrames, name="live processing")]
+    for thread in self.threads:
+      thread.daemon = True
+      thread.start()
+    return self
+
+  def isRunning(self):
+    return any(thread.is_alive() for thread in self.threads)
+
+  def _acquire(self):
+    try:
+      for index, image in enumerate(self.source.frames()):
+        self.metrics.count("acquired")
+        self.metrics.drop("overflow", self.buffer.put(LiveFrame(index, image, time.monotonic())))
+    except Exception as e:
+      logging.exception("Live frame source failed")
+      self.error = e
+    finally:
+      self.buffer.close()
+
+  def _processFrames(self):
+    while True:
+      frame, stale = self.buffer.takeLatest()
+      if frame is None:
+        return
+      self.metrics.drop("stale", stale)
+      try:
+        result = self.process(frame.image)
+      except Exception:
+        logging.exception("Live processing failed on frame %d" % frame.index)
+        self.metrics.count("failed")
+        continue
+      self.metrics.addProcessed(frame, time.monotonic())
+      with self.lock:
+        if self.latest is not None:
+          self.metrics.drop("superseded")
+        self.latest = (frame, result)
+
+  def takeResult(self):
+    """(frame, result) processed last and not taken yet, or None"""
+    with self.lock:
+      latest, self.latest = self.latest, None
+    return latest
+
+  def displayed(self, frame):
+    """Record that the result of frame is shown"""
+    self.metrics.addDisplayed(frame, time.monotonic())
+
+  def stop(self, timeout=5.0):
+    """Close the source and wait for the threads; a frame being processed finishes first"""
+    self.source.close()
+    self.buffer.close()
+    for thread in self.threads:
+      thread.join(timeout)
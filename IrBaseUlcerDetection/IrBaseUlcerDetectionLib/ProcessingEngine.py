@@ -0,0 +1,510 @@
+"""Slicer-free processing engine for IR-Base Ulcer Detection.
+
+Everything in this module works on plain SimpleITK images and does not import
+slicer, qt, ctk or vtk, so it can be used from worker processes and
+processing servers. IrBaseUlcerDetectionLogic is a thin adapter that pulls
+images from the scene, calls these functions and pushes the results back.
+"""
+
+import SimpleITK as sitk
+
+from . import HoleFilling, RegionOfInterest, SeedDetection, Smoothing, TiledProcessing
+from .HoleFilling import HOLE_FILLING_METHODS, HOLE_FILLING_VOTING, HOLE_FILLING_RECONSTRUCTION, HOLE_FILLING_CLOSING, HOLE_FILLING_AREA
+from .Smoothing import (SMOOTHING_METHODS, SMOOTHING_AUTO, SMOOTHING_CURVATURE_FLOW, SMOOTHING_MIN_MAX_CURVATURE_FLOW,
+                        SMOOTHING_GAUSSIAN, SMOOTHING_MEDIAN, SMOOTHING_BILATERAL)
+
+#
+# Processing modes, in the order shown by the widget combo box
+#
+
+MODE_ORIGINAL = "original"
+MODE_SMOOTHING = "image smoothing"
+MODE_SEGMENTATION = "image segmentation"
+MODE_SEGMENTATION_NO_HOLES = "image segmentation + no holes"
+MODE_CONTOURING = "contouring"
+
+PROCESSING_MODES = (
+  MODE_ORIGINAL,
+  MODE_SMOOTHING,
+  MODE_SEGMENTATION,
+  MODE_SEGMENTATION_NO_HOLES,
+  MODE_CONTOURING,
+  )
+
+# Modes whose output depends on the temperature window
+SEGMENTATION_MODES = (
+  MODE_SEGMENTATION,
+  MODE_SEGMENTATION_NO_HOLES,
+  MODE_CONTOURING,
+  )
+
+FOREGROUND_LABEL = 1
+
+# Labels of the dual-foot label map
+RIGHT_FOOT_LABEL = 1
+LEFT_FOOT_LABEL = 2
+
+# Label of the region outlines of the "contouring" mode
+CONTOUR_LABEL = 3
+
+# Label of the contralateral hot spots (see Asymmetry)
+HOTSPOT_LABEL = 4
+
+#
+# Pixel precision. Smoothing and segmentation run on float32 for the
+# "float32" and "uint16" precisions; "uint16" additionally returns the
+# temperature images encoded as TEMPERATURE_SCALE steps above
+# TEMPERATURE_OFFSET (centikelvin). Masks are always uint8.
+#
+
+PRECISION_FLOAT64 = "float64"
+PRECISION_FLOAT32 = "float32"
+PRECISION_UINT16 = "uint16"
+
+PRECISIONS = (
+  PRECISION_FLOAT64,
+  PRECISION_FLOAT32,
+  PRECISION_UINT16,
+  )
+
+TEMPERATURE_SCALE = 0.01
+TEMPERATURE_OFFSET = -273.15
+
+
+class PipelineCancelled(Exception):
+  """Raised by a stage observer to stop a pipeline between two stages"""
+
+
+class ProcessingParameters(object):
+  """Parameters of one processing run.
+
+  mode (str): one of PROCESSING_MODES.
+  tempMin, tempMax (float): temperature window of the connected threshold.
+  seeds (list of (i, j) tuples): flood fill seeds in pixel coordinates; when
+    empty, the feet are detected on the slice (see withSeeds).
+  smoothing (str): one of SMOOTHING_METHODS, see the Smoothing module.
+  timeStep (float), numberOfIterations (int): curvature flow settings.
+  sigma (float): Gaussian sigma and bilateral domain sigma, in pixels.
+  medianRadius (int): median window radius, in pixels.
+  rangeSigma (float): bilateral range sigma, in degrees.
+  noiseTarget (float): residual noise fraction "auto" smoothing must reach.
+  holeFilling (str): one of HOLE_FILLING_METHODS, see the HoleFilling module.
+  holeRadius (int): radius of the "voting" window and of the "closing" disc, in pixels.
+  holeArea (int): largest hole "small holes" fills, in pixels.
+  cropMargin (int or None): margin of the crops around each foot, see
+    segmentCropped; None processes the full frame.
+  zslice (int): slice taken from 3D inputs.
+  precision (str): one of PRECISIONS.
+  tileSize (int or None): frames larger than this run the smoothing, flood
+    fill, hole filling and contouring stages by tiles of this size (see
+    TiledProcessing), with the same results; None processes whole frames.
+  """
+
+  def __init__(self, mode=MODE_SEGMENTATION, tempMin=27.0, tempMax=35.0, seeds=None,
+               timeStep=0.125, numberOfIterations=5, holeRadius=2, zslice=0, precision=PRECISION_FLOAT32,
+               smoothing=SMOOTHING_CURVATURE_FLOW, sigma=1.0, medianRadius=1, rangeSigma=1.0, noiseTarget=0.45,
+               cropMargin=RegionOfInterest.DEFAULT_MARGIN, tileSize=None, holeFilling=HOLE_FILLING_VOTING, holeArea=25):
+    self.mode = mode
+    self.tempMin = float(tempMin)
+    self.tempMax = float(tempMax)
+    self.seeds = [tuple(int(round(c)) for c in seed[0:2]) for seed in (seeds or [])]
+    self.timeStep = float(timeStep)
+    self.numberOfIterations = int(numberOfIterations)
+    self.holeRadius = int(holeRadius)
+    self.zslice = int(zslice)
+    self.precision = precision
+    self.smoothing = smoothing
+    self.sigma = float(sigma)
+    self.medianRadius = int(medianRadius)
+    self.rangeSigma = float(rangeSigma)
+    self.noiseTarget = float(noiseTarget)
+    self.cropMargin = None if cropMargin is None else int(cropMargin)
+    self.tileSize = None if tileSize is None else int(tileSize)
+    self.holeFilling = holeFilling
+    self.holeArea = int(holeArea)
+
+  def copy(self, **changes):
+    """Return a copy of the parameters with some of the values replaced"""
+    values = dict(self.__dict__)
+    values.update(changes)
+    return ProcessingParameters(**values)
+
+  def smoothingKey(self):
+    """Values that determine the smoothed image"""
+    return (self.smoothing, self.timeStep, self.numberOfIterations, self.sigma, self.medianRadius,
+            self.rangeSigma, self.noiseTarget, self.precision)
+
+  def holeFillingKey(self):
+    """Values that determine the hole filling of a mask"""
+    return (self.holeFilling, self.holeRadius, self.holeArea)
+
+  def segmentationKey(self):
+    """Values that determine the smoothed image and the region masks"""
+    return self.smoothingKey() + (self.tempMin, self.tempMax, tuple(self.seeds), self.cropMargin)
+
+  def validate(self):
+    """Raise ValueError if the parameters cannot be processed"""
+    if self.mode not in PROCESSING_MODES:
+      raise ValueError("unknown processing mode: %s" % self.mode)
+    if self.tempMin > self.tempMax:
+      raise ValueError("tempMin (%g) is greater than tempMax (%g)" % (self.tempMin, self.tempMax))
+    if self.precision not in PRECISIONS:
+      raise ValueError("unknown precision: %s" % self.precision)
+    if self.smoothing not in SMOOTHING_METHODS:
+      raise ValueError("unknown smoothing method: %s" % self.smoothing)
+    if self.cropMargin is not None and self.cropMargin < 0:
+      raise ValueError("cropMargin must not be negative: %d" % self.cropMargin)
+    if self.holeFilling not in HOLE_FILLING_METHODS:
+      raise ValueError("unknown hole filling method: %s" % self.holeFilling)
+    if self.holeRadius < 0 or self.holeArea < 0:
+      raise ValueError("holeRadius (%d) and holeArea (%d) must not be negative" % (self.holeRadius, self.holeArea))
+    if self.tileSize is not None and self.tileSize < 1:
+      raise ValueError("tileSize must be positive: %d" % self.tileSize)
+
+  def __repr__(self):
+    return "ProcessingParameters(%s)" % ", ".join("%s=%r" % item for item in sorted(self.__dict__.items()))
+
+
+class ProcessingResult(object):
+  """Output of one processing run.
+
+  image: image to display for the requested mode: temperatures for "original",
+    "image smoothing" and "image segmentation" (masked), uint8 labels for
+    "image segmentation + no holes" (the mask) and "contouring" (the outline).
+  smoothed: noise reduced slice (None in "original" mode).
+  mask: binary region mask, or label map for dual-foot runs (None when the mode does not segment).
+  regions: dictionary label -> masked temperatures of that region (dual-foot runs only).
+  """
+
+  def __init__(self, mode, image, smoothed=None, mask=None, regions=None):
+    self.mode = mode
+    self.image = image
+    self.smoothed = smoothed
+    self.mask = mask
+    self.regions = regions or {}
+
+
+#
+# Pipeline stages
+#
+
+def extractSlice(image, zslice=0):
+  """Return the 2D slice zslice of a 3D image (2D images are returned as is)"""
+  if image.GetDimension() == 2:
+    return image
+  size = list(image.GetSize())
+  size[2] = 0
+  index = [0, 0, zslice]
+  extractor = sitk.ExtractImageFilter()
+  extractor.SetSize(size)
+  extractor.SetIndex(index)
+  return extractor.Execute(image)
+
+
+def computationPixelType(parameters):
+  return sitk.sitkFloat64 if parameters.precision == PRECISION_FLOAT64 else sitk.sitkFloat32
+
+
+def encodeTemperatures(image):
+  """Temperatures as uint16 counts of TEMPERATURE_SCALE above TEMPERATURE_OFFSET"""
+  counts = sitk.Clamp((sitk.Cast(image, sitk.sitkFloat32) - TEMPERATURE_OFFSET) / TEMPERATURE_SCALE + 0.5,
+                      lowerBound=0, upperBound=65535)
+  return sitk.Cast(counts, sitk.sitkUInt16)
+
+
+def decodeTemperatures(image):
+  """Inverse of encodeTemperatures, as float32 degrees"""
+  return sitk.Cast(image, sitk.sitkFloat32) * TEMPERATURE_SCALE + TEMPERATURE_OFFSET
+
+
+def temperatureOutput(image, parameters):
+  """Temperature image in the output pixel type of parameters.precision"""
+  return encodeTemperatures(image) if parameters.precision == PRECISION_UINT16 else image
+
+
+def smoothImage(image, parameters):
+  """Noise reduction, in the computation pixel type of parameters.precision"""
+  pixelType = computationPixelType(parameters)
+  if TiledProcessing.needsTiles(image, parameters.tileSize):
+    # "auto" chooses for the whole frame, not for each tile
+    parameters = Smoothing.resolveSmoothing(parameters, image.GetNumberOfPixels())
+    return TiledProcessing.tiledImageFilter(image, lambda tile: sitk.Cast(Smoothing.smooth(sitk.Cast(tile, pixelType), parameters), pixelType),
+                                            Smoothing.smoothingHalo(parameters), parameters.tileSize, pixelType)
+  if image.GetPixelID() != pixelType:
+    image = sitk.Cast(image, pixelType)
+  imgSmooth = Smoothing.smooth(image, parameters)
+  # some backends (CurvatureFlow) always produce double pixels
+  if imgSmooth.GetPixelID() != pixelType:
+    imgSmooth = sitk.Cast(imgSmooth, pixelType)
+  return imgSmooth
+
+
+def segmentRegion(imgSmooth, seeds, tempMin, tempMax, label=FOREGROUND_LABEL, tileSize=None):
+  """Flood fill from the seeds over pixels within [tempMin, tempMax]"""
+  if TiledProcessing.needsTiles(imgSmooth, tileSize):
+    mask = sitk.GetImageFromArray(TiledProcessing.connectedThreshold(sitk.GetArrayViewFromImage(imgSmooth), seeds, tempMin, tempMax,
+                                                                     label, tileSize))
+    mask.CopyInformation(imgSmooth)
+    return mask
+  return sitk.ConnectedThreshold(image1=imgSmooth, seedList=list(seeds), lower=tempMin, upper=tempMax, replaceValue=label)
+
+
+def fillHoles(mask, parameters, label=FOREGROUND_LABEL):
+  """Fill the holes of a binary mask with the method of parameters.holeFilling"""
+  return HoleFilling.fillHoles(mask, parameters, label)
+
+
+def maskImage(imgSmooth, mask):
+  """Temperatures of imgSmooth inside the mask, zero elsewhere"""
+  return sitk.Mask(imgSmooth, mask)
+
+
+def contourLabels(mask, tileSize=None):
+  """uint8 label map of the outline of the mask regions, CONTOUR_LABEL on the outline and 0 elsewhere"""
+  def contour(image):
+    return sitk.Cast(sitk.LabelContour(image) != 0, sitk.sitkUInt8) * CONTOUR_LABEL
+  if TiledProcessing.needsTiles(mask, tileSize):
+    return TiledProcessing.tiledImageFilter(mask, contour, 1, tileSize, sitk.sitkUInt8)
+  return contour(mask)
+
+
+#
+# Pipelines
+#
+# Pipelines accept an optional observer, called as observer(stage, progress)
+# before each stage with progress in [0, 1]. The observer may raise
+# PipelineCancelled to stop the run.
+#
+
+def reportStage(observer, stage, progress):
+  """Notify observer that stage starts, progress being the completed fraction of the run"""
+  if observer is not None:
+    observer(stage, progress)
+
+
+def chainObservers(*observers):
+  """Return one observer notifying every given observer (None entries are skipped) in order"""
+  observers = [observer for observer in observers if observer is not None]
+
+  def observer(stage, progress):
+    for each in observers:
+      each(stage, progress)
+
+  return observer
+
+
+def progressRange(observer, start, end):
+  """Observer placing the 0-1 progress of a sub-pipeline within [start, end] of the run.
+
+  The "done" of the sub-pipeline is not passed on: the caller reports it
+  once the whole run has finished.
+  """
+  if observer is None:
+    return None
+
+  def rangeObserver(stage, progress):
+    if stage != "done":
+      observer(stage, start + (end - start) * progress)
+
+  return rangeObserver
+
+
+def segmentCropped(image, parameters, labels, holes=False, observer=None):
+  """Smooth, flood fill and optionally hole fill only around the seeds.
+
+  Each seed gets the box of its coarse region plus parameters.cropMargin
+  (overlapping boxes are merged and smoothed once). Returns the full-frame
+  smoothed image, the smoothed crops pasted over the unsmoothed frame, and
+  a full-frame mask per seed, filled with labels[seed index]. Returns None
+  when cropping does not apply: cropMargin is None, the frame is small, a
+  seed has no coarse region, the crops would cover most of the frame, or a
+  region comes within the guard band (half the margin) of a crop edge.
+  """
+  width, height = image.GetSize()[0:2]
+  if parameters.cropMargin is None or width * height < RegionOfInterest.MINIMUM_FRAME_PIXELS:
+    return None
+  reportStage(observer, "cropping", 0.05)
+  boxes = RegionOfInterest.seedBoxes(image, parameters.seeds, parameters.tempMin, parameters.tempMax, parameters.cropMargin)
+  if boxes is None:
+    return None
+  groups = RegionOfInterest.groupBoxes(boxes)
+  if sum(RegionOfInterest.boxArea(box) for box, indexes in groups) > RegionOfInterest.MAXIMUM_CROP_FRACTION * width * height:
+    return None
+
+  crops = []
+  masks = {}
+  for box, indexes in groups:
+    reportStage(observer, "smoothing", 0.1)
+    cropSmooth = smoothImage(RegionOfInterest.cropImage(image, box), parameters)
+    crops.append((box, cropSmooth))
+    for index in indexes:
+      reportStage(observer, "segmentation", 0.6)
+      seed = (parameters.seeds[index][0] - box[0], parameters.seeds[index][1] - box[1])
+      mask = segmentRegion(cropSmooth, [seed], parameters.tempMin, parameters.tempMax, labels[index], parameters.tileSize)
+      if holes:
+        reportStage(observer, "hole filling", 0.7)
+        mask = fillHoles(mask, parameters, labels[index])
+      if RegionOfInterest.reachesCropBorder(sitk.GetArrayViewFromImage(mask), box, image.GetSize(), parameters.cropMargin // 2):
+        return None
+      masks[index] = mask
+
+  imgSmooth = sitk.Cast(image, computationPixelType(parameters))
+  emptyMask = sitk.Image(image.GetSize(), sitk.sitkUInt8)
+  emptyMask.CopyInformation(image)
+  for box, cropSmooth in crops:
+    imgSmooth = RegionOfInterest.pasteImage(imgSmooth, cropSmooth, box)
+  fullMasks = {}
+  for box, indexes in groups:
+    for index in indexes:
+      fullMasks[index] = RegionOfInterest.pasteImage(emptyMask, masks[index], box)
+  return imgSmooth, fullMasks
+
+
+def _mergeMasks(masks):
+  merged = None
+  for mask in masks:
+    merged = mask if merged is None else sitk.Maximum(merged, mask)
+  return merged
+
+
+def checkSeeds(size, seeds):
+  """Raise ValueError if a seed (i, j) lies outside an image of size (width, height, ...)"""
+  for seed in seeds:
+    if not (0 <= seed[0] < size[0] and 0 <= seed[1] < size[1]):
+      raise ValueError("seed (%d, %d) outside the image (%d x %d)" % (seed[0], seed[1], size[0], size[1]))
+
+
+def withSeeds(image, parameters):
+  """parameters, with the right and left foot seeds detected on the 2D image if none are given.
+
+  Given seeds are checked against the image (see checkSeeds).
+  """
+  if parameters.seeds:
+    checkSeeds(image.GetSize(), parameters.seeds)
+    return parameters
+  return parameters.copy(seeds=SeedDetection.detectFootSeeds(image))
+
+
+def runProcessing(image, parameters, index=None, observer=None):
+  """Run the pipeline selected by parameters.mode on image and return a ProcessingResult.
+
+  index is an optional ThresholdIndex built on the smoothed slice of image
+  with parameters.seeds; with it, smoothing and flood fill are looked up
+  instead of recomputed. Without it, segmentation modes run on crops around
+  the seeds (see segmentCropped); the smoothed image is then only smoothed
+  inside the crops.
+  """
+  parameters.validate()
+  reportStage(observer, "extraction", 0.0)
+  outputImage = extractSlice(image, parameters.zslice)
+  if parameters.mode == MODE_ORIGINAL:
+    reportStage(observer, "done", 1.0)
+    return ProcessingResult(parameters.mode, outputImage)
+
+  cropped = None
+  if index is None and parameters.mode in SEGMENTATION_MODES:
+    parameters = withSeeds(outputImage, parameters)
+    cropped = segmentCropped(outputImage, parameters, [FOREGROUND_LABEL] * len(parameters.seeds),
+                             holes=parameters.mode != MODE_SEGMENTATION, observer=observer)
+
+  # step 1) filtering: noise reduction
+  if cropped is not None:
+    imgSmooth = cropped[0]
+  else:
+    reportStage(observer, "smoothing", 0.1)
+    imgSmooth = index.smoothed if index is not None else smoothImage(outputImage, parameters)
+  if parameters.mode == MODE_SMOOTHING:
+    reportStage(observer, "done", 1.0)
+    return ProcessingResult(parameters.mode, temperatureOutput(imgSmooth, parameters), smoothed=imgSmooth)
+
+  # step 2) filtering: segmentation
+  if cropped is not None:
+    mask = _mergeMasks(cropped[1].values())
+  elif index is not None:
+    reportStage(observer, "segmentation", 0.6)
+    mask = index.region(parameters.tempMin, parameters.tempMax)
+  else:
+    reportStage(observer, "segmentation", 0.6)
+    mask = segmentRegion(imgSmooth, parameters.seeds, parameters.tempMin, parameters.tempMax, tileSize=parameters.tileSize)
+  if parameters.mode == MODE_SEGMENTATION:
+    output = temperatureOutput(maskImage(imgSmooth, mask), parameters)
+    reportStage(observer, "done", 1.0)
+    return ProcessingResult(parameters.mode, output, smoothed=imgSmooth, mask=mask)
+
+  # step 3) hole filling (already done on the crops)
+  if cropped is not None:
+    maskNoHoles = mask
+  else:
+    reportStage(observer, "hole filling", 0.7)
+    maskNoHoles = fillHoles(mask, parameters)
+  if parameters.mode == MODE_SEGMENTATION_NO_HOLES:
+    reportStage(observer, "done", 1.0)
+    return ProcessingResult(parameters.mode, maskNoHoles, smoothed=imgSmooth, mask=maskNoHoles)
+
+  # step 4) contouring
+  reportStage(observer, "contouring", 0.9)
+  output = contourLabels(maskNoHoles, parameters.tileSize)
+  reportStage(observer, "done", 1.0)
+  return ProcessingResult(parameters.mode, output, smoothed=imgSmooth, mask=maskNoHoles)
+
+
+def segmentFoot(image, parameters, observer=None):
+  """Smooth, flood fill from parameters.seeds and return the masked temperatures"""
+  parameters.validate()
+  reportStage(observer, "extraction", 0.0)
+  outputImage = extractSlice(image, parameters.zslice)
+  parameters = withSeeds(outputImage, parameters)
+  cropped = segmentCropped(outputImage, parameters, [FOREGROUND_LABEL] * len(parameters.seeds), observer=observer)
+  if cropped is not None:
+    imgSmooth, mask = cropped[0], _mergeMasks(cropped[1].values())
+  else:
+    reportStage(observer, "smoothing", 0.1)
+    imgSmooth = smoothImage(outputImage, parameters)
+    reportStage(observer, "segmentation", 0.6)
+    mask = segmentRegion(imgSmooth, parameters.seeds, parameters.tempMin, parameters.tempMax, tileSize=parameters.tileSize)
+  reportStage(observer, "done", 1.0)
+  return ProcessingResult(parameters.mode, temperatureOutput(maskImage(imgSmooth, mask), parameters), smoothed=imgSmooth, mask=mask)
+
+
+def segmentFeet(image, parameters, observer=None):
+  """Smooth once and flood fill both feet from the shared smoothed image.
+
+  parameters.seeds holds the right and the left foot seed, in this order,
+  or is empty to detect them.
+  The result mask is a label map (RIGHT_FOOT_LABEL, LEFT_FOOT_LABEL); where
+  the two regions overlap the left label wins. result.regions holds the
+  masked temperatures of each foot. Each foot is processed on its own crop
+  when possible (see segmentCropped).
+  """
+  parameters.validate()
+  reportStage(observer, "extraction", 0.0)
+  outputImage = extractSlice(image, parameters.zslice)
+  parameters = withSeeds(outputImage, parameters)
+  if len(parameters.seeds) != 2:
+    raise ValueError("dual-foot segmentation needs exactly two seeds, got %d" % len(parameters.seeds))
+  labels = (RIGHT_FOOT_LABEL, LEFT_FOOT_LABEL)
+  cropped = segmentCropped(outputImage, parameters, labels, observer=observer)
+  if cropped is not None:
+    imgSmooth, masks = cropped
+  else:
+    reportStage(observer, "smoothing", 0.1)
+    imgSmooth = smoothImage(outputImage, parameters)
+    masks = {}
+    for seedIndex, (label, seed) in enumerate(zip(labels, parameters.seeds)):
+      reportStage(observer, "segmentation", 0.6 + 0.2 * seedIndex)
+      masks[seedIndex] = segmentRegion(imgSmooth, [seed], parameters.tempMin, parameters.tempMax, label, parameters.tileSize)
+
+  labelMap = None
+  for seedIndex in range(len(labels)):
+    labelMap = masks[seedIndex] if labelMap is None else sitk.Maximum(labelMap, masks[seedIndex])
+  reportStage(observer, "done", 1.0)
+  return feetResult(imgSmooth, labelMap, parameters)
+
+
+def feetResult(imgSmooth, labelMap, parameters):
+  """segmentFeet result of a smoothed image and its dual-foot label map"""
+  regions = {}
+  for label in (RIGHT_FOOT_LABEL, LEFT_FOOT_LABEL):
+    labelMask = sitk.Cast(labelMap == label, sitk.sitkUInt8) * label
+    regions[label] = temperatureOutput(maskImage(imgSmooth, labelMask), parameters)
+  return ProcessingResult(parameters.mode, labelMap, smoothed=imgSmooth, mask=labelMap, regions=regions)
@@ -0,0 +1,163 @@
+"""Raw radiometric thermal files, read memory-mapped.
+
+A raw file holds frames of integer sensor counts, optionally preceded by a
+file header and by a header per frame. It comes with a JSON sidecar
+(<file>.json) describing the layout and the calibration:
+
+  {
+    "width": 640, "height": 480,
+    "dtype": "<u2",             numpy type of the counts (default little-endian uint16)
+    "headerBytes": 0,           bytes before the first frame
+    "frameHeaderBytes": 0,      bytes before each frame
+    "spacing": [1.0, 1.0],      pixel size in mm
+    "frameInterval": 0.04,      seconds between frames (optional)
+    "calibration": {...}
+  }
+
+The number of frames follows from the file size. The calibration is one of
+
+  {"type": "linear", "scale": 0.01, "offset": -273.15}
+  {"type": "planck", "R1": ..., "R2": ..., "B": ..., "F": ..., "O": ...}
+      T = B / ln(R1 / (R2 (counts + O)) + F) - 273.15, as in FLIR metadata
+  {"type": "lut", "table": [...]}  or  {"type": "lut", "file": "table.npy"}
+      degrees indexed by counts (file relative to the sidecar)
+
+Counts are only read when a frame is asked for, and every calibration is
+applied as a table lookup: 16-bit (and 8-bit) counts go through a table of
+all possible values built once, so a frame costs one gather however complex
+the calibration is. Frames come out one at a time as float32 SimpleITK
+images in degrees, ready for the processing engine.
+"""
+
+import json
+import os
+
+import numpy as np
+import SimpleITK as sitk
+
+SIDECAR_SUFFIX = ".json"
+
+CALIBRATION_LINEAR = "linear"
+CALIBRATION_PLANCK = "planck"
+CALIBRATION_LUT = "lut"
+
+CALIBRATIONS = (
+  CALIBRATION_LINEAR,
+  CALIBRATION_PLANCK,
+  CALIBRATION_LUT,
+  )
+
+KELVIN_OFFSET = -273.15
+
+
+def sidecarPath(path):
+  return path + SIDECAR_SUFFIX
+
+
+def linearCalibration(counts, scale, offset):
+  return counts * np.float32(scale) + np.float32(offset)
+
+
+def planckCalibration(counts, R1, R2, B, F, O):
+  """Degrees of counts through the Planck parameters of the camera"""
+  counts = np.asarray(counts, np.float64)
+  with np.errstate(divide="ignore", invalid="ignore"):
+    kelvin = B / np.log(R1 / (R2 * (counts + O)) + F)
+  return (kelvin + KELVIN_OFFSET).astype(np.float32)
+
+
+def calibrationFunction(calibration, directory="."):
+  """function(counts array) -> float32 degrees array of a sidecar calibration"""
+  calibrationType = calibration.get("type")
+  if calibrationType == CALIBRATION_LINEAR:
+    scale, offset = calibration.get("scale", 1.0), calibration.get("offset", 0.0)
+    return lambda counts: linearCalibration(np.asarray(counts, np.float32), scale, offset)
+  if calibrationType == CALIBRATION_PLANCK:
+    R1, R2, B, F, O = (float(calibration[name]) for name in ("R1", "R2", "B", "F", "O"))
+    return lambda counts: planckCalibration(counts, R1, R2, B, F, O)
+  if calibrationType == CALIBRATION_LUT:
+    if "file" in calibration:
+      table = np.load(os.path.join(directory, calibration["file"]))
+    else:
+      table = np.asarray(calibration["table"])
+    table = table.astype(np.float32)
+    return lambda counts: table[np.minimum(counts, len(table) - 1)]
+  raise ValueError("unknown calibration %r, expected one of %s" % (calibrationType, ", ".join(CALIBRATIONS)))
+
+
+class RadiometricFile(object):
+  """Frames of a raw radiometric file and its sidecar.
+
+  counts: read-only memory-mapped (frames, height, width) array of the raw counts.
+  """
+
+  def __init__(self, path, header=None):
+    """Open path, described by header (a dict as in the sidecar) or by the sidecar file"""
+    self.path = path
+    if header is None:
+      with open(sidecarPath(path)) as sidecar:
+        header = json.load(sidecar)
+    self.header = header
+    self.width = int(header["width"])
+    self.height = int(header["height"])
+    self.dtype = np.dtype(header.get("dtype", "<u2"))
+    self.spacing = tuple(float(value) for value in header.get("spacing", (1.0, 1.0)))
+    self.frameInterval = header.get("frameInterval")
+    headerBytes = int(header.get("headerBytes", 0))
+    frameHeaderBytes = int(header.get("frameHeaderBytes", 0))
+
+    pixels = (self.dtype, (self.height, self.width))
+    frameType = np.dtype([("header", "V%d" % frameHeaderBytes), ("pixels",) + pixels]) if frameHeaderBytes else np.dtype(pixels)
+    numberOfFrames = (os.path.getsize(path) - headerBytes) // frameType.itemsize
+    if numberOfFrames < 1:
+      raise ValueError("%s holds no %dx%d frame" % (path, self.width, self.height))
+    frames = np.memmap(path, dtype=frameType, mode="r", offset=headerBytes, shape=(numberOfFrames,))
+    # a strided view: frame headers are skipped, not copied
+    self.counts = frames["pixels"] if frameHeaderBytes else frames
+
+    calibrate = calibrationFunction(header.get("calibration", {"type": CALIBRATION_LINEAR}),
+                                    os.path.dirname(os.path.abspath(path)))
+    if self.dtype.kind == "u" and self.dtype.itemsize <= 2:
+      # every possible count, calibrated once
+      self.table = calibrate(np.arange(2 ** (8 * self.dtype.itemsize), dtype=np.uint32))
+      self.calibrate = lambda counts: self.table[counts]
+    else:
+      self.table = None
+      self.calibrate = calibrate
+
+  def __len__(self):
+    return self.counts.shape[0]
+
+  def temperatures(self, index):
+    """float32 (height, width) array of frame index in degrees; only that frame is read"""
+    return self.calibrate(self.counts[index])
+
+  def frame(self, index):
+    """Frame index as a 2D float32 SimpleITK image in degrees"""
+    image = sitk.GetImageFromArray(self.temperatures(index))
+    image.SetSpacing(self.spacing)
+    return image
+
+  def frames(self, start=0, stop=None):
+    """Yield frames start to stop (excluded) one at a time"""
+    for index in range(start, len(self) if stop is None else min(stop, len(self))):
+      yield self.frame(index)
+
+  def volumeArray(self, start=0, stop=None):
+    """float32 (frames, height, width) array of degrees of frames start to stop"""
+    return self.calibrate(self.counts[start:stop])
+
+
+def writeRadiometricFile(path, counts, calibration, spacing=(1.0, 1.0), frameInterval=None):
+  """Write (frames, height, width) or (height, width) counts as a raw file and its sidecar"""
+  counts = np.asarray(counts)
+  if counts.ndim == 2:
+    counts = counts[np.newaxis]
+  counts.tofile(path)
+  header = {"width": counts.shape[2], "height": counts.shape[1], "dtype": counts.dtype.str,
+            "spacing": list(spacing), "calibration": calibration}
+  if frameInterval is not None:
+    header["frameInterval"] = frameInterval
+  with open(sidecarPath(path), "w") as sidecar:
+    json.dump(header, sidecar, indent=2)
+  return header
@@ -0,0 +1,101 @@
+"""Regions of interest around the foot seeds.
+
+The feet cover a fraction of a thermal frame, so the expensive stages run
+on crops only. A coarse pass (bin-shrunk frame, flood fill from each seed
+with a widened temperature window) bounds each foot cheaply; the box is
+grown by a margin, larger than the reach of the smoothing filters, so that
+results inside the crop match full-frame ones. A region that comes within
+the guard band of a crop edge may extend beyond it, and the caller then
+falls back to the full frame.
+
+Boxes are (i0, j0, i1, j1) pixel ranges, i1 and j1 excluded.
+"""
+
+import numpy as np
+import SimpleITK as sitk
+
+# Pixels added around the coarse region of each seed
+DEFAULT_MARGIN = 16
+
+# Bin shrink factor and temperature window widening (degrees) of the coarse pass
+COARSE_SHRINK = 4
+COARSE_SLACK = 1.0
+
+# Crops covering more than this fraction of the frame are not worth it
+MAXIMUM_CROP_FRACTION = 0.8
+
+# Smaller frames are processed whole: the coarse pass costs about what it saves
+MINIMUM_FRAME_PIXELS = 40000
+
+
+def boxArea(box):
+  i0, j0, i1, j1 = box
+  return (i1 - i0) * (j1 - j0)
+
+
+def seedBoxes(image, seeds, tempMin, tempMax, margin=DEFAULT_MARGIN, shrink=COARSE_SHRINK, slack=COARSE_SLACK):
+  """Box of the coarse region of each seed, or None if a seed has no coarse region"""
+  width, height = image.GetSize()[0:2]
+  coarse = sitk.BinShrink(sitk.Cast(image, sitk.sitkFloat32), [shrink, shrink])
+  coarseWidth, coarseHeight = coarse.GetSize()
+  boxes = []
+  for i, j in seeds:
+    coarseSeed = (min(i // shrink, coarseWidth - 1), min(j // shrink, coarseHeight - 1))
+    region = sitk.ConnectedThreshold(coarse, seedList=[coarseSeed], lower=tempMin - slack, upper=tempMax + slack)
+    regionArray = sitk.GetArrayViewFromImage(region)
+    rows = np.nonzero(regionArray.any(axis=1))[0]
+    columns = np.nonzero(regionArray.any(axis=0))[0]
+    if len(rows) == 0:
+      return None
+    boxes.append((max(int(columns[0]) * shrink - margin, 0), max(int(rows[0]) * shrink - margin, 0),
+                  min((int(columns[-1]) + 1) * shrink + margin, width), min((int(rows[-1]) + 1) * shrink + margin, height)))
+  return boxes
+
+
+def groupBoxes(boxes):
+  """Merge overlapping boxes; returns a list of (box, indexes of the merged boxes)"""
+  groups = [(box, [index]) for index, box in enumerate(boxes)]
+  merged = True
+  while merged:
+    merged = False
+    for first in range(len(groups)):
+      for second in range(first + 1, len(groups)):
+        (a, aIndexes), (b, bIndexes) = groups[first], groups[second]
+        if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+          groups[first] = ((min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])), aIndexes + bIndexes)
+          del groups[second]
+          merged = True
+          break
+      if merged:
+        break
+  return groups
+
+
+def maskBox(maskArray, margin=0):
+  """Box of the non zero pixels of a 2D array grown by margin (within the array), or None if there are none"""
+  rows = np.nonzero(maskArray.any(axis=1))[0]
+  columns = np.nonzero(maskArray.any(axis=0))[0]
+  if len(rows) == 0:
+    return None
+  height, width = maskArray.shape
+  return (max(int(columns[0]) - margin, 0), max(int(rows[0]) - margin, 0),
+          min(int(columns[-1]) + margin + 1, width), min(int(rows[-1]) + margin + 1, height))
+
+
+def cropImage(image, box):
+  i0, j0, i1, j1 = box
+  return sitk.RegionOfInterest(image, [int(i1 - i0), int(j1 - j0)], [int(i0), int(j0)])
+
+
+def pasteImage(destination, source, box):
+  """destination with source pasted at the corner of box"""
+  return sitk.Paste(destination, source, source.GetSize(), [0, 0], [int(box[0]), int(box[1])])
+
+
+def reachesCropBorder(maskArray, box, imageSize, guard):
+  """Whether the mask (in box coordinates) comes within guard pixels of a crop edge inside the frame"""
+  i0, j0, i1, j1 = box
+  width, height = imageSize[0:2]
+  band = guard + 1
+  return bool((i0 > 0 and maskArray[:, :band].any()) or (i1 < width and maskArray[:, -band:].any()) or
+              (j0 > 0 and maskArray[:band, :].any()) or (j1 < height and maskArray[-band:, :].any()))
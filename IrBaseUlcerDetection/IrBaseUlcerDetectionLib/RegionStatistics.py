@@ -0,0 +1,154 @@
+"""Per-region temperature statistics in one pass over the label images.
+
+The labelled pixels of every label image are gathered once and sorted once
+by (label, temperature); area, mean and standard deviation then come from
+sums over each label's run in the sorted order, and min, max and
+percentiles from ranks within the run. The cost is the same for 2 labels
+or 20, which keeps thousands of frames cheap.
+
+Besides the feet (RIGHT_FOOT_LABEL, LEFT_FOOT_LABEL), each foot can be split
+in forefoot, midfoot and heel thirds along its long axis (footSubregions),
+assuming the toes point to the top of the image (smaller j), as in the
+acquisition protocol.
+"""
+
+import collections
+
+import numpy as np
+import SimpleITK as sitk
+
+from . import ProcessingEngine
+
+# Sub-region labels: 10 x foot label + part
+FOREFOOT = 1
+MIDFOOT = 2
+HEEL = 3
+
+PART_NAMES = collections.OrderedDict([(FOREFOOT, "forefoot"), (MIDFOOT, "midfoot"), (HEEL, "heel")])
+
+FOOT_NAMES = collections.OrderedDict([(ProcessingEngine.RIGHT_FOOT_LABEL, "right"), (ProcessingEngine.LEFT_FOOT_LABEL, "left")])
+
+DEFAULT_PERCENTILES = (5, 25, 50, 75, 95)
+
+
+def subregionLabel(footLabel, part):
+  return 10 * footLabel + part
+
+
+def regionName(label):
+  """Readable name of a foot or sub-region label"""
+  if label in FOOT_NAMES:
+    return FOOT_NAMES[label] + " foot"
+  footLabel, part = divmod(label, 10)
+  if footLabel in FOOT_NAMES and part in PART_NAMES:
+    return FOOT_NAMES[footLabel] + " " + PART_NAMES[part]
+  return "label %d" % label
+
+
+def statisticsColumns(percentiles=DEFAULT_PERCENTILES):
+  """Keys of a statistics row, in table order"""
+  return (["label", "name", "area", "areaMm2", "mean", "std", "min", "max"] +
+          ["p%g" % percentile for percentile in percentiles] + ["hotSpots", "hotSpotArea"])
+
+
+def footSubregions(labels):
+  """Label map of the forefoot, midfoot and heel thirds of each foot of a dual-foot label map"""
+  labelArray = sitk.GetArrayViewFromImage(labels)
+  subregionArray = np.zeros(labelArray.shape, np.uint8)
+  for footLabel in FOOT_NAMES:
+    rows, columns = np.nonzero(labelArray == footLabel)
+    if len(rows) < 3:
+      continue
+    points = np.vstack((columns - columns.mean(), rows - rows.mean()))
+    eigenvalues, eigenvectors = np.linalg.eigh(np.cov(points))
+    axis = eigenvectors[:, np.argmax(eigenvalues)]
+    # toes first: the axis points to the top of the image
+    if axis[1] > 0:
+      axis = -axis
+    position = axis.dot(points)
+    low, high = position.min(), position.max()
+    thirds = np.clip(((high - position) * 3 / max(high - low, 1e-6)).astype(int), 0, 2)
+    subregionArray[rows, columns] = subregionLabel(footLabel, FOREFOOT) + thirds
+  subregions = sitk.GetImageFromArray(subregionArray)
+  subregions.CopyInformation(labels)
+  return subregions
+
+
+def labelStatistics(temperatures, labelImages, hotSpots=None, percentiles=DEFAULT_PERCENTILES, labels=None):
+  """Statistics rows of every non zero label of labelImages (one image or a list of them).
+
+  temperatures: 2D or 3D image of degrees, on the grid of the label images.
+  hotSpots: optional image, non zero on hot spot pixels; each row then
+    counts the hot spot regions touching its label and their area there.
+  labels: labels to report even when absent (their values are NaN, area 0);
+    by default the labels present.
+  Returns a list of dicts with the keys of statisticsColumns(percentiles),
+  sorted by label. Areas are in pixels and mm^2.
+  """
+  if isinstance(labelImages, sitk.Image):
+    labelImages = [labelImages]
+  values = sitk.GetArrayViewFromImage(temperatures).ravel()
+  spacing = temperatures.GetSpacing()
+  pixelArea = spacing[0] * spacing[1]
+
+  # one (label, value) pair per labelled pixel of every label image
+  labelParts, valueParts, hotParts = [], [], []
+  hotArray = None
+  if hotSpots is not None:
+    hotComponents = sitk.ConnectedComponent(sitk.Cast(hotSpots != 0, sitk.sitkUInt8))
+    hotArray = sitk.GetArrayViewFromImage(hotComponents).ravel()
+  for labelImage in labelImages:
+    labelArray = sitk.GetArrayViewFromImage(labelImage).ravel()
+    labelled = np.flatnonzero(labelArray)
+    labelParts.append(labelArray[labelled].astype(np.int64))
+    valueParts.append(values[labelled].astype(np.float64))
+    if hotArray is not None:
+      hotParts.append(hotArray[labelled].astype(np.int64))
+  pixelLabels = np.concatenate(labelParts)
+  pixelValues = np.concatenate(valueParts)
+
+  order = np.lexsort((pixelValues, pixelLabels))
+  sortedLabels = pixelLabels[order]
+  sortedValues = pixelValues[order]
+  present, starts, counts = np.unique(sortedLabels, return_index=True, return_counts=True)
+  sums = np.add.reduceat(sortedValues, starts) if len(starts) else np.zeros(0)
+  squares = np.add.reduceat(sortedValues ** 2, starts) if len(starts) else np.zeros(0)
+  means = sums / np.maximum(counts, 1)
+  stds = np.sqrt(np.maximum(squares / np.maximum(counts, 1) - means ** 2, 0.0))
+
+  # linear interpolation between the closest ranks, as numpy.percentile
+  percentileValues = {}
+  for percentile in percentiles:
+    rank = (counts - 1) * (percentile / 100.0)
+    below = np.floor(rank).astype(np.int64)
+    above = np.minimum(below + 1, counts - 1)
+    fraction = rank - below
+    percentileValues[percentile] = (sortedValues[starts + below] * (1 - fraction) + sortedValues[starts + above] * fraction
+                                    if len(starts) else np.zeros(0))
+
+  hotSpotCounts, hotSpotAreas = {}, {}
+  if hotArray is not None:
+    pixelHot = np.concatenate(hotParts)
+    hot = pixelHot != 0
+    hotLabels, hotAreas = np.unique(pixelLabels[hot], return_counts=True)
+    hotSpotAreas = dict(zip(hotLabels.tolist(), hotAreas.tolist()))
+    pairs = np.unique(np.vstack((pixelLabels[hot], pixelHot[hot])), axis=1)
+    pairLabels, pairCounts = np.unique(pairs[0], return_counts=True)
+    hotSpotCounts = dict(zip(pairLabels.tolist(), pairCounts.tolist()))
+
+  rowIndex = dict((int(label), index) for index, label in enumerate(present))
+  rows = []
+  for label in sorted(set(rowIndex) | set(labels or ())):
+    index = rowIndex.get(label)
+    row = collections.OrderedDict([("label", label), ("name", regionName(label))])
+    if index is None:
+      row.update(area=0, areaMm2=0.0, mean=float("nan"), std=float("nan"), min=float("nan"), max=float("nan"))
+      row.update(("p%g" % percentile, float("nan")) for percentile in percentiles)
+    else:
+      start, count = starts[index], counts[index]
+      row.update(area=int(count), areaMm2=float(count * pixelArea), mean=float(means[index]), std=float(stds[index]),
+                 min=float(sortedValues[start]), max=float(sortedValues[start + count - 1]))
+      row.update(("p%g" % percentile, float(percentileValues[percentile][index])) for percentile in percentiles)
+    row.update(hotSpots=hotSpotCounts.get(label, 0), hotSpotArea=hotSpotAreas.get(label, 0))
+    rows.append(row)
+  return rows
@@ -0,0 +1,202 @@
+"""Persistent, content-addressed cache of intermediate results.
+
+Keys hash the input pixels and geometry together with the stage name and
+its parameters, so a result is found again whatever node, session or file
+the pixels came from. Each entry is a directory holding one uncompressed
+.npy file per image and an entry.json file with the image geometries and
+any JSON data (statistics, table rows). Entries are written to a temporary
+directory and renamed into place, so readers never see half-written
+entries.
+
+CacheEntry.array reads an image back memory-mapped: only the pages used
+are read, and they stay reclaimable file pages. A SimpleITK image owns its
+buffer, so CacheEntry.image copies the whole array into memory; callers
+that only need the pixels (to fill a volume node, for statistics) use
+array().
+
+The total size is capped: after each write the least recently used entries
+are removed, reading an entry making it the most recently used one.
+"""
+
+import collections
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+
+import numpy as np
+import SimpleITK as sitk
+
+# Bump when the stored layout or the stage outputs change
+FORMAT_VERSION = 1
+
+DEFAULT_MAX_BYTES = 1024 ** 3
+
+ENTRY_FILE = "entry.json"
+
+
+def _updateWithImage(hasher, image):
+  if isinstance(image, np.ndarray):
+    hasher.update(repr((image.dtype.str, image.shape)).encode())
+    hasher.update(np.ascontiguousarray(image).data)
+    return
+  hasher.update(repr((image.GetPixelIDTypeAsString(), image.GetSize(), image.GetNumberOfComponentsPerPixel(),
+                      image.GetSpacing(), image.GetOrigin(), image.GetDirection())).encode())
+  hasher.update(np.ascontiguousarray(sitk.GetArrayViewFromImage(image)).data)
+
+
+def cacheKey(stage, images, parameterKey=None):
+  """Hex digest of a stage, its input images and its parameters.
+
+  images is a list, or a dict by name, of SimpleITK images or numpy arrays
+  (pixels only, e.g. the array of a volume node).
+  """
+  hasher = hashlib.blake2b(digest_size=20)
+  hasher.update(repr((FORMAT_VERSION, stage, parameterKey)).encode())
+  if isinstance(images, dict):
+    images = [images[name] for name in sorted(images)]
+  for image in images:
+    _updateWithImage(hasher, image)
+  return hasher.hexdigest()
+
+
+def _directorySize(path):
+  return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+
+class CacheEntry(object):
+  """One cached result: images by name and JSON data"""
+
+  def __init__(self, path, description):
+    self.path = path
+    self.description = description
+
+  @property
+  def data(self):
+    return self.description["data"]
+
+  def names(self):
+    return list(self.description["images"])
+
+  def array(self, name):
+    """Memory-mapped, read-only pixel array of image name"""
+    return np.load(os.path.join(self.path, name + ".npy"), mmap_mode="r")
+
+  def image(self, name):
+    """Image name as a SimpleITK image with its original geometry.
+
+    The pixels are copied out of the memory-mapped file: use array() when
+    the pixels are all that is needed.
+    """
+    geometry = self.description["images"][name]
+    image = sitk.GetImageFromArray(self.array(name), isVector=geometry["components"] > 1)
+    image.SetSpacing(geometry["spacing"])
+    image.SetOrigin(geometry["origin"])
+    image.SetDirection(geometry["direction"])
+    return image
+
+
+class DiskCache(object):
+  """Cache directory holding at most maxBytes of entries.
+
+  Set enabled to False to bypass it (get misses, put does nothing). It can
+  be used from worker threads.
+  """
+
+  def __init__(self, directory, maxBytes=DEFAULT_MAX_BYTES):
+    self.directory = directory
+    self.maxBytes = maxBytes
+    self.enabled = True
+    self.lock = threading.Lock()
+    # key -> size in bytes, least recently used first; read from disk on first use
+    self.sizes = None
+
+  def _loadSizes(self):
+    if self.sizes is not None:
+      return
+    self.sizes = collections.OrderedDict()
+    if not os.path.isdir(self.directory):
+      return
+    entries = []
+    for key in os.listdir(self.directory):
+      path = os.path.join(self.directory, key)
+      entryFile = os.path.join(path, ENTRY_FILE)
+      if key.startswith(".") or not os.path.isfile(entryFile):
+        continue
+      entries.append((os.path.getmtime(entryFile), key, _directorySize(path)))
+    for accessTime, key, size in sorted(entries):
+      self.sizes[key] = size
+
+  def key(self, stage, images, parameterKey=None):
+    return cacheKey(stage, images, parameterKey)
+
+  def totalBytes(self):
+    with self.lock:
+      self._loadSizes()
+      return sum(self.sizes.values())
+
+  def get(self, key):
+    """CacheEntry of key, or None"""
+    if not self.enabled:
+      return None
+    path = os.path.join(self.directory, key)
+    with self.lock:
+      self._loadSizes()
+      try:
+        with open(os.path.join(path, ENTRY_FILE)) as entryFile:
+          description = json.load(entryFile)
+        os.utime(os.path.join(path, ENTRY_FILE))
+      except (OSError, ValueError):
+        return None
+      if key in self.sizes:
+        self.sizes.move_to_end(key)
+    return CacheEntry(path, description)
+
+  def put(self, key, images=None, data=None):
+    """Store images (dict name -> SimpleITK image) and JSON data under key"""
+    if not self.enabled:
+      return
+    images = images or {}
+    description = {"version": FORMAT_VERSION, "images": {}, "data": data}
+    temporary = None
+    try:
+      os.makedirs(self.directory, exist_ok=True)
+      temporary = tempfile.mkdtemp(prefix=".", dir=self.directory)
+      for name, image in images.items():
+        np.save(os.path.join(temporary, name + ".npy"), sitk.GetArrayViewFromImage(image))
+        description["images"][name] = {"spacing": image.GetSpacing(), "origin": image.GetOrigin(),
+                                       "direction": image.GetDirection(),
+                                       "components": image.GetNumberOfComponentsPerPixel()}
+      with open(os.path.join(temporary, ENTRY_FILE), "w") as entryFile:
+        json.dump(description, entryFile)
+      size = _directorySize(temporary)
+      with self.lock:
+        self._loadSizes()
+        path = os.path.join(self.directory, key)
+        if os.path.isdir(path):
+          # written meanwhile by another run of the same stage
+          shutil.rmtree(temporary, ignore_errors=True)
+          return
+        os.rename(temporary, path)
+        self.sizes[key] = size
+        self._evict()
+    except (OSError, TypeError, ValueError) as e:
+      logging.warning("result cache: cannot store %s: %s" % (key, e))
+      if temporary is not None:
+        shutil.rmtree(temporary, ignore_errors=True)
+
+  def _evict(self):
+    while self.sizes and sum(self.sizes.values()) > self.maxBytes:
+      key, size = self.sizes.popitem(last=False)
+      shutil.rmtree(os.path.join(self.directory, key), ignore_errors=True)
+
+  def clear(self):
+    """Remove every entry"""
+    with self.lock:
+      self._loadSizes()
+      for key in list(self.sizes):
+        shutil.rmtree(os.path.join(self.directory, key), ignore_errors=True)
+      self.sizes.clear()
@@ -0,0 +1,53 @@
+"""Automatic foot seeds.
+
+The feet are the warm mode of the temperature histogram: an Otsu threshold
+on a bin-shrunk frame separates them from the background, a small opening
+removes speckle, and the largest connected components are taken as the
+feet. Each seed is the pixel of its component farthest from the component
+border, so a flood fill never starts on an edge or a stray warm pixel.
+
+Seeds follow the convention of the rest of the module: right foot first,
+the right foot being the one on the image left (smaller i).
+"""
+
+import numpy as np
+import SimpleITK as sitk
+
+# The frame is bin shrunk to about this width before detection
+DETECTION_WIDTH = 320
+
+# Components smaller than this fraction of the frame are not feet
+MINIMUM_FOOT_FRACTION = 0.005
+
+
+def footComponents(image, shrink):
+  """(label map, distance map) of the warm components of the shrunk frame, largest component first"""
+  small = sitk.BinShrink(sitk.Cast(image, sitk.sitkFloat32), [shrink, shrink])
+  warm = sitk.BinaryMorphologicalOpening(sitk.OtsuThreshold(small, 0, 1), [1, 1])
+  width, height = small.GetSize()
+  components = sitk.RelabelComponent(sitk.ConnectedComponent(warm),
+                                     minimumObjectSize=int(MINIMUM_FOOT_FRACTION * width * height))
+  distance = sitk.SignedMaurerDistanceMap(warm, insideIsPositive=True, squaredDistance=True, useImageSpacing=False)
+  return components, distance
+
+
+def detectFootSeeds(image, numberOfFeet=2):
+  """Return numberOfFeet seeds (i, j) of a 2D thermogram, sorted by i (right foot first).
+
+  Raises ValueError if fewer warm components than numberOfFeet are found.
+  """
+  width, height = image.GetSize()[0:2]
+  shrink = max(1, width // DETECTION_WIDTH)
+  components, distance = footComponents(image, shrink)
+  labelArray = sitk.GetArrayViewFromImage(components)
+  distanceArray = sitk.GetArrayViewFromImage(distance)
+  if labelArray.max() < numberOfFeet:
+    raise ValueError("found %d warm region(s), %d feet expected" % (labelArray.max(), numberOfFeet))
+
+  seeds = []
+  for label in range(1, numberOfFeet + 1):
+    deepest = np.argmax(np.where(labelArray == label, distanceArray, -np.inf))
+    row, column = np.unravel_index(deepest, labelArray.shape)
+    # center of the bin in the full frame
+    seeds.append((min(int(column) * shrink + shrink // 2, width - 1), min(int(row) * shrink + shrink // 2, height - 1)))
+  return sorted(seeds)
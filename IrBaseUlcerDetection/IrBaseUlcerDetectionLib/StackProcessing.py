@@ -0,0 +1,52 @@
+"""Parallel processing of stacked exams.
+
+Each z slice of a stack is an independent thermogram, so the whole
+runProcessing chain runs on every slice concurrently and the outputs are
+stacked back into one volume. Threads are used by default (SimpleITK
+filters release the GIL); a process pool can be used instead for headless
+batch runs. Each SimpleITK filter is limited to its share of the cores so
+that slices, not filter threads, are what runs in parallel.
+"""
+
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import SimpleITK as sitk
+
+from . import ProcessingEngine, TiledProcessing
+
+
+def defaultWorkerCount():
+  return multiprocessing.cpu_count()
+
+
+def _initProcessWorker():
+  sitk.ProcessObject.SetGlobalDefaultNumberOfThreads(1)
+
+
+def _processSlice(image, parameters):
+  return ProcessingEngine.runProcessing(image, parameters).image
+
+
+def processSlices(slices, parameters, workers=None, useProcesses=False):
+  """Run runProcessing on every 2D image of slices in parallel and return the outputs in order"""
+  parameters.validate()
+  slices = list(slices)
+  workers = max(1, min(workers or defaultWorkerCount(), len(slices) or 1))
+  if useProcesses:
+    with ProcessPoolExecutor(max_workers=workers, initializer=_initProcessWorker) as executor:
+      return list(executor.map(_processSlice, slices, [parameters] * len(slices)))
+
+  with TiledProcessing.limitFilterThreads(workers), ThreadPoolExecutor(max_workers=workers) as executor:
+    return list(executor.map(lambda image: _processSlice(image, parameters), slices))
+
+
+def processStack(image, parameters, workers=None, useProcesses=False):
+  """Process every z slice of a 3D image in parallel and return the outputs as one volume"""
+  slices = [ProcessingEngine.extractSlice(image, zslice) for zslice in range(image.GetSize()[2])]
+  outputs = processSlices(slices, parameters, workers, useProcesses)
+  volume = sitk.JoinSeries(outputs)
+  volume.SetSpacing(image.GetSpacing())
+  volume.SetOrigin(image.GetOrigin())
+  volume.SetDirection(image.GetDirection())
+  return volume
@@ -0,0 +1,195 @@
+"""Lazy, memoized stage graph of the interactive processing pipeline.
+
+Each stage names the stages it reads and the parameter values it depends
+on. Its memo key is its name, those values and the keys of its inputs, so
+a stage is computed again only when something upstream of it changed:
+switching the mode from "image segmentation" to "+ no holes" only fills
+the holes of the mask already computed, and moving a temperature slider
+leaves the smoothed image alone.
+
+Results are kept in memory, least recently used first, and evicted once
+their total size goes over maxBytes. Sizes are read again at every
+eviction: a ThresholdIndex builds its level maps on its first lookup, after
+it was memoized. Stages report to the engine observer
+only when they are computed, so a memoized run reports just "done".
+"""
+
+import collections
+import threading
+
+import SimpleITK as sitk
+
+from . import ProcessingEngine, ResultCache
+from .ThresholdIndex import ThresholdIndex
+
+DEFAULT_MAX_BYTES = 256 * 1024 ** 2
+
+INPUT_IMAGE = "image"
+
+
+def valueBytes(value):
+  """Approximate memory size of a stage result"""
+  if isinstance(value, sitk.Image):
+    return value.GetNumberOfPixels() * value.GetNumberOfComponentsPerPixel() * value.GetSizeOfPixelComponent()
+  if isinstance(value, (tuple, list)):
+    return sum(valueBytes(each) for each in value)
+  return getattr(value, "nbytes", 0)
+
+
+class Stage(object):
+  """compute(parameters, *input values) -> result; key(parameters) -> the parameter values it reads"""
+
+  def __init__(self, name, compute, inputs=(), key=None, progress=0.0):
+    self.name = name
+    self.compute = compute
+    self.inputs = tuple(inputs)
+    self.key = key or (lambda parameters: None)
+    self.progress = progress
+
+
+class StageGraph(object):
+  """Stages evaluated on demand, with their results memoized.
+
+  Graph inputs are not stages: evaluate takes them as a dict name -> (key,
+  value), the key identifying the value (e.g. a node and its modification
+  time) and the value being the input itself or a function returning it,
+  called only when a stage has to be computed from it. Evaluation can run
+  from worker threads; two threads missing the same stage both compute it.
+  """
+
+  def __init__(self, maxBytes=DEFAULT_MAX_BYTES):
+    self.stages = collections.OrderedDict()
+    self.maxBytes = maxBytes
+    self.lock = threading.Lock()
+    # memo key -> result, least recently used first
+    self.memo = collections.OrderedDict()
+    self.hits = 0
+    self.misses = 0
+
+  def addStage(self, name, compute, inputs=(), key=None, progress=0.0):
+    self.stages[name] = Stage(name, compute, inputs, key, progress)
+
+  def stageKey(self, name, parameters, inputs):
+    """Memo key of stage name: its parameter key and the keys of everything upstream"""
+    if name not in self.stages:
+      return ("input", name, inputs[name][0])
+    stage = self.stages[name]
+    return (name, stage.key(parameters)) + tuple(self.stageKey(each, parameters, inputs) for each in stage.inputs)
+
+  def isCached(self, name, parameters, inputs):
+    with self.lock:
+      return self.stageKey(name, parameters, inputs) in self.memo
+
+  def evaluate(self, name, parameters, inputs, observer=None):
+    """Result of stage name, computing only the stages whose key is not memoized"""
+    return self._evaluate(name, parameters, inputs, observer, {})
+
+  def _evaluate(self, name, parameters, inputs, observer, loaded):
+    if name not in self.stages:
+      if name not in loaded:
+        value = inputs[name][1]
+        loaded[name] = value() if callable(value) else value
+      return loaded[name]
+
+    key = self.stageKey(name, parameters, inputs)
+    with self.lock:
+      if key in self.memo:
+        self.memo.move_to_end(key)
+        self.hits += 1
+        return self.memo[key]
+      self.misses += 1
+    stage = self.stages[name]
+    values = [self._evaluate(each, parameters, inputs, observer, loaded) for each in stage.inputs]
+    ProcessingEngine.reportStage(observer, name, stage.progress)
+    result = stage.compute(parameters, *values)
+    with self.lock:
+      self.memo[key] = result
+      self._evict()
+    return result
+
+  def totalBytes(self):
+    with self.lock:
+      return sum(valueBytes(result) for result in self.memo.values())
+
+  def _evict(self):
+    total = sum(valueBytes(result) for result in self.memo.values())
+    while len(self.memo) > 1 and total > self.maxBytes:
+      key, result = self.memo.popitem(last=False)
+      total -= valueBytes(result)
+
+  def clear(self):
+    with self.lock:
+      self.memo.clear()
+
+
+class ProcessingGraph(StageGraph):
+  """ProcessingEngine.runProcessing as a stage graph:
+
+    image -> extraction -> smoothing -> threshold index -> segmentation -> hole filling -> contouring
+                                     \\-> smoothed temperatures         \\-> masked temperatures
+
+  Segmentation is looked up in a ThresholdIndex of the smoothed slice, so
+  a new temperature window costs a comparison. smooth(image, parameters)
+  replaces ProcessingEngine.smoothImage, e.g. to go through a result cache.
+  """
+
+  # stage whose result is the displayed image of each mode
+  MODE_OUTPUTS = {
+    ProcessingEngine.MODE_ORIGINAL: "extraction",
+    ProcessingEngine.MODE_SMOOTHING: "smoothed temperatures",
+    ProcessingEngine.MODE_SEGMENTATION: "masked temperatures",
+    ProcessingEngine.MODE_SEGMENTATION_NO_HOLES: "hole filling",
+    ProcessingEngine.MODE_CONTOURING: "contouring",
+    }
+
+  def __init__(self, smooth=None, maxBytes=DEFAULT_MAX_BYTES):
+    StageGraph.__init__(self, maxBytes)
+    smooth = smooth or ProcessingEngine.smoothImage
+    self.addStage("extraction", lambda parameters, image: ProcessingEngine.extractSlice(image, parameters.zslice),
+                  [INPUT_IMAGE], lambda parameters: parameters.zslice, 0.0)
+    self.addStage("smoothing", lambda parameters, image: smooth(image, parameters),
+                  ["extraction"], lambda parameters: parameters.smoothingKey(), 0.1)
+    self.addStage("smoothed temperatures", lambda parameters, imgSmooth: ProcessingEngine.temperatureOutput(imgSmooth, parameters),
+                  ["smoothing"], progress=0.9)
+    self.addStage("threshold index", lambda parameters, imgSmooth: ThresholdIndex(imgSmooth, parameters.seeds),
+                  ["smoothing"], lambda parameters: tuple(parameters.seeds), 0.4)
+    self.addStage("segmentation", lambda parameters, index: index.region(parameters.tempMin, parameters.tempMax),
+                  ["threshold index"], lambda parameters: (parameters.tempMin, parameters.tempMax), 0.6)
+    self.addStage("masked temperatures",
+                  lambda parameters, imgSmooth, mask: ProcessingEngine.temperatureOutput(ProcessingEngine.maskImage(imgSmooth, mask), parameters),
+                  ["smoothing", "segmentation"], progress=0.9)
+    self.addStage("hole filling", lambda parameters, mask: ProcessingEngine.fillHoles(mask, parameters),
+                  ["segmentation"], lambda parameters: parameters.holeFillingKey(), 0.7)
+    self.addStage("contouring", lambda parameters, mask: ProcessingEngine.contourLabels(mask, parameters.tileSize),
+                  ["hole filling"], progress=0.9)
+
+  def run(self, image, parameters, imageKey=None, observer=None):
+    """ProcessingResult of parameters.mode on image, as ProcessingEngine.runProcessing returns it.
+
+    image may be a function returning the image, called only on a miss.
+    imageKey identifies the image pixels; by default they are hashed.
+    Without seeds, the feet are detected on the slice.
+    """
+    parameters.validate()
+    if imageKey is None:
+      image = image() if callable(image) else image
+      imageKey = ResultCache.cacheKey(INPUT_IMAGE, [image])
+    inputs = {INPUT_IMAGE: (imageKey, image)}
+    mode = parameters.mode
+    if mode in ProcessingEngine.SEGMENTATION_MODES and not parameters.seeds:
+      parameters = ProcessingEngine.withSeeds(self.evaluate("extraction", parameters, inputs, observer), parameters)
+
+    def stage(name):
+      return self.evaluate(name, parameters, inputs, observer)
+
+    output = stage(self.MODE_OUTPUTS[mode])
+    if mode == ProcessingEngine.MODE_ORIGINAL:
+      result = ProcessingEngine.ProcessingResult(mode, output)
+    elif mode == ProcessingEngine.MODE_SMOOTHING:
+      result = ProcessingEngine.ProcessingResult(mode, output, smoothed=stage("smoothing"))
+    elif mode == ProcessingEngine.MODE_SEGMENTATION:
+      result = ProcessingEngine.ProcessingResult(mode, output, smoothed=stage("smoothing"), mask=stage("segmentation"))
+    else:
+      result = ProcessingEngine.ProcessingResult(mode, output, smoothed=stage("smoothing"), mask=stage("hole filling"))
+    ProcessingEngine.reportStage(observer, "done", 1.0)
+    return result
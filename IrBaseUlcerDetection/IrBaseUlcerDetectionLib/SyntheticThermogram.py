@@ -0,0 +1,80 @@
+"""Synthetic plantar thermograms for tests and benchmarks.
+
+A frame holds two foot-shaped warm regions on a cooler background, with
+sensor noise and a few hot spots, in degrees. Shapes scale with the frame
+size, so the same generator covers 160x120 sensors up to 1280x1024 ones.
+"""
+
+import numpy as np
+import SimpleITK as sitk
+
+# Standard sensor sizes (width, height)
+FRAME_SIZES = (
+  (160, 120),
+  (320, 240),
+  (640, 480),
+  (1280, 1024),
+  )
+
+
+def _footMask(x, y, centerX, centerY, scale):
+  """Sole outline: forefoot and heel ellipses joined by a narrower arch"""
+  forefoot = ((x - centerX) / (0.16 * scale)) ** 2 + ((y - (centerY - 0.14 * scale)) / (0.22 * scale)) ** 2 <= 1
+  heel = ((x - centerX) / (0.11 * scale)) ** 2 + ((y - (centerY + 0.22 * scale)) / (0.13 * scale)) ** 2 <= 1
+  arch = (np.abs(x - centerX) <= 0.10 * scale) & (y >= centerY - 0.14 * scale) & (y <= centerY + 0.22 * scale)
+  return forefoot | heel | arch
+
+
+def footThermogram(width=320, height=240, randomSeed=0, ambient=22.0, footTemperature=31.0, noise=0.15,
+                   hotSpots=2, hotSpotDelta=2.5, shift=(0, 0), noiseSeed=None, coldSpots=0, coldSpotDelta=-6.0):
+  """Return (image, seeds) for one synthetic frame.
+
+  image is a 2D float32 SimpleITK image in degrees; seeds holds the right
+  and the left foot seed in pixel coordinates, as runSegmentation expects.
+  shift moves both feet by (dx, dy) pixels and noiseSeed, if given, draws
+  new noise over the same hot spots, to build sequences. coldSpots small
+  spots coldSpotDelta degrees below the foot leave holes in its region.
+  """
+  rng = np.random.RandomState(randomSeed)
+  y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+  scale = min(width / 2.0, float(height))
+  centers = [(width * 0.28 + shift[0], height * 0.5 + shift[1]), (width * 0.72 + shift[0], height * 0.5 + shift[1])]
+
+  temperatures = np.full((height, width), ambient, dtype=np.float32)
+  for centerX, centerY in centers:
+    foot = _footMask(x, y, centerX, centerY, scale)
+    # slightly cooler toes than heel
+    temperatures[foot] = footTemperature + 0.5 * (y[foot] - centerY) / scale
+    for spot in range(hotSpots):
+      spotX = centerX + rng.uniform(-0.08, 0.08) * scale
+      spotY = centerY + rng.uniform(-0.25, 0.25) * scale
+      radius = 0.03 * scale
+      spotMask = foot & (((x - spotX) ** 2 + (y - spotY) ** 2) <= radius ** 2)
+      temperatures[spotMask] += hotSpotDelta
+    for spot in range(coldSpots):
+      spotX = centerX + rng.uniform(-0.12, 0.12) * scale
+      spotY = centerY + rng.uniform(-0.3, 0.3) * scale
+      radius = rng.uniform(0.003, 0.02) * scale
+      spotMask = foot & (((x - spotX) ** 2 + (y - spotY) ** 2) <= radius ** 2)
+      temperatures[spotMask] += coldSpotDelta
+  noiseRng = rng if noiseSeed is None else np.random.RandomState(noiseSeed)
+  temperatures += noiseRng.normal(0.0, noise, temperatures.shape).astype(np.float32)
+
+  image = sitk.GetImageFromArray(temperatures)
+  seeds = [(int(round(centerX)), int(round(centerY))) for centerX, centerY in centers]
+  return image, seeds
+
+
+def thermogramStack(width=320, height=240, frames=8, drift=(1, 0), randomSeed=0, **frameOptions):
+  """Return (volume, seeds) with frames z slices, the feet drifting by drift pixels per frame.
+
+  seeds are those of the first frame.
+  """
+  slices = []
+  seeds = None
+  for frame in range(frames):
+    image, frameSeeds = footThermogram(width, height, randomSeed=randomSeed, noiseSeed=randomSeed + frame + 1,
+                                       shift=(drift[0] * frame, drift[1] * frame), **frameOptions)
+    slices.append(image)
+    seeds = seeds or frameSeeds
+  return sitk.JoinSeries(slices), seeds
@@ -0,0 +1,161 @@
+"""Threshold index for instant re-segmentation of one smoothed image.
+
+ConnectedThreshold keeps a pixel when a path of pixels inside [tempMin,
+tempMax] joins it to a seed. With tempMax fixed, the highest tempMin for
+which a pixel is still reached is its maximin path value from the seeds,
+which grayscale reconstruction by dilation computes in one pass (and
+reconstruction by erosion gives the minimax value for a fixed tempMin).
+Once one of those maps is built, the region of any window that keeps that
+bound is a single comparison, and the region area over the whole slider
+range is a sorted lookup.
+
+Temperatures are indexed as integer levels of `resolution` degrees (the
+temperature sliders use two decimals), which keeps the reconstruction on
+integer pixels. Like ConnectedThreshold, pixels and bounds are compared in
+the pixel type of the image: a float32 pixel of 31.99 is 31.98999977, as
+is the bound 31.99 once cast, so both get the level of 31.99. Results equal
+ConnectedThreshold for every window whose bounds are multiples of the
+resolution.
+"""
+
+import numpy as np
+import SimpleITK as sitk
+
+from . import ProcessingEngine
+
+DEFAULT_RESOLUTION = 0.01
+
+
+def _gridValues(levels, resolution, pixelType):
+  """Temperatures of levels as ConnectedThreshold compares them: the double bound cast to the pixel type"""
+  return np.round(levels * resolution, 9).astype(pixelType)
+
+
+def _levels(values, resolution, rounding):
+  """Integer temperature levels of values, np.floor or np.ceil to the grid in the pixel type of values"""
+  values = np.asarray(values)
+  levels = rounding(values.astype(np.float64) / resolution).astype(np.int64)
+  # the division is off by one level when the value and the grid temperature only agree in the pixel type
+  if rounding is np.floor:
+    levels += _gridValues(levels + 1, resolution, values.dtype) <= values
+    levels -= _gridValues(levels, resolution, values.dtype) > values
+  else:
+    levels -= _gridValues(levels - 1, resolution, values.dtype) >= values
+    levels += _gridValues(levels, resolution, values.dtype) < values
+  return levels
+
+
+class ThresholdIndex(object):
+  """ConnectedThreshold lookups for one smoothed image and one seed list.
+
+  Only the map of the bound that was kept fixed by the last query is
+  rebuilt, so moving one temperature slider at a time costs one
+  reconstruction when the drag starts and a comparison per update after.
+  """
+
+  def __init__(self, imgSmooth, seeds, resolution=DEFAULT_RESOLUTION):
+    self.smoothed = imgSmooth
+    self.seeds = [tuple(seed[0:2]) for seed in seeds]
+    # numpy indexing would wrap negative seeds to the other side of the frame
+    ProcessingEngine.checkSeeds(imgSmooth.GetSize(), self.seeds)
+    self.resolution = resolution
+    self._values = sitk.GetArrayViewFromImage(imgSmooth)
+    self._lowerBounds = None  # (tempMax, maximin level map)
+    self._upperBounds = None  # (tempMin, minimax level map)
+    self._lastQuery = None
+
+  def _bound(self, temperature):
+    """temperature cast to the pixel type, as ConnectedThreshold casts its bounds"""
+    return np.asarray(temperature, dtype=np.float64).astype(self._values.dtype)
+
+  def matches(self, imgSmooth, seeds):
+    """True if the index answers queries for imgSmooth and seeds"""
+    return imgSmooth is self.smoothed and self.seeds == [tuple(seed[0:2]) for seed in seeds]
+
+  @property
+  def nbytes(self):
+    """Memory held by the level maps built so far (the smoothed image is not counted)"""
+    return sum(bounds[1].nbytes for bounds in (self._lowerBounds, self._upperBounds) if bounds is not None)
+
+  def _reconstruct(self, blocked, levels, reconstruction, outside):
+    """Reconstruct from the seeds over the pixels that are not blocked.
+
+    levels are shifted to 1..n so that 0 and n+1 are free to mark blocked
+    pixels. The returned map is in absolute levels, with the lowest int64 for
+    unreachable pixels of a dilation and the highest one for an erosion, so
+    that they never pass a threshold comparison.
+    """
+    offset = levels.min() - 1
+    levels = levels - offset
+    pixelType = np.uint16 if levels.max() + 1 < np.iinfo(np.uint16).max else np.uint32
+    if outside == 'low':
+      outside, unreachableLevel = 0, np.iinfo(np.int64).min
+    else:
+      outside, unreachableLevel = levels.max() + 1, np.iinfo(np.int64).max
+    maskArray = np.where(blocked, outside, levels).astype(pixelType)
+    markerArray = np.full(levels.shape, outside, dtype=pixelType)
+    for i, j in self.seeds:
+      if not blocked[j, i]:
+        markerArray[j, i] = maskArray[j, i]
+    bounds = sitk.GetArrayFromImage(reconstruction(sitk.GetImageFromArray(markerArray), sitk.GetImageFromArray(maskArray)))
+    bounds = bounds.astype(np.int64)
+    unreachable = bounds == outside
+    bounds += offset
+    bounds[unreachable] = unreachableLevel
+    return bounds
+
+  def lowerBounds(self, tempMax):
+    """For each pixel, the level of the highest tempMin at which it is still in the region"""
+    if self._lowerBounds is None or self._lowerBounds[0] != tempMax:
+      levels = _levels(self._values, self.resolution, np.floor)
+      bounds = self._reconstruct(self._values > self._bound(tempMax), levels, sitk.ReconstructionByDilation, 'low')
+      self._lowerBounds = (tempMax, bounds)
+    return self._lowerBounds[1]
+
+  def upperBounds(self, tempMin):
+    """For each pixel, the level of the lowest tempMax at which it is already in the region"""
+    if self._upperBounds is None or self._upperBounds[0] != tempMin:
+      levels = _levels(self._values, self.resolution, np.ceil)
+      bounds = self._reconstruct(self._values < self._bound(tempMin), levels, sitk.ReconstructionByErosion, 'high')
+      self._upperBounds = (tempMin, bounds)
+    return self._upperBounds[1]
+
+  def _regionByTempMin(self, tempMax, tempMin):
+    bounds = self.lowerBounds(tempMax)
+    return bounds >= _levels(self._bound(tempMin), self.resolution, np.ceil)
+
+  def _regionByTempMax(self, tempMin, tempMax):
+    bounds = self.upperBounds(tempMin)
+    return bounds <= _levels(self._bound(tempMax), self.resolution, np.floor)
+
+  def regionArray(self, tempMin, tempMax):
+    """Boolean array of the ConnectedThreshold region of [tempMin, tempMax]"""
+    if self._lowerBounds is not None and self._lowerBounds[0] == tempMax:
+      region = self._regionByTempMin(tempMax, tempMin)
+    elif self._upperBounds is not None and self._upperBounds[0] == tempMin:
+      region = self._regionByTempMax(tempMin, tempMax)
+    elif self._lastQuery is not None and self._lastQuery[0] == tempMin:
+      # tempMax is the bound being dragged
+      region = self._regionByTempMax(tempMin, tempMax)
+    else:
+      region = self._regionByTempMin(tempMax, tempMin)
+    self._lastQuery = (tempMin, tempMax)
+    return region
+
+  def region(self, tempMin, tempMax, label=1):
+    """Region of [tempMin, tempMax] as a mask image, as sitk.ConnectedThreshold returns it"""
+    mask = sitk.GetImageFromArray(self.regionArray(tempMin, tempMax).astype(np.uint8) * np.uint8(label))
+    mask.CopyInformation(self.smoothed)
+    return mask
+
+  def areaByTempMin(self, tempMax, tempMins):
+    """Region area in pixels for each value of tempMins, with tempMax fixed"""
+    bounds = self.lowerBounds(tempMax)
+    bounds = np.sort(bounds[bounds != np.iinfo(np.int64).min])
+    return len(bounds) - np.searchsorted(bounds, _levels(self._bound(tempMins), self.resolution, np.ceil), side='left')
+
+  def areaByTempMax(self, tempMin, tempMaxs):
+    """Region area in pixels for each value of tempMaxs, with tempMin fixed"""
+    bounds = self.upperBounds(tempMin)
+    bounds = np.sort(bounds[bounds != np.iinfo(np.int64).max])
+    return np.searchsorted(bounds, _levels(self._bound(tempMaxs), self.resolution, np.floor), side='right')
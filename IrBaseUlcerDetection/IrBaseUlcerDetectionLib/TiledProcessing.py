@@ -0,0 +1,220 @@
+"""Tiled execution of the smoothing and morphology stages on large frames.
+
+Stitched panoramas and high resolution sensors give frames whose
+full-frame intermediates (CurvatureFlow works and returns in double
+precision, whatever the input) do not fit the review workstations. Here
+each filter runs on overlapping tiles instead: a tile is the inner box it
+writes plus a halo of the filter reach (see Smoothing.smoothingHalo), so
+the inner pixels are exactly the full-frame ones and the tiles stitch
+without seams. Tiles run on a thread pool (SimpleITK filters release the
+GIL) and only tile-sized intermediates exist at any time.
+
+Frames are 2D numpy arrays, (height, width) as SimpleITK views them, and
+outputs are written into a preallocated array: with numpy.memmap input
+and output, the frame never has to be in memory, only the tiles of the
+running threads.
+
+The flood fill (ConnectedThreshold) is not local; connectedThreshold
+labels the in-window components of each tile, merges the components that
+touch across tile edges and keeps those holding a seed, which equals a
+full-frame flood fill.
+
+Boxes are (i0, j0, i1, j1) pixel ranges, i1 and j1 excluded, as in
+RegionOfInterest.
+"""
+
+import contextlib
+import multiprocessing
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import SimpleITK as sitk
+
+DEFAULT_TILE_SIZE = 512
+
+# filter thread counts of the pools running now; the SimpleITK default is process-wide
+_filterThreadsLock = threading.Lock()
+_filterThreadLimits = []
+_filterThreadsDefault = None
+
+
+@contextlib.contextmanager
+def limitFilterThreads(workers):
+  """Limit each SimpleITK filter to its share of the cores while workers threads run filters.
+
+  Pools may overlap (a stack and a background job) or nest (tiles of each
+  slice): the default is the smallest share of the running pools, and the
+  previous default is restored when the last one ends.
+  """
+  global _filterThreadsDefault
+  share = max(1, multiprocessing.cpu_count() // max(1, workers))
+  with _filterThreadsLock:
+    if not _filterThreadLimits:
+      _filterThreadsDefault = sitk.ProcessObject.GetGlobalDefaultNumberOfThreads()
+    _filterThreadLimits.append(share)
+    sitk.ProcessObject.SetGlobalDefaultNumberOfThreads(min(_filterThreadLimits))
+  try:
+    yield
+  finally:
+    with _filterThreadsLock:
+      _filterThreadLimits.remove(share)
+      sitk.ProcessObject.SetGlobalDefaultNumberOfThreads(min(_filterThreadLimits) if _filterThreadLimits else _filterThreadsDefault)
+
+
+def tileBoxes(shape, tileSize=DEFAULT_TILE_SIZE, halo=0):
+  """(inner box, outer box) of each tile of a (height, width) frame, row by row"""
+  height, width = shape[0:2]
+  tiles = []
+  for j0 in range(0, height, tileSize):
+    for i0 in range(0, width, tileSize):
+      i1, j1 = min(i0 + tileSize, width), min(j0 + tileSize, height)
+      tiles.append(((i0, j0, i1, j1), (max(i0 - halo, 0), max(j0 - halo, 0), min(i1 + halo, width), min(j1 + halo, height))))
+  return tiles
+
+
+def _boxSlices(box, origin=(0, 0)):
+  i0, j0, i1, j1 = box
+  return slice(j0 - origin[1], j1 - origin[1]), slice(i0 - origin[0], i1 - origin[0])
+
+
+def _runTiles(function, tiles, workers):
+  """function(tile) over the tiles on a thread pool, each filter limited to its share of the cores"""
+  workers = max(1, min(workers or multiprocessing.cpu_count(), len(tiles)))
+  if workers == 1:
+    return [function(tile) for tile in tiles]
+  with limitFilterThreads(workers), ThreadPoolExecutor(max_workers=workers) as executor:
+    return list(executor.map(function, tiles))
+
+
+def tileImage(array, box, spacing=(1.0, 1.0)):
+  """Tile box of a 2D array as a SimpleITK image (a copy of the tile only)"""
+  tile = sitk.GetImageFromArray(np.ascontiguousarray(array[_boxSlices(box)]))
+  tile.SetSpacing(spacing)
+  return tile
+
+
+def tiledFilter(array, function, halo, tileSize=DEFAULT_TILE_SIZE, output=None, dtype=None, spacing=(1.0, 1.0), workers=None):
+  """Run function(SimpleITK tile) -> SimpleITK image over the tiles of a 2D array.
+
+  halo: reach of function in pixels.
+  output: array of the frame shape to write to (e.g. a numpy.memmap); by
+    default a new array of dtype (default: the dtype of array).
+  Returns output.
+  """
+  if output is None:
+    output = np.empty(array.shape[0:2], dtype or array.dtype)
+
+  def run(tile):
+    inner, outer = tile
+    result = function(tileImage(array, outer, spacing))
+    output[_boxSlices(inner)] = sitk.GetArrayViewFromImage(result)[_boxSlices(inner, outer)]
+
+  _runTiles(run, tileBoxes(array.shape, tileSize, halo), workers)
+  return output
+
+
+class _UnionFind(object):
+
+  def __init__(self, size):
+    self.parent = np.arange(size)
+
+  def find(self, item):
+    root = item
+    while self.parent[root] != root:
+      root = self.parent[root]
+    while self.parent[item] != root:
+      self.parent[item], item = root, self.parent[item]
+    return root
+
+  def roots(self):
+    """Root of every item, by pointer jumping"""
+    roots = self.parent
+    while True:
+      jumped = roots[roots]
+      if np.array_equal(jumped, roots):
+        return roots
+      roots = jumped
+
+  def union(self, first, second):
+    first, second = self.find(first), self.find(second)
+    if first != second:
+      self.parent[max(first, second)] = min(first, second)
+
+
+def _inWindowComponents(array, box, lower, upper):
+  """Face-connected components of the pixels of box within [lower, upper], as ConnectedThreshold connects them"""
+  values = array[_boxSlices(box)]
+  inWindow = sitk.GetImageFromArray(((values >= lower) & (values <= upper)).astype(np.uint8))
+  components = sitk.ConnectedComponent(inWindow, False)
+  return sitk.GetArrayFromImage(components)
+
+
+def connectedThreshold(array, seeds, lower, upper, label=1, tileSize=DEFAULT_TILE_SIZE, output=None, workers=None):
+  """sitk.ConnectedThreshold of a 2D array from seeds (i, j), by tiles, as a uint8 array (or into output).
+
+  A first pass keeps only the edge rows and columns of the component
+  labels of each tile and the seed components, a second pass labels each
+  tile again and keeps the components joined to a seed.
+  """
+  if output is None:
+    output = np.zeros(array.shape[0:2], np.uint8)
+  tiles = [inner for inner, outer in tileBoxes(array.shape, tileSize)]
+
+  def edges(box):
+    components = _inWindowComponents(array, box, lower, upper)
+    seedComponents = [components[j - box[1], i - box[0]] for i, j in seeds
+                      if box[0] <= i < box[2] and box[1] <= j < box[3]]
+    return (int(components.max()), components[:, 0].copy(), components[:, -1].copy(), components[0, :].copy(),
+            components[-1, :].copy(), seedComponents)
+
+  tileEdges = _runTiles(edges, tiles, workers)
+
+  # tile components numbered after those of the previous tiles; 0 stays the background
+  offsets = np.cumsum([0] + [each[0] for each in tileEdges])
+  unionFind = _UnionFind(offsets[-1] + 1)
+  tileIndex = dict((box[0:2], index) for index, box in enumerate(tiles))
+
+  def joinEdges(first, second, firstEdge, secondEdge):
+    touching = (firstEdge != 0) & (secondEdge != 0)
+    pairs = np.unique(np.vstack((firstEdge[touching] + offsets[first], secondEdge[touching] + offsets[second])), axis=1)
+    for a, b in pairs.T:
+      unionFind.union(a, b)
+
+  for index, box in enumerate(tiles):
+    right, below = tileIndex.get((box[2], box[1])), tileIndex.get((box[0], box[3]))
+    if right is not None:
+      joinEdges(index, right, tileEdges[index][2], tileEdges[right][1])
+    if below is not None:
+      joinEdges(index, below, tileEdges[index][4], tileEdges[below][3])
+
+  seedRoots = set(unionFind.find(component + offsets[index])
+                  for index, each in enumerate(tileEdges) for component in each[5] if component != 0)
+  kept = np.isin(unionFind.roots(), list(seedRoots))
+  kept[0] = False
+
+  def fill(tileAndIndex):
+    index, box = tileAndIndex
+    components = _inWindowComponents(array, box, lower, upper)
+    region = kept[np.where(components != 0, components + offsets[index], 0)]
+    output[_boxSlices(box)] = region.astype(np.uint8) * np.uint8(label)
+
+  _runTiles(fill, list(enumerate(tiles)), workers)
+  return output
+
+
+def tiledImageFilter(image, function, halo, tileSize=DEFAULT_TILE_SIZE, pixelType=None, workers=None):
+  """tiledFilter on a 2D SimpleITK image, returning an image with its geometry"""
+  dtype = None
+  if pixelType is not None:
+    dtype = sitk.GetArrayViewFromImage(sitk.Image([1, 1], pixelType)).dtype
+  output = tiledFilter(sitk.GetArrayViewFromImage(image), function, halo, tileSize, dtype=dtype,
+                       spacing=image.GetSpacing(), workers=workers)
+  result = sitk.GetImageFromArray(output)
+  result.CopyInformation(image)
+  return result
+
+
+def needsTiles(image, tileSize):
+  """Whether a 2D image is larger than one tile of tileSize (None: tiling off)"""
+  return tileSize is not None and image.GetDimension() == 2 and max(image.GetSize()) > tileSize
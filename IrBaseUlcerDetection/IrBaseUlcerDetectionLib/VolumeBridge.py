@@ -0,0 +1,192 @@
+"""Scene side of IR-Base Ulcer Detection.
+
+Moves slices between volume nodes and the processing engine through NumPy
+views of the node image data, and keeps one reusable output node per role
+instead of cloning the working volume on every update. Masks and outlines
+go to uint8 label map nodes sharing one color table.
+"""
+
+import vtk
+import slicer
+import SimpleITK as sitk
+
+from . import ProcessingEngine
+
+# Attribute that marks the output nodes owned by the module
+ROLE_ATTRIBUTE = "IrBaseUlcerDetection.OutputRole"
+
+# Role of the color table of the label map outputs
+LABEL_COLORS_ROLE = "IrBaseUlcerDetectionLabelColors"
+
+# (label, name, (r, g, b)) of the label map outputs
+LABEL_COLORS = (
+  (ProcessingEngine.RIGHT_FOOT_LABEL, "right foot", (0.2, 0.8, 0.2)),
+  (ProcessingEngine.LEFT_FOOT_LABEL, "left foot", (0.95, 0.85, 0.2)),
+  (ProcessingEngine.CONTOUR_LABEL, "contour", (1.0, 0.2, 0.2)),
+  (ProcessingEngine.HOTSPOT_LABEL, "hot spot", (0.9, 0.2, 0.9)),
+  )
+
+
+def pullSlice(volumeNode, zslice=0):
+  """Return slice zslice of volumeNode as a 2D SimpleITK image.
+
+  The volume is read through a view of the node image data, so only the
+  requested slice is copied.
+  """
+  volumeArray = slicer.util.arrayFromVolume(volumeNode)
+  image = sitk.GetImageFromArray(volumeArray[zslice], isVector=volumeArray.ndim == 4)
+  image.SetSpacing(volumeNode.GetSpacing()[0:2])
+  return image
+
+
+def iterateSlices(volumeNode):
+  """Yield the slices of volumeNode one at a time, as pulled by pullSlice"""
+  for zslice in range(volumeNode.GetImageData().GetDimensions()[2]):
+    yield pullSlice(volumeNode, zslice)
+
+
+def pushSlice(image, volumeNode, referenceNode, zslice=0):
+  """Write a 2D SimpleITK image into volumeNode, placed on slice zslice of referenceNode.
+
+  When volumeNode already holds data of the same shape and type the pixels are
+  copied in place into its image data, otherwise the image data is reallocated.
+  """
+  imageArray = sitk.GetArrayViewFromImage(image)
+  imageArray = imageArray.reshape((1,) + imageArray.shape)
+
+  ijkToRAS = vtk.vtkMatrix4x4()
+  referenceNode.GetIJKToRASMatrix(ijkToRAS)
+  volumeNode.SetIJKToRASMatrix(ijkToRAS)
+  if zslice:
+    volumeNode.SetOrigin(ijkToRAS.MultiplyPoint((0, 0, zslice, 1))[0:3])
+
+  if volumeNode.GetImageData() is not None:
+    nodeArray = slicer.util.arrayFromVolume(volumeNode)
+    if nodeArray.shape == imageArray.shape and nodeArray.dtype == imageArray.dtype:
+      nodeArray[:] = imageArray
+      slicer.util.arrayFromVolumeModified(volumeNode)
+      return volumeNode
+  slicer.util.updateVolumeFromArray(volumeNode, imageArray)
+  return volumeNode
+
+
+def pushTable(tableNode, rows, columns):
+  """Replace the content of tableNode by rows (dicts), one column per key in columns.
+
+  Columns whose first value is a string become string columns, the others
+  double columns.
+  """
+  table = tableNode.GetTable()
+  wasModifying = tableNode.StartModify()
+  table.Initialize()
+  for column in columns:
+    isText = bool(rows) and isinstance(rows[0][column], str)
+    array = vtk.vtkStringArray() if isText else vtk.vtkDoubleArray()
+    array.SetName(column)
+    array.SetNumberOfValues(len(rows))
+    for rowIndex, row in enumerate(rows):
+      array.SetValue(rowIndex, row[column] if isText else float(row[column]))
+    table.AddColumn(array)
+  table.Modified()
+  tableNode.EndModify(wasModifying)
+  return tableNode
+
+
+class RasToIjk(object):
+  """World RAS to IJK conversion for volume nodes.
+
+  The RAS to IJK matrix of each volume, including its parent transform, is
+  cached until the volume or the transform is modified.
+  """
+
+  def __init__(self):
+    self.matrices = {}
+
+  def matrix(self, volumeNode):
+    """World RAS to IJK matrix of volumeNode"""
+    transformNode = volumeNode.GetParentTransformNode()
+    key = (volumeNode.GetMTime(), transformNode.GetMTime() if transformNode is not None else None)
+    cached = self.matrices.get(volumeNode.GetID())
+    if cached is not None and cached[0] == key:
+      return cached[1]
+
+    rasToIJK = vtk.vtkMatrix4x4()
+    volumeNode.GetRASToIJKMatrix(rasToIJK)
+    if transformNode is not None:
+      if not transformNode.IsTransformToWorldLinear():
+        raise ValueError("volume %s is under a non linear transform" % volumeNode.GetName())
+      worldToRAS = vtk.vtkMatrix4x4()
+      transformNode.GetMatrixTransformFromWorld(worldToRAS)
+      worldToIJK = vtk.vtkMatrix4x4()
+      vtk.vtkMatrix4x4.Multiply4x4(rasToIJK, worldToRAS, worldToIJK)
+      rasToIJK = worldToIJK
+    self.matrices[volumeNode.GetID()] = (key, rasToIJK)
+    return rasToIJK
+
+  def convert(self, volumeNode, rasPoint):
+    """Nearest voxel (i, j, k) of volumeNode to the world RAS point"""
+    ijk = self.matrix(volumeNode).MultiplyPoint(list(rasPoint[0:3]) + [1.0])
+    return tuple(int(round(c)) for c in ijk[0:3])
+
+
+class OutputNodePool(object):
+  """Fixed set of output nodes, one per role, reused between runs.
+
+  Nodes are found through ROLE_ATTRIBUTE, so every logic instance shares the
+  same nodes. They stay in the scene until evict or clear is called.
+  """
+
+  def __init__(self, scene=None):
+    self.scene = scene or slicer.mrmlScene
+
+  def find(self, role):
+    """Return the output node of role, or None"""
+    for node in self.nodes():
+      if node.GetAttribute(ROLE_ATTRIBUTE) == role:
+        return node
+    return None
+
+  def nodes(self):
+    """Return all output nodes currently in the scene"""
+    return [node for node in slicer.util.getNodesByClass("vtkMRMLNode", self.scene)
+            if node.GetAttribute(ROLE_ATTRIBUTE)]
+
+  def node(self, role, className="vtkMRMLScalarVolumeNode"):
+    """Return the output node of role, creating it on first use (any node class can be pooled)"""
+    node = self.find(role)
+    if node is not None and not node.IsA(className):
+      self.evict(role)
+      node = None
+    if node is None:
+      node = self.scene.AddNewNodeByClass(className, role)
+      node.SetAttribute(ROLE_ATTRIBUTE, role)
+      if node.IsA("vtkMRMLDisplayableNode"):
+        node.CreateDefaultDisplayNodes()
+    return node
+
+  def labelNode(self, role):
+    """Return the label map output node of role, displayed with the LABEL_COLORS table"""
+    labelNode = self.node(role, "vtkMRMLLabelMapVolumeNode")
+    colorNode = self.node(LABEL_COLORS_ROLE, "vtkMRMLColorTableNode")
+    numberOfColors = max(label for label, name, color in LABEL_COLORS) + 1
+    if colorNode.GetNumberOfColors() != numberOfColors:
+      colorNode.SetTypeToUser()
+      colorNode.SetNumberOfColors(numberOfColors)
+      colorNode.SetColor(0, "background", 0.0, 0.0, 0.0, 0.0)
+      for label, name, (r, g, b) in LABEL_COLORS:
+        colorNode.SetColor(label, name, r, g, b, 1.0)
+    displayNode = labelNode.GetDisplayNode()
+    if displayNode.GetColorNodeID() != colorNode.GetID():
+      displayNode.SetAndObserveColorNodeID(colorNode.GetID())
+    return labelNode
+
+  def evict(self, role):
+    """Remove the output node of role from the scene"""
+    node = self.find(role)
+    if node is not None:
+      self.scene.RemoveNode(node)
+
+  def clear(self):
+    """Remove every output node from the scene"""
+    for node in self.nodes():
+      self.scene.RemoveNode(node)
@@ -0,0 +1,43 @@
+"""Processing library of IR-Base Ulcer Detection.
+
+Slicer imports the module, and so this package, at every startup, also for
+users who never open it: importing the package must stay cheap. The names
+of ProcessingEngine it re-exports are resolved on first access, and
+lazyImport binds a module that is only executed once used. ThresholdIndex
+is imported from its module, IrBaseUlcerDetectionLib.ThresholdIndex.
+"""
+
+import importlib
+import importlib.util
+import sys
+
+
+def lazyImport(name):
+  """Module name, executed on its first attribute access instead of now.
+
+  Modules already imported are returned as they are. The first access
+  should not race between threads: use the module once from the main
+  thread before handing it to workers.
+  """
+  if name in sys.modules:
+    return sys.modules[name]
+  spec = importlib.util.find_spec(name)
+  if spec is None:
+    raise ImportError("No module named %r" % name, name=name)
+  spec.loader = importlib.util.LazyLoader(spec.loader)
+  module = importlib.util.module_from_spec(spec)
+  sys.modules[name] = module
+  spec.loader.exec_module(module)
+  parent, _, child = name.rpartition(".")
+  if parent:
+    setattr(sys.modules[parent], child, module)
+  return module
+
+
+def __getattr__(name):
+  # "from IrBaseUlcerDetectionLib import runProcessing" and the like, as when they were imported with the package
+  if not name.startswith("_"):
+    ProcessingEngine = importlib.import_module(__name__ + ".ProcessingEngine")
+    if hasattr(ProcessingEngine, name):
+      return getattr(ProcessingEngine, name)
+  raise AttributeError("module %r has no attribute %r" % (__name__, name))
@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+"""Offline benchmark of the IR-Base Ulcer Detection processing pipelines.
+
+Times the import of the library in fresh interpreters (what the module
+adds to Slicer startup, and to its first processing), then runs every
+runProcessing mode, mode switches of the incremental processing graph,
+the dual-foot segmentation and asymmetry map of runSegmentation,
+whole-stack processing and sequence streaming on synthetic thermograms,
+stage by stage, without Slicer or network access.
+Results are written as JSON; passing a previous result file as baseline
+reports the ratio of every timing and fails on regressions.
+
+  python IrBaseUlcerDetectionBenchmark.py --output baseline.json
+  python IrBaseUlcerDetectionBenchmark.py --baseline baseline.json --output current.json
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import time
+
+MODULE_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+sys.path.insert(0, MODULE_DIRECTORY)
+
+import numpy as np
+import SimpleITK as sitk
+
+from IrBaseUlcerDetectionLib import Asymmetry, FrameStream, ProcessingEngine, StackProcessing, StageGraph, SyntheticThermogram
+
+FORMAT_VERSION = 1
+
+# (case, statements, check run after them) of the import benchmark; Slicer
+# imports the package at startup, which must not load SimpleITK
+IMPORT_CASES = (
+  ("module startup", "import IrBaseUlcerDetectionLib\n"
+                     "from IrBaseUlcerDetectionLib.Instrumentation import Profiler\n"
+                     "sitk = IrBaseUlcerDetectionLib.lazyImport('SimpleITK')\n"
+                     "ProcessingEngine = IrBaseUlcerDetectionLib.lazyImport('IrBaseUlcerDetectionLib.ProcessingEngine')",
+   "assert 'SimpleITK.SimpleITK' not in sys.modules, 'SimpleITK is imported with the package'"),
+  ("first processing", "from IrBaseUlcerDetectionLib import ProcessingEngine, StageGraph", ""),
+  )
+
+IMPORT_SCRIPT = """
+import sys, time
+sys.path.insert(0, %r)
+start = time.perf_counter()
+%s
+seconds = time.perf_counter() - start
+%s
+print(seconds)
+"""
+
+
+class StageTimer(object):
+  """Engine observer accumulating the wall time of each stage"""
+
+  def __init__(self):
+    self.stages = {}
+    self.stage = None
+    self.start = None
+
+  def __call__(self, stage, progress):
+    now = time.perf_counter()
+    if self.stage not in (None, "done"):
+      self.stages[self.stage] = self.stages.get(self.stage, 0.0) + now - self.start
+    self.stage, self.start = stage, now
+
+
+def timeRun(run, repeat):
+  """Best of repeat runs of run(observer): (total seconds, stage seconds)"""
+  best = None
+  for iteration in range(repeat):
+    timer = StageTimer()
+    start = time.perf_counter()
+    run(timer)
+    total = time.perf_counter() - start
+    # steps such as the asymmetry map leave their stage open
+    timer("done", 1.0)
+    if best is None or total < best[0]:
+      best = (total, dict(timer.stages))
+  return best
+
+
+def benchmarkImports(repeat):
+  """Import times of the library, each in a new interpreter"""
+  for case, statements, check in IMPORT_CASES:
+    script = IMPORT_SCRIPT % (os.path.abspath(MODULE_DIRECTORY), statements, check)
+    seconds = min(float(subprocess.check_output([sys.executable, "-c", script]).decode().split()[-1]) for iteration in range(repeat))
+    yield "import", case, (), seconds, {}
+
+
+def benchmarkFrame(width, height, repeat):
+  image, seeds = SyntheticThermogram.footThermogram(width, height)
+  parameters = ProcessingEngine.ProcessingParameters(seeds=seeds[0:1])
+  for mode in ProcessingEngine.PROCESSING_MODES:
+    modeParameters = parameters.copy(mode=mode)
+    total, stages = timeRun(lambda observer: ProcessingEngine.runProcessing(image, modeParameters, observer=observer), repeat)
+    yield "runProcessing", mode, (width, height, 1), total, stages
+
+  # mode switches of an interactive session, from a graph that already ran "image segmentation"
+  for mode in ProcessingEngine.PROCESSING_MODES:
+    best = None
+    for iteration in range(repeat):
+      graph = StageGraph.ProcessingGraph()
+      graph.run(image, parameters, "frame")
+      switch = timeRun(lambda observer: graph.run(image, parameters.copy(mode=mode), "frame", observer=observer), 1)
+      best = switch if best is None or switch[0] < best[0] else best
+    yield "processingGraph", mode, (width, height, 1), best[0], best[1]
+
+  # whole frame without crops, by tiles as for panoramas and high resolution sensors
+  for tileSize in (None, 256):
+    tiledParameters = parameters.copy(mode=ProcessingEngine.MODE_CONTOURING, cropMargin=None, tileSize=tileSize)
+    total, stages = timeRun(lambda observer: ProcessingEngine.runProcessing(image, tiledParameters, observer=observer), repeat)
+    yield "runProcessing full frame", "%s px tiles" % tileSize if tileSize else "no tiles", (width, height, 1), total, stages
+
+  # smoothing backends alone, with what "auto" resolves to
+  for smoothing in ProcessingEngine.SMOOTHING_METHODS:
+    smoothingParameters = parameters.copy(smoothing=smoothing)
+    total, stages = timeRun(lambda observer: ProcessingEngine.smoothImage(image, smoothingParameters), repeat)
+    yield "smoothImage", smoothing, (width, height, 1), total, stages
+
+  # hole filling methods on a mask with holes, each compared with VotingBinaryHoleFilling over the whole frame
+  holeyImage, holeySeeds = SyntheticThermogram.footThermogram(width, height, coldSpots=20)
+  mask = ProcessingEngine.runProcessing(holeyImage, parameters.copy(seeds=holeySeeds, cropMargin=None)).mask
+
+  def wholeFrameVoting():
+    return sitk.VotingBinaryHoleFilling(image1=mask, radius=[parameters.holeRadius] * 2, majorityThreshold=1,
+                                        backgroundValue=0, foregroundValue=ProcessingEngine.FOREGROUND_LABEL)
+
+  reference = sitk.GetArrayFromImage(wholeFrameVoting())
+  total, stages = timeRun(lambda observer: wholeFrameVoting(), repeat)
+  yield "fillHoles", "voting, whole frame", (width, height, 1), total, stages
+  for holeFilling in ProcessingEngine.HOLE_FILLING_METHODS:
+    holeParameters = parameters.copy(holeFilling=holeFilling)
+    total, stages = timeRun(lambda observer: ProcessingEngine.fillHoles(mask, holeParameters), repeat)
+    filled = sitk.GetArrayFromImage(ProcessingEngine.fillHoles(mask, holeParameters))
+    yield "fillHoles", holeFilling, (width, height, 1), total, stages, {"pixelsDifferingFromVoting": int((filled != reference).sum())}
+
+  feetParameters = parameters.copy(seeds=seeds)
+  total, stages = timeRun(lambda observer: ProcessingEngine.segmentFeet(image, feetParameters, observer=observer), repeat)
+  yield "runSegmentation", "dual foot", (width, height, 1), total, stages
+
+  # contralateral map on the dual-foot result, for each transform
+  feet = ProcessingEngine.segmentFeet(image, feetParameters)
+  for transformType in Asymmetry.TRANSFORMS:
+    total, stages = timeRun(lambda observer: Asymmetry.asymmetryMap(feet.smoothed, feet.mask, transformType=transformType,
+                                                                    observer=observer), repeat)
+    yield "asymmetryMap", transformType, (width, height, 1), total, stages
+
+
+def benchmarkStack(width, height, frames, repeat, workers):
+  volume, seeds = SyntheticThermogram.thermogramStack(width, height, frames)
+  parameters = ProcessingEngine.ProcessingParameters(seeds=seeds)
+
+  stackParameters = parameters.copy(mode=ProcessingEngine.MODE_CONTOURING, seeds=seeds[0:1])
+  total, stages = timeRun(lambda observer: StackProcessing.processStack(volume, stackParameters, workers), repeat)
+  yield "processStack", ProcessingEngine.MODE_CONTOURING, (width, height, frames), total, stages
+
+  def stream(observer):
+    for frameResult in FrameStream.streamSegmentation(FrameStream.iterateSlices(volume), parameters):
+      pass
+  total, stages = timeRun(stream, repeat)
+  yield "streamSegmentation", "dual foot", (width, height, frames), total, stages
+
+
+def environment():
+  return {
+    "python": platform.python_version(),
+    "platform": platform.platform(),
+    "processor": platform.processor(),
+    "cpuCount": multiprocessing.cpu_count(),
+    "simpleitk": sitk.Version_VersionString(),
+    "numpy": np.__version__,
+    }
+
+
+def resultKey(result):
+  return "%s | %s | %s" % (result["pipeline"], result["mode"], "x".join(str(d) for d in result["size"]))
+
+
+def compare(results, baseline, tolerance):
+  """Print the timing ratios to baseline and return the keys that regressed"""
+  previous = dict((resultKey(result), result) for result in baseline["results"])
+  regressions = []
+  for result in results:
+    key = resultKey(result)
+    if key not in previous:
+      continue
+    ratio = result["total"] / max(previous[key]["total"], 1e-9)
+    flag = ""
+    if ratio > 1.0 + tolerance:
+      flag = "  REGRESSION"
+      regressions.append(key)
+    print("%-60s %8.4f s -> %8.4f s  x%.2f%s" % (key, previous[key]["total"], result["total"], ratio, flag))
+  return regressions
+
+
+def parseSize(text):
+  width, height = text.lower().split("x")
+  return int(width), int(height)
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument("--sizes", default=",".join("%dx%d" % size for size in SyntheticThermogram.FRAME_SIZES),
+                      help="comma separated frame sizes, WIDTHxHEIGHT")
+  parser.add_argument("--frames", type=int, default=8, help="frames of the stack and sequence benchmarks (0 to skip)")
+  parser.add_argument("--repeat", type=int, default=3, help="runs per case, the fastest is kept")
+  parser.add_argument("--workers", type=int, default=None, help="workers of the stack benchmark")
+  parser.add_argument("--output", help="JSON file to write the results to")
+  parser.add_argument("--baseline", help="JSON results of a previous run to compare with")
+  parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown before a case counts as a regression")
+  args = parser.parse_args(argv)
+
+  def cases():
+    for case in benchmarkImports(args.repeat):
+      yield case
+    for width, height in (parseSize(size) for size in args.sizes.split(",")):
+      for case in benchmarkFrame(width, height, args.repeat):
+        yield case
+      if args.frames:
+        for case in benchmarkStack(width, height, args.frames, args.repeat, args.workers):
+          yield case
+
+  results = []
+  for case in cases():
+    # cases may add values other than timings, e.g. how far a faster method is from the reference
+    pipeline, mode, size, total, stages = case[0:5]
+    extra = case[5] if len(case) > 5 else {}
+    result = {"pipeline": pipeline, "mode": mode, "size": list(size), "total": total, "stages": stages}
+    result.update(extra)
+    results.append(result)
+    print("%-60s %8.4f s  %s" % (resultKey(result), total,
+                                 ", ".join(["%s %.4f" % item for item in sorted(stages.items())] +
+                                           ["%s %s" % item for item in sorted(extra.items())])))
+
+  report = {"version": FORMAT_VERSION, "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "environment": environment(), "repeat": args.repeat, "results": results}
+  if args.output:
+    with open(args.output, "w") as outputFile:
+      json.dump(report, outputFile, indent=2, sort_keys=True)
+
+  if args.baseline:
+    with open(args.baseline) as baselineFile:
+      baseline = json.load(baselineFile)
+    print("")
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+      print("%d case(s) slower than baseline by more than %d%%" % (len(regressions), args.tolerance * 100))
+      return 1
+  return 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())